@@ -1,17 +1,41 @@
+import os
+import json
+import hashlib
 import requests
 from graphql import get_introspection_query
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+
+# Layout version of the schema cache file, a cache written by another version is fetched again
+SCHEMA_CACHE_VERSION = 1
+
 
 class WorldsAPIDiscovery:
-    def __init__(self, api_url, token_id, token_value):
+    def __init__(self, api_url, token_id, token_value, schema_cache=None, refresh=False, schema=None):
+        """Use `schema`, or the `schema_cache` file, or introspect the API (and save it to the cache)."""
         self.api_url = api_url
         self.headers = {
             "x-token-id": token_id,
             "x-token-value": token_value,
             "Content-Type": "application/json"
         }
-        self.schema = self._fetch_schema()
-        self.type_map = {t["name"]: t for t in self.schema["types"]}
+        self.schema_cache = schema_cache
+        if schema is None and schema_cache and not refresh:
+            schema = self._read_schema_cache()
+        if schema is None:
+            schema = self._fetch_schema()
+            if schema_cache:
+                self._write_schema_cache(schema)
+        self._set_schema(schema)
+
+    @classmethod
+    def from_schema_file(cls, path):
+        """Offline instance from a schema cache file or a saved introspection response."""
+        with open(path) as f:
+            data = json.load(f)
+        schema = data.get("schema") or (data.get("data") or data).get("__schema")
+        if not schema:
+            raise RuntimeError(f"{path} holds no introspection schema")
+        return cls(data.get("api_url"), None, None, schema=schema)
 
     def _fetch_schema(self):
         query = {"query": get_introspection_query()}
@@ -21,46 +45,171 @@ class WorldsAPIDiscovery:
             raise RuntimeError(f"Introspection failed, response: {data}")
         return data["data"]["__schema"]
 
+    def refresh_schema(self):
+        """Introspect the API again, return True when the schema changed."""
+        previous = self.schema_sha256
+        schema = self._fetch_schema()
+        if self.schema_cache:
+            self._write_schema_cache(schema)
+        self._set_schema(schema)
+        return self.schema_sha256 != previous
+
+    def _set_schema(self, schema):
+        self.schema = schema
+        self.schema_sha256 = self._schema_digest(schema)
+        self.type_map = {t["name"]: t for t in self.schema["types"]}
+        self._expansions = {}
+
+    @staticmethod
+    def _schema_digest(schema):
+        return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+    def _read_schema_cache(self):
+        try:
+            with open(self.schema_cache) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != SCHEMA_CACHE_VERSION or cached.get("api_url") != self.api_url:
+            return None
+        return cached.get("schema")
+
+    def _write_schema_cache(self, schema):
+        cached = {
+            "version": SCHEMA_CACHE_VERSION,
+            "api_url": self.api_url,
+            "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "sha256": self._schema_digest(schema),
+            "schema": schema,
+        }
+        directory = os.path.dirname(os.path.abspath(self.schema_cache))
+        os.makedirs(directory, exist_ok=True)
+        temp = f"{self.schema_cache}.{os.getpid()}.tmp"
+        with open(temp, "w") as f:
+            json.dump(cached, f)
+        os.replace(temp, self.schema_cache)
+
     def get_type(self, type_name):
         return self.type_map.get(type_name)
 
     def list_fields_recursive(self, type_name, _visited=None, max_depth=5):
-        """Return all fields recursively but safely."""
-        if _visited is None:
-            _visited = set()
-
-        if type_name in _visited or max_depth <= 0:
+        """Return all fields recursively, memoized per (type, depth)."""
+        if _visited and type_name in _visited:
             return {}
+        return self._expand(type_name, max_depth)
 
-        type_obj = self.get_type(type_name)
-        if not type_obj or "fields" not in type_obj:
-            return {}
+    def _expand(self, type_name, depth):
+        key = (type_name, depth)
+        if key in self._expansions:
+            return self._expansions[key]
 
-        _visited.add(type_name)
         fields = {}
+        if depth > 0:
+            for name, nested_type in self._field_targets(type_name):
+                # Scalars and enums, objects need subselection and are dropped when none is left
+                if nested_type is None:
+                    fields[name] = {}
+                    continue
+                nested = self._expand(nested_type, depth - 1)
+                # Back references to the parent (Detection.track under Track) are not expanded again
+                back = self._back_references(nested_type, type_name)
+                if back and not back.isdisjoint(nested):
+                    nested = {n: sub for n, sub in nested.items() if n not in back}
+                if nested:
+                    fields[name] = nested
+        self._expansions[key] = fields
+        return fields
 
-        for f in type_obj["fields"]:
-            f_type = f["type"]
-            # Unwrap NonNull or List
-            while f_type.get("ofType"):
-                f_type = f_type["ofType"]
-
-            nested_type = f_type.get("name")
-            kind = f_type.get("kind")
-
-            # Scalars and enums
-            if kind in ["SCALAR", "ENUM"]:
-                fields[f["name"]] = {}
-            # Objects need subselection
-            elif kind in ["OBJECT", "INTERFACE"] and self.get_type(nested_type):
-                fields[f["name"]] = self.list_fields_recursive(
-                    nested_type, _visited.copy(), max_depth - 1
-                )
-            # Lists of scalars? just include
+    def _field_targets(self, type_name):
+        """Return (field name, object type or None) of every field of `type_name`."""
+        key = (type_name, "fields")
+        if key not in self._expansions:
+            type_obj = self.get_type(type_name)
+            targets = []
+            for f in (type_obj or {}).get("fields") or []:
+                nested_type, kind = self._unwrap(f["type"])
+                is_object = kind in ["OBJECT", "INTERFACE"] and self.get_type(nested_type)
+                targets.append((f["name"], nested_type if is_object else None))
+            self._expansions[key] = targets
+        return self._expansions[key]
+
+    def _back_references(self, type_name, parent_type):
+        """Return the names of the fields of `type_name` whose type is `parent_type`."""
+        key = (type_name, "back", parent_type)
+        if key not in self._expansions:
+            self._expansions[key] = {n for n, t in self._field_targets(type_name) if t == parent_type}
+        return self._expansions[key]
+
+    @staticmethod
+    def _unwrap(type_ref):
+        while type_ref.get("ofType"):
+            type_ref = type_ref["ofType"]
+        return type_ref.get("name"), type_ref.get("kind")
+
+    @staticmethod
+    def _type_string(type_ref):
+        if type_ref["kind"] == "NON_NULL":
+            return WorldsAPIDiscovery._type_string(type_ref["ofType"]) + "!"
+        if type_ref["kind"] == "LIST":
+            return "[" + WorldsAPIDiscovery._type_string(type_ref["ofType"]) + "]"
+        return type_ref["name"]
+
+    def narrow_selection(self, type_name, wanted, path=""):
+        """Return the selection of `wanted` the schema supports on `type_name`, and notes."""
+        type_obj = self.get_type(type_name)
+        fields_by_name = {f["name"]: f for f in (type_obj or {}).get("fields") or []}
+        fields, notes = {}, []
+
+        for name, sub in wanted.items():
+            field = fields_by_name.get(name)
+            if field is None:
+                notes.append(f"{path}{name}: not a field of {type_name}, skipped")
+                continue
+            if field.get("args"):
+                args = ", ".join(a["name"] for a in field["args"])
+                notes.append(f"{path}{name}: accepts ({args}), not limited since every item is consumed")
+
+            nested_type, kind = self._unwrap(field["type"])
+            if kind in ["OBJECT", "INTERFACE"]:
+                if not sub:
+                    notes.append(f"{path}{name}: {nested_type} needs a subselection, selecting its scalars")
+                    sub = {f["name"]: {} for f in self.get_type(nested_type)["fields"]
+                           if self._unwrap(f["type"])[1] in ["SCALAR", "ENUM"]}
+                fields[name], nested_notes = self.narrow_selection(nested_type, sub, f"{path}{name}.")
+                notes.extend(nested_notes)
             else:
-                fields[f["name"]] = {}
-
-        return fields
+                if sub:
+                    notes.append(f"{path}{name}: {kind.lower()} {nested_type} has no subfields, "
+                                 f"returned whole for {', '.join(sub)}")
+                fields[name] = {}
+        return fields, notes
+
+    def root_field(self, operation, field_name):
+        """Return the field `field_name` of the `operation` root type."""
+        root_ref = self.schema.get(f"{operation}Type")
+        if not root_ref:
+            raise RuntimeError(f"The schema has no {operation} type")
+        root = self.get_type(root_ref["name"])
+        field = next((f for f in root["fields"] if f["name"] == field_name), None)
+        if field is None:
+            raise RuntimeError(f"{field_name} is not a {operation} field")
+        return field
+
+    def build_query_selection(self, operation_name, field_name, wanted, variables=None, operation="query"):
+        """Return an `operation` of `field_name` selecting `wanted` (None: every field), and notes."""
+        field = self.root_field(operation, field_name)
+        if variables is None:
+            variables = {a["name"]: self._type_string(a["type"]) for a in field["args"]}
+        field_type = self._unwrap(field["type"])[0]
+        if wanted is None:
+            fields_dict, notes = self.list_fields_recursive(field_type), []
+        else:
+            fields_dict, notes = self.narrow_selection(field_type, wanted, f"{field_name}.")
+        field_str = self._build_field_string(fields_dict)
+        var_def = self._build_variable_definitions(variables)
+        var_use = f"({self._build_variable_usage(variables)})" if variables else ""
+        query = f"{operation} {operation_name}{var_def} {{\n  {field_name}{var_use} {{\n{field_str}\n  }}\n}}\n"
+        return query, notes
 
     def build_query_all_fields(self, query_name, type_name, variables=None):
         fields_dict = self.list_fields_recursive(type_name)
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+
+from dotenv import load_dotenv
+
+from discovery import WorldsAPIDiscovery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from track_aggregation import TRACK_NODE_FIELDS  # noqa: E402
+
+# Writes the queries/*.graphql documents from the (cached) API schema, files that exist are kept unless --force
+#
+#   python generate_queries.py                   # cached schema, fetched on first use
+#   python generate_queries.py --refresh         # introspect the API again
+#   python generate_queries.py --schema schema.json --only tracksSummary --force
+load_dotenv()
+SCHEMA_CACHE = os.getenv("WORLDS_SCHEMA_CACHE", os.path.join(ROOT, "APIDiscovery", ".schema_cache.json"))
+
+PAGE_INFO = {"hasNextPage": {}, "endCursor": {}}
+DATA_SOURCE = {"id": {}, "name": {}}
+
+# file name -> operation, root field, variables and selection (None selects every field)
+QUERY_SPECS = {
+    "tracks": {
+        "operation": "query",
+        "field": "tracks",
+        "variables": {"filter": "FilterTrackInput!", "first": "Int!", "after": "String"},
+        "selection": {
+            "edges": {"node": {
+                "id": {},
+                "dataSource": DATA_SOURCE,
+                "video": {"thumbnailUrl": {}},
+                "tag": {},
+                "startTime": {},
+                "endTime": {},
+                "detections": {"metadata": {}, "timestamp": {}, "zones": {"name": {}}},
+            }},
+            "pageInfo": PAGE_INFO,
+        },
+    },
+    # The tracks query narrowed to the track fields the aggregation reads, paged like tracks
+    "tracksSummary": {
+        "operation": "query",
+        "field": "tracks",
+        "variables": {"filter": "FilterTrackInput!", "first": "Int!", "after": "String"},
+        "selection": {"edges": {"node": TRACK_NODE_FIELDS}, "pageInfo": PAGE_INFO},
+    },
+    "devices": {
+        "operation": "query",
+        "field": "devices",
+        "variables": {"filter": "FilterDeviceInput!", "first": "Int!", "after": "String"},
+        "selection": {"edges": {"node": {"address": {}, "dataSource": DATA_SOURCE}}, "pageInfo": PAGE_INFO},
+    },
+    "detectionActivity": {
+        "operation": "subscription",
+        "field": "detectionActivity",
+        "variables": {"filter": "FilterDetectionActivityInput"},
+        "selection": {"track": {"dataSource": DATA_SOURCE, "tag": {}}, "timestamp": {}},
+    },
+    "createEvent": {
+        "operation": "mutation",
+        "field": "createEvent",
+        "variables": {"event": "CreateEventInput!"},
+        "selection": {name: {} for name in
+                      ("id", "type", "subType", "startTime", "endTime", "draft", "priority", "metadata")},
+    },
+}
+
+
+def generate(helper: WorldsAPIDiscovery, names, out_dir, force=False):
+    written = []
+    for name in names:
+        spec = QUERY_SPECS[name]
+        path = os.path.join(out_dir, f"{name}.graphql")
+        # Documents may be edited by hand (tracks.graphql pages with $after), never overwrite them silently
+        if os.path.exists(path) and not force:
+            print(f"{name}: {path} exists, skipped (--force overwrites it)")
+            continue
+        try:
+            query, notes = helper.build_query_selection(name, spec["field"], spec["selection"], spec["variables"],
+                                                        operation=spec["operation"])
+        except RuntimeError as e:
+            print(f"{name}: not generated, {e}")
+            continue
+        with open(path, "w") as f:
+            f.write(query)
+        written.append(path)
+        for note in notes:
+            print(f"{name}: note: {note}")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the queries/*.graphql documents from the API schema")
+    parser.add_argument("--schema", help="saved schema or introspection response, no network access")
+    parser.add_argument("--refresh", action="store_true", help="introspect the API again and update the cache")
+    parser.add_argument("--force", action="store_true", help="overwrite documents that already exist")
+    parser.add_argument("--only", nargs="+", choices=sorted(QUERY_SPECS), help="generate these documents only")
+    parser.add_argument("--out", default=os.path.join(ROOT, "queries"))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.schema:
+        helper = WorldsAPIDiscovery.from_schema_file(args.schema)
+    else:
+        helper = WorldsAPIDiscovery(os.getenv("WORLDS_API_URL"), os.getenv("WORLDS_TOKEN_ID"),
+                                    os.getenv("WORLDS_TOKEN_VALUE"), schema_cache=SCHEMA_CACHE, refresh=args.refresh)
+    loaded = time.perf_counter()
+    written = generate(helper, args.only or list(QUERY_SPECS), args.out, args.force)
+    print(f"Wrote {len(written)} documents to {args.out} in {(time.perf_counter() - loaded) * 1000:.1f} ms "
+          f"(schema {helper.schema_sha256[:12]} loaded in {(loaded - started) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ api_url = os.getenv("WORLDS_API_URL")
 token_id = os.getenv("WORLDS_TOKEN_ID")
 token_value = os.getenv("WORLDS_TOKEN_VALUE")
 
-helper = WorldsAPIDiscovery(api_url, token_id, token_value)
+# introspected once, then read from WORLDS_SCHEMA_CACHE (see generate_queries.py)
+helper = WorldsAPIDiscovery(api_url, token_id, token_value, schema_cache=os.getenv("WORLDS_SCHEMA_CACHE"))
 
 # Variables example for a 24h time window
 
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+from worlds_api_client import WorldsAPIClient
+from track_aggregation import TrackAggregator, parse_timestamp
+from track_fetcher import TRACKS_QUERY, TrackPageFetcher
+from devices import get_devices_list
+from db.crud import get_completed_windows, store_backfill_window
+from metrics import AGGREGATION_FAILURES, record_aggregation
+
+logger = logging.getLogger(__name__)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "8"))
+# Requests per second shared by every worker of a backfill, 0 disables the budget
+BACKFILL_RATE = float(os.getenv("BACKFILL_RATE", "20"))
+BACKFILL_WINDOW_MINUTES = int(os.getenv("BACKFILL_WINDOW_MINUTES", "60"))
+
+
+# Token bucket shared by threads: `rate` tokens per second, at most `burst` saved up.
+# acquire() blocks until a token is available.
+class RateBudget:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# WorldsAPIClient whose requests draw from a RateBudget. Retries draw again, responses
+# served by the response cache never reach _post and cost nothing.
+class BudgetedWorldsAPIClient(WorldsAPIClient):
+    def __init__(self, budget: RateBudget, **kwargs):
+        super().__init__(**kwargs)
+        self.budget = budget
+        self.requests = 0
+
+    def _post(self, *args, **kwargs) -> dict:
+        self.budget.acquire()
+        self.requests += 1
+        return super()._post(*args, **kwargs)
+
+
+def parse_time(value: str) -> datetime:
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"not an ISO-8601 date or time: {value!r}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+# [start, end) windows of `minutes` aligned on multiples of the window length since the
+# epoch (so the hour windows start on the hour), covering start..end. Windows that have
+# not ended yet are left out, they are still the live service's job.
+def aligned_windows(start: datetime, end: datetime, minutes: int,
+                    now: Optional[datetime] = None) -> Iterator[tuple[datetime, datetime]]:
+    step = timedelta(minutes=minutes)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    end = min(end, now or datetime.now(timezone.utc))
+    window_start = epoch + ((start - epoch) // step) * step
+    while window_start + step <= end:
+        yield window_start, window_start + step
+        window_start += step
+
+
+# Aggregates one device and window and stores the result with the window's end as its
+# timestamp, like the live service does at the end of the same hour. A fetch error is
+# raised instead of storing a partial window, the window stays unchecked and is retried
+# by the next run.
+def backfill_window(client: WorldsAPIClient, device_id: str, window_start: datetime, window_end: datetime,
+                    max_tracks: int = 5) -> int:
+    started = time.perf_counter()
+    fetcher = TrackPageFetcher(client, TRACKS_QUERY, prefetch=1)
+    aggregator = TrackAggregator(device_id, window_end.isoformat(timespec="seconds"), max_tracks)
+    try:
+        for nodes in fetcher.iter_page_nodes(device_id, window_start, window_end):
+            aggregator.add_nodes(nodes)
+    except Exception:
+        AGGREGATION_FAILURES.labels("backfill").inc()
+        raise
+    record_aggregation("backfill", started, fetcher.pages, aggregator.tracks)
+    store_backfill_window(device_id, window_start, window_end, aggregator.result(), aggregator.tracks)
+    return aggregator.tracks
+
+
+# Runs every (device, window) pair not checkpointed yet on a pool of `workers` threads.
+# Returns the number of windows that failed.
+def backfill(client: WorldsAPIClient, device_ids: list[str], start: datetime, end: datetime,
+             minutes: int = BACKFILL_WINDOW_MINUTES, workers: int = BACKFILL_WORKERS, max_tracks: int = 5,
+             redo: bool = False) -> int:
+    windows = list(aligned_windows(start, end, minutes))
+    if not windows or not device_ids:
+        logger.warning("Nothing to backfill: no device or no complete window in the range.")
+        return 0
+
+    done = set() if redo else get_completed_windows(device_ids, windows[0][0], windows[-1][1])
+    # Oldest windows first, so an interrupted run leaves a contiguous history behind
+    pending = [(device_id, ws, we) for ws, we in windows for device_id in device_ids if (device_id, ws) not in done]
+    total = len(windows) * len(device_ids)
+    logger.info(f"Backfilling {len(pending)} of {total} windows ({total - len(pending)} already done) "
+                f"for {len(device_ids)} devices, {windows[0][0].isoformat()} to {windows[-1][1].isoformat()}, "
+                f"{workers} workers")
+    if not pending:
+        return 0
+
+    started = time.perf_counter()
+    completed = failed = tracks = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending))), thread_name_prefix="backfill")
+    try:
+        futures = {pool.submit(backfill_window, client, device_id, ws, we, max_tracks): (device_id, ws)
+                   for device_id, ws, we in pending}
+        for future in as_completed(futures):
+            device_id, window_start = futures[future]
+            try:
+                tracks += future.result()
+                completed += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Backfill of {device_id} at {window_start.isoformat()} failed: {e}")
+            finished = completed + failed
+            if finished % 50 == 0 or finished == len(pending):
+                elapsed = time.perf_counter() - started
+                logger.info(f"{finished}/{len(pending)} windows ({failed} failed), {tracks} tracks "
+                            f"in {elapsed:.1f}s, {finished / elapsed:.1f} windows/s")
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted after {completed} windows, completed windows are kept and skipped next time.")
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+
+    logger.info(f"Backfilled {completed}/{len(pending)} windows, {tracks} tracks, {failed} failed, "
+                f"in {time.perf_counter() - started:.1f}s")
+    return failed
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-aggregate past tracks window by window into the dashboard tables")
+    parser.add_argument("--devices", nargs="+", default=["all"],
+                        help="data source ids, or 'all' for every device of the API (default)")
+    parser.add_argument("--start", type=parse_time, required=True, help="ISO-8601 start, UTC unless an offset is given")
+    parser.add_argument("--end", type=parse_time, default=datetime.now(timezone.utc),
+                        help="ISO-8601 end (default: now), only windows that ended are aggregated")
+    parser.add_argument("--window-minutes", type=int, default=BACKFILL_WINDOW_MINUTES)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE,
+                        help="API requests per second across all workers, 0 for no limit")
+    parser.add_argument("--max-tracks", type=int, default=5)
+    parser.add_argument("--redo", action="store_true", help="aggregate checkpointed windows again")
+    args = parser.parse_args(argv)
+
+    client = BudgetedWorldsAPIClient(RateBudget(args.rate))
+    try:
+        device_ids = args.devices
+        if device_ids == ["all"]:
+            device_ids = [d["id"] for d in get_devices_list(client) if d.get("id")]
+        failed = backfill(client, device_ids, args.start, args.end, minutes=args.window_minutes,
+                          workers=args.workers, max_tracks=args.max_tracks, redo=args.redo)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        logger.info(f"{client.requests} API requests made.")
+        client.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,82 @@
+import os
 import time
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from worlds_api_client import WorldsAPIClient
-from db.crud import store_tags_series, store_top_tracks, store_zones, save_devices
+from typing import Optional
+from worlds_api_client import AsyncWorldsAPIClient, WorldsAPIClient
+from devices import get_devices_list, get_devices_list_async
+from track_aggregation import TrackAggregator, parse_track
+from track_store import TrackStore, start_track_store_server
+from track_fetcher import TRACKS_QUERY, TrackPageFetcher, tracks_variables
+from track_window import TrackWindow
+from db.crud import store_aggregation_results, save_devices
+from metrics import (
+    AGGREGATION_FAILURES, TRACK_STORE_BYTES, TRACK_STORE_TRACKS, TRACKS_PER_PAGE, record_aggregation,
+    start_metrics_server,
+)
 
 logger = logging.getLogger(__name__)
 
 # Configure logging for the daemon
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# "single" keeps the original Bourbon Street only behaviour,
+# "pool" fans aggregation out across every saved device.
+AGGREGATION_MODE = os.getenv("AGGREGATION_MODE", "single")
+AGGREGATION_WORKERS = int(os.getenv("AGGREGATION_WORKERS", "8"))
+AGGREGATION_INTERVAL = int(os.getenv("AGGREGATION_INTERVAL", "3600"))  # seconds
+# Incremental mode keeps a rolling window per device and refreshes it every INCREMENTAL_INTERVAL
+AGGREGATION_INCREMENTAL = os.getenv("AGGREGATION_INCREMENTAL", "false").lower() in ("1", "true", "yes")
+INCREMENTAL_INTERVAL = int(os.getenv("INCREMENTAL_INTERVAL", "60"))  # seconds
+# The device list is fetched again this often, new cameras are picked up without a restart
+DEVICES_REFRESH_INTERVAL = int(os.getenv("DEVICES_REFRESH_INTERVAL", "3600"))  # seconds
+# Track window is split into this many sub-intervals fetched concurrently,
+# each one paging up to TRACKS_PREFETCH_PAGES ahead of the aggregation.
+TRACKS_FETCH_SLICES = int(os.getenv("TRACKS_FETCH_SLICES", "1"))
+TRACKS_PREFETCH_PAGES = int(os.getenv("TRACKS_PREFETCH_PAGES", "2"))
+# Keep the last TRACK_STORE_HOURS of fetched tracks per device in memory (track_store.py) for
+# rollups the aggregation does not compute, at most TRACK_STORE_CAPACITY tracks per device. 0 disables it
+TRACK_STORE_HOURS = float(os.getenv("TRACK_STORE_HOURS", "0"))
+TRACK_STORE_CAPACITY = int(os.getenv("TRACK_STORE_CAPACITY", "200000"))
+# Port of the store's query endpoints (/rollup, /top, /histogram, /devices), 0 disables them
+TRACK_STORE_PORT = int(os.getenv("TRACK_STORE_PORT", "9101"))
+
+TRACK_STORE = TrackStore(TRACK_STORE_HOURS, TRACK_STORE_CAPACITY) if TRACK_STORE_HOURS > 0 else None
+if TRACK_STORE is not None:
+    TRACK_STORE_BYTES.set_function(TRACK_STORE.nbytes)
+    TRACK_STORE_TRACKS.set_function(TRACK_STORE.tracks)
+
+
+def serve_track_store():
+    if TRACK_STORE is not None and TRACK_STORE_PORT > 0:
+        start_track_store_server(TRACK_STORE, TRACK_STORE_PORT)
+
+
+# Stores {device_id: result} for one or many devices in a single transaction
+def persist_aggregations(results: dict):
+    if not results:
+        return
+    try:
+        store_aggregation_results(results)
+    except Exception as e:
+        logger.error(f"Failed to store aggregated data for {', '.join(results)}: {e}", exc_info=True)
+
+
+def persist_aggregation(data_source_id: str, result: dict):
+    persist_aggregations({data_source_id: result})
+
+
+# Aggregates one page of track nodes and keeps them in TRACK_STORE
+def add_page(aggregator: TrackAggregator, data_source_id: str, nodes: list[dict]):
+    if TRACK_STORE is not None:
+        TRACK_STORE.add_nodes(data_source_id, nodes)
+    aggregator.add_nodes(nodes)
+
 
 # Main aggregation function for backend.
-# Consumes tracks over the last hour, loops through paginated response.
+# Consumes tracks over the last hour, streams the paginated response page by page.
 # Aggregates the data to compute:
 # 1) top 5 longest tracks by time
 # 2) tag -> count over the last hour
@@ -19,143 +84,187 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 #
 # #2 (tags) are accumulated over time
 # #1 and #3 replaced for each time window
-def aggregate_tracks(client: WorldsAPIClient, data_source_id: str, minutes: int = 60, max_tracks: int = 5):
+def aggregate_tracks(client: WorldsAPIClient, data_source_id: str, minutes: int = 60, max_tracks: int = 5,
+                     persist: bool = True):
+    started = time.perf_counter()
     end_time = datetime.now(timezone.utc)
     start_time = end_time - timedelta(minutes=minutes)
+    fetcher = TrackPageFetcher(client, TRACKS_QUERY, slices=TRACKS_FETCH_SLICES, prefetch=TRACKS_PREFETCH_PAGES)
 
-    variables = client.get_default_variables()
-    variables["filter"] = {
-        "dataSourceId": {"eq": data_source_id},
-        "time": {
-            "between": [
-                start_time.isoformat(timespec="milliseconds"),
-                end_time.isoformat(timespec="milliseconds"),
-            ]
-        },
-    }
-
-    base_record = {
-        "device_id": data_source_id,
-        "timestamp": end_time.isoformat(timespec="seconds")
-    }
-
-    # Aggregated return data placeholders
-    tag_counts = {}
-    track_details = {}
-    all_zones = set()
-
-    after_cursor = None
-    seen_cursors = set()
-
-    while True:
-        if after_cursor:
-            variables["after"] = after_cursor
+    aggregator = TrackAggregator(data_source_id, end_time.isoformat(timespec="seconds"), max_tracks)
+    try:
+        for nodes in fetcher.iter_page_nodes(data_source_id, start_time, end_time):
+            add_page(aggregator, data_source_id, nodes)
+    except Exception as e:
+        AGGREGATION_FAILURES.labels("full").inc()
+        logger.error(f"Failed to fetch tracks for {data_source_id}: {e}", exc_info=True)
+
+    result = aggregator.result()
+    record_aggregation("full", started, fetcher.pages, aggregator.tracks)
+    if persist:
+        persist_aggregation(data_source_id, result)
+    return result
+
+
+# Incremental variant of aggregate_tracks.
+# Only fetches tracks newer than the window watermark, merges them into the per-minute
+# buckets and expires the buckets that left the window, so it can run every minute
+# for roughly the API cost of one minute of tracks.
+def aggregate_tracks_incremental(client: WorldsAPIClient, window: TrackWindow, persist: bool = True):
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    start_time, end_time = window.fetch_range(now)
+    fetcher = TrackPageFetcher(client, TRACKS_QUERY, prefetch=TRACKS_PREFETCH_PAGES)
+
+    # The watermark only moves once every page of this cycle has been merged,
+    # a failed fetch is retried from the old watermark next cycle.
+    fetched = 0
+    latest_end = None
+    try:
+        for nodes in fetcher.iter_page_nodes(window.device_id, start_time, end_time):
+            if TRACK_STORE is not None:
+                TRACK_STORE.add_nodes(window.device_id, nodes)
+            for node in nodes:
+                track = parse_track(node)
+                window.add(track, now)
+                if track["end"] and (latest_end is None or track["end"] > latest_end):
+                    latest_end = track["end"]
+                fetched += 1
+    except Exception as e:
+        AGGREGATION_FAILURES.labels("incremental").inc()
+        logger.error(f"Failed to fetch tracks for {window.device_id}: {e}", exc_info=True)
+        latest_end = None
+    window.advance(latest_end)
+    window.expire(now)
+    logger.info(f"Merged {fetched} tracks since {start_time.isoformat(timespec='seconds')} for {window.device_id}")
+
+    result = window.result(now.isoformat(timespec="seconds"))
+    record_aggregation("incremental", started, fetcher.pages, fetched)
+    if persist:
+        persist_aggregation(window.device_id, result)
+    return result
+
+
+# asyncio variant of aggregate_tracks, used when the services share one event loop.
+# Pages are prefetched by AsyncWorldsAPIClient.iter_pages and the DB writes run in a worker thread.
+async def aggregate_tracks_async(client: AsyncWorldsAPIClient, data_source_id: str, minutes: int = 60,
+                                 max_tracks: int = 5, persist: bool = True):
+    started = time.perf_counter()
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(minutes=minutes)
+    variables = tracks_variables(client, data_source_id, start_time, end_time)
 
-        try:
-            page = client.execute_query("tracks", variables)
+    aggregator = TrackAggregator(data_source_id, end_time.isoformat(timespec="seconds"), max_tracks)
+    pages = 0
+    try:
+        async for page in client.iter_pages(TRACKS_QUERY, variables):
             nodes = client.extract_nodes(page)
-        except Exception as e:
-            logger.error(f"Failed to fetch tracks for {data_source_id}: {e}", exc_info=True)
-            break
-
-        for node in nodes:
-            tag = node.get("tag", "unknown")
-            track_id = node.get("id")
-            start = node.get("startTime")
-            end = node.get("endTime")
-            detections = node.get("detections", [])
-            video = node.get("video", {})
-            thumbnail = video.get("thumbnailUrl")
-
-            # Calculate track length
+            pages += 1
+            TRACKS_PER_PAGE.observe(len(nodes))
+            add_page(aggregator, data_source_id, nodes)
+    except Exception as e:
+        AGGREGATION_FAILURES.labels("async").inc()
+        logger.error(f"Failed to fetch tracks for {data_source_id}: {e}", exc_info=True)
+
+    result = aggregator.result()
+    record_aggregation("async", started, pages, aggregator.tracks)
+    if persist:
+        await asyncio.to_thread(persist_aggregation, data_source_id, result)
+    return result
+
+
+def _timed_aggregate(client: WorldsAPIClient, device_id: str, minutes: int, max_tracks: int,
+                     window: Optional[TrackWindow] = None):
+    started = time.perf_counter()
+    if window is not None:
+        result = aggregate_tracks_incremental(client, window, persist=False)
+    else:
+        result = aggregate_tracks(client, device_id, minutes=minutes, max_tracks=max_tracks, persist=False)
+    return result, time.perf_counter() - started
+
+
+# Worker-pool aggregation over many devices.
+# Each device runs in its own worker so a cycle takes as long as the slowest device,
+# not the sum of all of them. A failing device is logged and skipped, the others still finish.
+# The results of all devices are committed together once the cycle is done.
+# Passing `windows` switches every device to incremental aggregation over its TrackWindow.
+def aggregate_devices(client: WorldsAPIClient, device_ids: list[str], minutes: int = 60,
+                      max_tracks: int = 5, max_workers: int = AGGREGATION_WORKERS,
+                      windows: Optional[dict[str, TrackWindow]] = None) -> dict:
+    results = {}
+    if not device_ids:
+        return results
+
+    if windows is not None:
+        for device_id in device_ids:
+            if device_id not in windows:
+                windows[device_id] = TrackWindow(device_id, minutes=minutes, max_tracks=max_tracks)
+
+    workers = max(1, min(max_workers, len(device_ids)))
+    cycle_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aggregate") as pool:
+        futures = {
+            pool.submit(_timed_aggregate, client, device_id, minutes, max_tracks,
+                        windows.get(device_id) if windows is not None else None): device_id
+            for device_id in device_ids
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
             try:
-                start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
-                end_dt = datetime.fromisoformat(end.replace("Z", "+00:00"))
-                length_sec = (end_dt - start_dt).total_seconds()
-            except Exception:
-                length_sec = 0.0
-
-            # Get average confidence for the track
-            conf_vals = [
-                d.get("metadata", {}).get("track_confidence")
-                for d in detections
-                if d.get("metadata", {}).get("track_confidence") is not None
-            ]
-            avg_conf = sum(conf_vals) / len(conf_vals) if conf_vals else None
-
-            # Extract zones from detections
-            zones = {z["name"] for d in detections for z in d.get("zones", []) if z.get("name")}
-            all_zones.update(zones)
-
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
-            # Build Top Tracks record
-            track_details[track_id] = {
-                "id": track_id,
-                "device_id": data_source_id,
-                "timestamp": base_record["timestamp"],
-                "length": length_sec,
-                "detections": len(detections),
-                "tag": tag,
-                "thumbnail_url": thumbnail,
-                "track_confidence_average": avg_conf,
-                "zones": list(zones),
-            }
-
-        # Pagination Voodoo
-        page_info = None
-        for v in page.get("data", {}).values():
-            page_info = v.get("pageInfo")
-            break
-
-        if not page_info or not page_info.get("hasNextPage"):
-            break
-
-        end_cursor = page_info.get("endCursor")
-        if not end_cursor or end_cursor in seen_cursors:
-            break
-
-        seen_cursors.add(end_cursor)
-        after_cursor = end_cursor
-
-    # Prepare records to store into DB
-    tags_output = {**base_record, "tags": [{"tag": t, "count": c} for t, c in tag_counts.items()]}
-    sorted_tracks = sorted(track_details.values(), key=lambda x: x["length"], reverse=True)[:max_tracks]
-    zones_output = {**base_record, "zones": list(all_zones)}
-
-    # Persist to DB
+                result, elapsed = future.result()
+                results[device_id] = result
+                logger.info(f"Aggregated device {device_id} in {elapsed:.2f}s")
+            except Exception as e:
+                logger.error(f"Aggregation failed for device {device_id}: {e}", exc_info=True)
+
+    persist_aggregations(results)
+    logger.info(
+        f"Aggregated {len(results)}/{len(device_ids)} devices in "
+        f"{time.perf_counter() - cycle_started:.2f}s using {workers} workers"
+    )
+    return results
+
+
+# Fetches and saves the device list again, keeps the previous one if that fails or comes back empty
+def refresh_devices(client: WorldsAPIClient, devices: list[dict]) -> list[dict]:
     try:
-        store_tags_series(tags_output)
-        store_top_tracks(data_source_id, sorted_tracks)
-        store_zones(data_source_id, zones_output["zones"], zones_output["timestamp"])
+        fresh = get_devices_list(client)
+        if not fresh:
+            logger.warning("No devices returned from API, keeping the previous device list.")
+            return devices
+        save_devices(fresh)
+        logger.info(f"Refreshed device list, {len(fresh)} devices.")
+        return fresh
     except Exception as e:
-        logger.error(f"Failed to store aggregated data for {data_source_id}: {e}", exc_info=True)
+        logger.error(f"Refreshing the device list failed, keeping the previous one: {e}", exc_info=True)
+        return devices
 
-    return {"tags": tags_output, "top_tracks": sorted_tracks, "zones": zones_output}
 
-
-def get_devices_list(client):
-    flattened_list = []
-    variables = client.get_default_variables()
-    variables['filter'] = {"address": {"like": "earthcam"}}
+async def refresh_devices_async(client: AsyncWorldsAPIClient, devices: list[dict]) -> list[dict]:
     try:
-        devices = client.execute_query("devices", variables)
-        for item in client.extract_nodes(devices):
-            ds = item.pop('dataSource')
-            flattened_list.append({**item, **ds})
+        fresh = await get_devices_list_async(client)
+        if not fresh:
+            logger.warning("No devices returned from API, keeping the previous device list.")
+            return devices
+        await asyncio.to_thread(save_devices, fresh)
+        logger.info(f"Refreshed device list, {len(fresh)} devices.")
+        return fresh
     except Exception as e:
-        logger.error(f"Failed to fetch devices: {e}", exc_info=True)
-    return flattened_list
+        logger.error(f"Refreshing the device list failed, keeping the previous one: {e}", exc_info=True)
+        return devices
 
 
 # Main daemon loop that runs the sync every hour.
 def main():
     client = WorldsAPIClient()
+    start_metrics_server()
+    serve_track_store()
     logger.info("Dashboard service started.")
 
     # Had this to display device dropdown in grafana and select dashboard per device
     # But since other sources produce no data this is pretty much useless
     # Keeping it here since the work has already been done
+    devices = []
     try:
         logger.info("Fetching and saving device list...")
         devices = get_devices_list(client)
@@ -170,15 +279,80 @@ def main():
 
     # We will do this for Burbon Street only since other sources have no data
     device_id = "4ae953d5-d3a6-4f70-8b5a-0873a40f518b"
+    device_ids = [d["id"] for d in devices if d.get("id")]
+    windows = {} if AGGREGATION_INCREMENTAL else None
+    interval = INCREMENTAL_INTERVAL if AGGREGATION_INCREMENTAL else AGGREGATION_INTERVAL
+    devices_refreshed = time.monotonic()
     while True:
+        if time.monotonic() - devices_refreshed >= DEVICES_REFRESH_INTERVAL:
+            devices = refresh_devices(client, devices)
+            device_ids = [d["id"] for d in devices if d.get("id")]
+            devices_refreshed = time.monotonic()
+            if windows is not None and AGGREGATION_MODE == "pool":
+                for stale in set(windows) - set(device_ids):
+                    del windows[stale]
         try:
-            logger.info(f"Aggregating tracks for device_id: {device_id}")
-            aggregate_tracks(client, device_id, minutes=60, max_tracks=5)
+            if AGGREGATION_MODE == "pool":
+                logger.info(f"Aggregating tracks for {len(device_ids)} devices")
+                aggregate_devices(client, device_ids, minutes=60, max_tracks=5, windows=windows)
+            elif windows is not None:
+                logger.info(f"Incrementally aggregating tracks for device_id: {device_id}")
+                window = windows.setdefault(device_id, TrackWindow(device_id, minutes=60, max_tracks=5))
+                aggregate_tracks_incremental(client, window)
+            else:
+                logger.info(f"Aggregating tracks for device_id: {device_id}")
+                aggregate_tracks(client, device_id, minutes=60, max_tracks=5)
         except Exception as e:
             logger.critical(f"An unexpected critical error occurred in the main loop: {e}", exc_info=True)
 
-        logger.info("Cycle finished. Sleeping for 1 hour.")
-        time.sleep(3600)  # Sleep for 3600 seconds
+        logger.info(f"Cycle finished. Sleeping for {interval} seconds.")
+        time.sleep(interval)
+
+
+async def _timed_aggregate_async(client: AsyncWorldsAPIClient, device_id: str, minutes: int, max_tracks: int):
+    started = time.perf_counter()
+    try:
+        result = await aggregate_tracks_async(client, device_id, minutes=minutes, max_tracks=max_tracks, persist=False)
+        logger.info(f"Aggregated device {device_id} in {time.perf_counter() - started:.2f}s")
+        return device_id, result
+    except Exception as e:
+        logger.error(f"Aggregation failed for device {device_id}: {e}", exc_info=True)
+        return device_id, None
+
+
+# asyncio version of the daemon loop. Devices are aggregated concurrently, bounded by the
+# client's request semaphore, so it can share an event loop with the subscription service.
+async def main_async(client: Optional[AsyncWorldsAPIClient] = None):
+    client = client or AsyncWorldsAPIClient()
+    start_metrics_server()
+    serve_track_store()
+    logger.info("Dashboard service started (asyncio).")
+
+    devices = await get_devices_list_async(client)
+    if not devices:
+        logger.warning("No devices returned from API. Skipping track aggregation.")
+        return
+    try:
+        await asyncio.to_thread(save_devices, devices)
+        logger.info(f"Successfully saved {len(devices)} devices.")
+    except Exception as e:
+        logger.error(f"A failure occurred while saving devices: {e}", exc_info=True)
+
+    # We will do this for Burbon Street only since other sources have no data
+    device_ids = ["4ae953d5-d3a6-4f70-8b5a-0873a40f518b"]
+    devices_refreshed = time.monotonic()
+    while True:
+        if time.monotonic() - devices_refreshed >= DEVICES_REFRESH_INTERVAL:
+            devices = await refresh_devices_async(client, devices)
+            devices_refreshed = time.monotonic()
+        if AGGREGATION_MODE == "pool":
+            device_ids = [d["id"] for d in devices if d.get("id")]
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(_timed_aggregate_async(client, d, 60, 5) for d in device_ids))
+        await asyncio.to_thread(persist_aggregations, {d: r for d, r in outcomes if r is not None})
+        logger.info(f"Cycle for {len(device_ids)} devices finished in {time.perf_counter() - started:.2f}s. "
+                    f"Sleeping for {AGGREGATION_INTERVAL} seconds.")
+        await asyncio.sleep(AGGREGATION_INTERVAL)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+BucketKey = Tuple[str, Optional[str], datetime]
+
+
+# Pre-aggregates detection events into (source_id, tag, time bucket) counters.
+#
+# `swap()` hands the closed buckets to the caller and installs a fresh buffer for the
+# still open ones in a single step, with no await in between, so events that arrive while
+# a flush is being written land in the new buffer instead of being cleared away. Only
+# buckets that ended more than `grace` ago are flushed, which gives late events a chance
+# to be counted and keeps detection_events at one row per bucket.
+class DetectionBuckets:
+    def __init__(self, bucket_seconds: int = 30, grace_seconds: int = 10):
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.grace = timedelta(seconds=grace_seconds)
+        self._buffer: Dict[BucketKey, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def bucket_start(self, timestamp: datetime) -> datetime:
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        epoch = int(timestamp.timestamp())
+        return datetime.fromtimestamp(epoch - epoch % self.bucket_seconds, tz=timezone.utc)
+
+    def add(self, record: Dict[str, Any]):
+        start = self.bucket_start(record["timestamp"])
+        key = (record["source_id"], record["tag"], start)
+        row = self._buffer.get(key)
+        if row is None:
+            self._buffer[key] = {**record, "timestamp": start, "event_count": record.get("event_count", 1)}
+        else:
+            row["event_count"] += record.get("event_count", 1)
+
+    # Returns the buckets ready to be written. With now=None every bucket is returned (shutdown).
+    def swap(self, now: Optional[datetime] = None) -> Dict[BucketKey, Dict[str, Any]]:
+        buffer, self._buffer = self._buffer, {}
+        if now is None:
+            return buffer
+
+        cutoff = now - self.grace - timedelta(seconds=self.bucket_seconds)
+        closed = {}
+        for key, row in buffer.items():
+            if key[2] <= cutoff:
+                closed[key] = row
+            else:
+                self._buffer[key] = row
+        return closed
+
+    # Puts back buckets whose write failed, merging with anything counted since
+    def restore(self, buckets: Dict[BucketKey, Dict[str, Any]]):
+        for key, row in buckets.items():
+            current = self._buffer.get(key)
+            if current is None:
+                self._buffer[key] = row
+            else:
+                current["event_count"] += row["event_count"]
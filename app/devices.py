@@ -0,0 +1,54 @@
+import logging
+
+from worlds_api_client import AsyncWorldsAPIClient, WorldsAPIBase, WorldsAPIClient
+
+logger = logging.getLogger(__name__)
+
+# Device list of the Worlds API, shared by the dashboard, subscription and backfill
+# services. Kept apart from dashboard_service so importing it has no side effects.
+
+
+def devices_variables(client: WorldsAPIBase) -> dict:
+    variables = client.get_default_variables()
+    variables['filter'] = {"address": {"like": "earthcam"}}
+    return variables
+
+
+def flatten_devices(client: WorldsAPIBase, devices: dict) -> list[dict]:
+    flattened_list = []
+    for item in client.extract_nodes(devices):
+        ds = item.pop('dataSource')
+        flattened_list.append({**item, **ds})
+    return flattened_list
+
+
+# Every page of devices. A failure on any page returns an empty list, not a partial one.
+def get_devices_list(client: WorldsAPIClient):
+    flattened_list = []
+    variables = devices_variables(client)
+    seen_cursors = set()
+    try:
+        while True:
+            devices = client.execute_query("devices", variables)
+            flattened_list += flatten_devices(client, devices)
+            page_info = client.extract_page_info(devices)
+            end_cursor = page_info.get("endCursor") if page_info and page_info.get("hasNextPage") else None
+            if not end_cursor or end_cursor in seen_cursors:
+                break
+            seen_cursors.add(end_cursor)
+            variables = {**variables, "after": end_cursor}
+    except Exception as e:
+        logger.error(f"Failed to fetch devices: {e}", exc_info=True)
+        flattened_list = []
+    return flattened_list
+
+
+async def get_devices_list_async(client: AsyncWorldsAPIClient):
+    flattened_list = []
+    try:
+        async for devices in client.iter_pages("devices", devices_variables(client)):
+            flattened_list += flatten_devices(client, devices)
+    except Exception as e:
+        logger.error(f"Failed to fetch devices: {e}", exc_info=True)
+        flattened_list = []
+    return flattened_list
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+SAMPLE = "sample"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SAMPLE)
+
+
+# Bounded hand-off between a subscription receive loop and a pool of consumer tasks.
+#
+# The receive loop only awaits `put()`, the consumers run `handler` for every event.
+# What happens when consumers fall behind and the queue fills up is explicit:
+#   block       - put() waits for space, backpressure reaches the websocket reader
+#   drop_oldest - the oldest queued event is discarded to make room
+#   sample      - once the queue is half full only every `sample_every`-th event is kept
+class IngestPipeline:
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], maxsize: int = 10000, consumers: int = 4,
+                 policy: str = BLOCK, sample_every: int = 10, name: str = "ingest"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}', expected one of {OVERFLOW_POLICIES}")
+        self.handler = handler
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.consumers = consumers
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.name = name
+        self._tasks: list[asyncio.Task] = []
+        self._sample_counter = 0
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_lag = 0.0  # seconds between enqueue and start of processing
+        self.max_lag = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def put(self, event: Any) -> bool:
+        self.received += 1
+        item = (time.monotonic(), event)
+
+        if self.policy == SAMPLE and self.queue.qsize() * 2 >= self.queue.maxsize > 0:
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_every:
+                self.dropped += 1
+                return False
+
+        if self.policy == DROP_OLDEST:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return True
+                except asyncio.QueueFull:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self.dropped += 1
+                    except asyncio.QueueEmpty:
+                        pass
+
+        await self.queue.put(item)
+        return True
+
+    async def _consume(self):
+        while True:
+            enqueued, event = await self.queue.get()
+            lag = time.monotonic() - enqueued
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            try:
+                await self.handler(event)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"{self.name} consumer failed to process event: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._consume(), name=f"{self.name}-consumer-{i}")
+                for i in range(self.consumers)
+            ]
+
+    async def stop(self, drain: bool = True, timeout: Optional[float] = None):
+        if drain:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self.name} stopped with {self.depth} events still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "capacity": self.queue.maxsize,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_lag": round(self.last_lag, 3),
+            "max_lag": round(self.max_lag, 3),
+        }
+
+    # Periodically logs queue depth and lag, max_lag is reset after every report
+    async def report(self, interval: float = 60.0):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"{self.name} pipeline: {self.stats()}")
+            self.max_lag = 0.0
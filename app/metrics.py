@@ -0,0 +1,95 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text format on http://<host>:METRICS_PORT/metrics, 0 disables the endpoint.
+# The db package registers its writer metrics (db/metrics.py) on the same default registry.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Worlds API
+WORLDS_REQUEST_SECONDS = Histogram(
+    "worlds_api_request_seconds", "Worlds API request latency including retries", ["query", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+WORLDS_REQUEST_RETRIES = Counter("worlds_api_request_retries_total", "Retried Worlds API requests", ["reason"])
+WORLDS_GRAPHQL_ERRORS = Counter("worlds_api_graphql_errors_total", "Responses carrying GraphQL errors")
+SUBSCRIPTION_EVENTS = Counter("worlds_subscription_events_total", "Subscription events received", ["subscription"])
+SUBSCRIPTION_ERRORS = Counter("worlds_subscription_errors_total", "Subscription connections lost", ["subscription"])
+SUBSCRIPTION_SHARD_SOURCES = Gauge("subscription_shard_sources", "Data sources subscribed to by this shard")
+RESPONSE_CACHE_REQUESTS = Counter(
+    "worlds_response_cache_requests_total", "Settled query lookups in the response cache", ["query", "result"]
+)
+RESPONSE_CACHE_EVICTIONS = Counter("worlds_response_cache_evictions_total", "Responses evicted from the cache")
+RESPONSE_CACHE_BYTES = Gauge("worlds_response_cache_bytes", "Compressed bytes held by the response cache")
+
+# Dashboard aggregation
+AGGREGATION_SECONDS = Histogram(
+    "aggregation_seconds", "Time to fetch and aggregate the tracks of one device", ["mode"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+AGGREGATION_PAGES = Histogram(
+    "aggregation_pages", "Track pages fetched per device and cycle", ["mode"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+TRACKS_PER_PAGE = Histogram(
+    "aggregation_tracks_per_page", "Track nodes per fetched page",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500),
+)
+AGGREGATION_TRACKS = Counter("aggregation_tracks_total", "Track nodes aggregated", ["mode"])
+AGGREGATION_FAILURES = Counter("aggregation_fetch_failures_total", "Aggregations cut short by a fetch error", ["mode"])
+TRACK_STORE_BYTES = Gauge("track_store_bytes", "Bytes of columns held by the in-memory track store")
+TRACK_STORE_TRACKS = Gauge("track_store_tracks", "Tracks held by the in-memory track store")
+
+# Subscription ingest
+FLUSH_SECONDS = Histogram(
+    "detection_flush_seconds", "Time to hand closed detection buckets to the spool or database",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+FLUSH_ROWS = Counter("detection_flush_rows_total", "Detection bucket rows flushed")
+FLUSH_FAILURES = Counter("detection_flush_failures_total", "Flushes that kept their buckets for a retry")
+AGGREGATE_BUCKETS = Gauge("detection_aggregate_buckets", "Open detection buckets held in memory")
+INGEST_QUEUE_DEPTH = Gauge("ingest_queue_depth", "Events waiting in the ingest queue", ["pipeline"])
+INGEST_LAG = Gauge("ingest_lag_seconds", "Queue wait of the last event picked up by a consumer", ["pipeline"])
+INGEST_DROPPED = Gauge("ingest_dropped_events", "Events dropped by the overflow policy since start", ["pipeline"])
+SPOOL_PENDING = Gauge("spool_pending_rows", "Rows in the local spool waiting for the drainer")
+
+_server_lock = threading.Lock()
+_server_started = False
+
+
+# Starts the exposition endpoint once per process, both services may ask for it when
+# they share a process (worlds_services.py)
+def start_metrics_server(port: int = METRICS_PORT):
+    global _server_started
+    if port <= 0:
+        return
+    with _server_lock:
+        if _server_started:
+            return
+        start_http_server(port)
+        _server_started = True
+    logger.info(f"Serving Prometheus metrics on :{port}/metrics")
+
+
+@contextmanager
+def observe_request(query: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        WORLDS_REQUEST_SECONDS.labels(query, outcome).observe(time.perf_counter() - started)
+
+
+# Cycle time, pages and tracks of one device's aggregation, `mode` is full, incremental,
+# async or backfill
+def record_aggregation(mode: str, started: float, pages: int, tracks: int):
+    AGGREGATION_SECONDS.labels(mode).observe(time.perf_counter() - started)
+    AGGREGATION_PAGES.labels(mode).observe(pages)
+    AGGREGATION_TRACKS.labels(mode).inc(tracks)
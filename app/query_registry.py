@@ -0,0 +1,89 @@
+import os
+import glob
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from graphql import DocumentNode, OperationDefinitionNode, parse
+from graphql.utilities import strip_ignored_characters
+
+logger = logging.getLogger(__name__)
+
+QUERIES_DIR = os.getenv("WORLDS_QUERIES_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries"))
+
+
+@dataclass(frozen=True)
+class QueryDocument:
+    name: str
+    operation: str  # query, mutation or subscription
+    document: DocumentNode
+    text: str  # minified document, this exact string is what gets sent and hashed
+    sha256: str
+
+
+# Parsed and validated GraphQL documents from queries/*.graphql.
+#
+# Every document is read, parsed and minified once. Clients look documents up by
+# name instead of touching the filesystem per request, and the SHA-256 of the sent
+# text is ready for Automatic Persisted Queries.
+class QueryRegistry:
+    def __init__(self, queries_dir: str = QUERIES_DIR):
+        self.queries_dir = queries_dir
+        self.documents: dict[str, QueryDocument] = {}
+
+    def load(self) -> "QueryRegistry":
+        documents = {}
+        for path in sorted(glob.glob(os.path.join(self.queries_dir, "*.graphql"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path, "r", encoding="utf-8") as f:
+                documents[name] = self._compile(name, f.read(), path)
+        self.documents = documents
+        logger.info(f"Loaded {len(documents)} GraphQL documents from {self.queries_dir}")
+        return self
+
+    @staticmethod
+    def _compile(name: str, source: str, path: str) -> QueryDocument:
+        # Raises GraphQLSyntaxError so a broken query fails the service at startup, not mid-cycle
+        document = parse(source)
+        operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+        if len(operations) != 1:
+            raise ValueError(f"{path} must contain exactly one operation, found {len(operations)}")
+        operation = operations[0]
+        if operation.name is None or operation.name.value != name:
+            logger.warning(f"Operation name in {path} does not match the file name '{name}'")
+
+        text = strip_ignored_characters(source)
+        return QueryDocument(
+            name=name,
+            operation=operation.operation.value,
+            document=document,
+            text=text,
+            sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        )
+
+    def get(self, name: str) -> QueryDocument:
+        document = self.documents.get(name)
+        if document is None:
+            path = os.path.join(self.queries_dir, f"{name}.graphql")
+            logger.error(f"Query file not found: {path}")
+            raise FileNotFoundError(f"Query file not found: {path}")
+        return document
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.documents
+
+
+_registry: Optional[QueryRegistry] = None
+_registry_lock = threading.Lock()
+
+
+# Process wide registry, loaded on first use
+def get_registry() -> QueryRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = QueryRegistry().load()
+    return _registry
@@ -0,0 +1,162 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import asyncpg
+from fastapi import FastAPI, Query, Request, Response
+from prometheus_client import make_asgi_app
+from sqlalchemy import select
+
+from read_cache import CachedResponse, ReadCache
+from db.async_db import AsyncSessionLocal
+from db.crud import AGGREGATES_CHANNEL
+from db.db import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from db.model import TagCounts, Tags, TopTracks, Zones
+from db.rollups import detection_counts_query
+
+logger = logging.getLogger(__name__)
+
+# Read-only JSON endpoints for the Grafana Infinity datasource, served from ReadCache.
+# Entries live READ_API_CACHE_TTL seconds at most and are dropped as soon as a writer
+# announces new data on the aggregates_written channel.
+READ_API_CACHE_TTL = float(os.getenv("READ_API_CACHE_TTL", "30"))  # seconds
+READ_API_MAX_ENTRIES = int(os.getenv("READ_API_MAX_ENTRIES", "1024"))
+READ_API_LISTEN_RETRY = float(os.getenv("READ_API_LISTEN_RETRY", "5"))  # seconds
+
+CACHE = ReadCache(READ_API_CACHE_TTL, READ_API_MAX_ENTRIES)
+
+# Notification payload -> cache topics it makes stale
+WRITE_TOPICS = {
+    "aggregation": ("top_tracks", "zones", "tag_counts"),
+    "detection_events": ("detections",),
+}
+
+
+def _on_write(connection, pid, channel, payload):
+    topics = WRITE_TOPICS.get(payload)
+    if topics:
+        CACHE.invalidate(topics)
+
+
+async def listen_for_writes():
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(
+                user=DB_USER, password=DB_PASS, database=DB_NAME, host=DB_HOST, port=DB_PORT
+            )
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(AGGREGATES_CHANNEL, _on_write)
+            # Writes may have happened while we were not listening
+            CACHE.invalidate()
+            logger.info(f"Listening for writes on '{AGGREGATES_CHANNEL}'")
+            await closed.wait()
+            logger.warning("Write notification connection closed.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Write notification listener failed: {e}")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(READ_API_LISTEN_RETRY)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener = asyncio.create_task(listen_for_writes())
+    yield
+    listener.cancel()
+
+
+app = FastAPI(title="Worlds dashboard read API", lifespan=lifespan)
+app.mount("/metrics", make_asgi_app())
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _respond(request: Request, entry: CachedResponse) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": f"max-age={int(READ_API_CACHE_TTL)}"}
+    if _etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+async def _rows(query, params: Optional[dict] = None) -> list[dict]:
+    async with AsyncSessionLocal() as db:
+        return [dict(row) for row in (await db.execute(query, params)).mappings().all()]
+
+
+@app.get("/top_tracks")
+async def top_tracks(request: Request, device_id: Optional[str] = None):
+    query = select(*TopTracks.__table__.columns).order_by(TopTracks.device_id, TopTracks.length.desc())
+    if device_id:
+        query = query.where(TopTracks.device_id == device_id)
+    entry = await CACHE.get(f"top_tracks:{device_id}", ["top_tracks"], lambda: _rows(query))
+    return _respond(request, entry)
+
+
+@app.get("/zones")
+async def zones(request: Request, device_id: Optional[str] = None):
+    query = select(*Zones.__table__.columns).order_by(Zones.device_id)
+    if device_id:
+        query = query.where(Zones.device_id == device_id)
+    entry = await CACHE.get(f"zones:{device_id}", ["zones"], lambda: _rows(query))
+    return _respond(request, entry)
+
+
+# Relative windows (`hours` back from now) rather than absolute ranges, so the panels of
+# every viewer share one cache key per refresh interval
+@app.get("/tag_counts")
+async def tag_counts(request: Request, device_id: Optional[str] = None, tag: Optional[str] = None,
+                     hours: float = Query(24, gt=0, le=24 * 365)):
+    async def load():
+        query = (
+            select(TagCounts.device_id, Tags.name.label("tag"), TagCounts.ts, TagCounts.count)
+            .join(Tags, Tags.id == TagCounts.tag_id)
+            .where(TagCounts.ts >= datetime.now(timezone.utc) - timedelta(hours=hours))
+            .order_by(TagCounts.ts)
+        )
+        if device_id:
+            query = query.where(TagCounts.device_id == device_id)
+        if tag:
+            query = query.where(Tags.name == tag)
+        return await _rows(query)
+
+    entry = await CACHE.get(f"tag_counts:{device_id}:{tag}:{hours}", ["tag_counts"], load)
+    return _respond(request, entry)
+
+
+@app.get("/detections")
+async def detections(request: Request, source_id: Optional[str] = None, tag: Optional[str] = None,
+                     hours: float = Query(24, gt=0, le=24 * 730), step: int = Query(300, gt=0)):
+    async def load():
+        end = datetime.now(timezone.utc)
+        rollup, query, params = detection_counts_query(
+            end - timedelta(hours=hours), end, timedelta(seconds=step), source_id, tag
+        )
+        return await _rows(query, params)
+
+    entry = await CACHE.get(f"detections:{source_id}:{tag}:{hours}:{step}", ["detections"], load)
+    return _respond(request, entry)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "cache": CACHE.stats()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("READ_API_PORT", "8000")))
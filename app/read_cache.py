@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    expires: float
+    topics: frozenset
+
+
+# In-memory cache of serialized JSON responses for the read API.
+#
+# Entries expire after `ttl` seconds and are dropped early by invalidate() when one of
+# their topics was written. Concurrent misses on the same key share one load, so any
+# number of dashboard viewers refreshing at once cost a single database query, which keeps
+# running for the others when the caller that started it goes away. A load that
+# raced with an invalidation of one of its topics is returned to its callers but not kept. The least recently
+# used entries are evicted past `max_entries`.
+class ReadCache:
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        # Bumped by invalidate(), globally for topics=None, per topic otherwise
+        self._generation = 0
+        self._topic_generations: dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str, topics: Iterable[str], loader: Callable[[], Awaitable[Any]]) -> CachedResponse:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # The load runs in a task of its own, so a caller that is cancelled (client gone)
+            # stops waiting without cancelling the load the other callers wait for
+            topics = frozenset(topics)
+            task = asyncio.ensure_future(self._load(key, topics, loader, self._generation_of(topics)))
+            task.add_done_callback(lambda t: self._done(key, t))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, topics: frozenset, loader: Callable[[], Awaitable[Any]],
+                    generation: tuple) -> CachedResponse:
+        body = json.dumps(await loader(), default=_default, separators=(",", ":")).encode("utf-8")
+        entry = CachedResponse(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            expires=time.monotonic() + self.ttl,
+            topics=topics,
+        )
+        if generation == self._generation_of(topics):
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _generation_of(self, topics: frozenset) -> tuple:
+        return self._generation, tuple(sorted((t, self._topic_generations.get(t, 0)) for t in topics))
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, waiters get it re-raised
+
+    # Drops the entries of the given topics, or everything with topics=None
+    def invalidate(self, topics: Optional[Iterable[str]] = None):
+        self.invalidations += 1
+        if topics is None:
+            self._generation += 1
+            self._entries.clear()
+            return
+        topics = set(topics)
+        for topic in topics:
+            self._topic_generations[topic] = self._topic_generations.get(topic, 0) + 1
+        for key in [k for k, e in self._entries.items() if e.topics & topics]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
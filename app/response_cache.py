@@ -0,0 +1,158 @@
+import os
+import gzip
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+import orjson
+
+from metrics import RESPONSE_CACHE_EVICTIONS, RESPONSE_CACHE_REQUESTS
+from track_aggregation import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+# End of the filter.time.between range of a query's variables, None when there is none
+def range_end(variables: Optional[dict]) -> Optional[datetime]:
+    between = (((variables or {}).get("filter") or {}).get("time") or {}).get("between") or []
+    if len(between) != 2:
+        return None
+    end = parse_timestamp(between[1])
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    return end
+
+
+# Content-addressed on-disk cache of settled query responses.
+#
+# A response is stored under the SHA-256 of the query document's hash and its variables
+# (keys sorted, None values dropped), so the same page of the same query is found again
+# whatever the order the variables were built in. Only requests whose time range ended
+# more than `settled_seconds` ago are cached: tracks in those windows no longer change.
+#
+# Responses are gzip compressed JSON files, one per key, written through a temp file and
+# renamed so a reader never sees half a file. A SQLite index keeps their size and last
+# access; once the files pass `max_bytes` the least recently used ones are deleted.
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int = 1 << 30, settled_seconds: float = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.settled = timedelta(seconds=settled_seconds)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, query TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def cacheable(self, variables: Optional[dict], now: Optional[datetime] = None) -> bool:
+        end = range_end(variables)
+        return end is not None and end <= (now or datetime.now(timezone.utc)) - self.settled
+
+    @staticmethod
+    def key(document_sha256: str, variables: Optional[dict]) -> str:
+        body = orjson.dumps(_normalize(variables or {}), option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(document_sha256.encode() + b"\0" + body).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def get(self, key: str, query: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), "rb") as f:
+                payload = f.read()
+            data = orjson.loads(gzip.decompress(payload))
+        except FileNotFoundError:
+            return self._miss(query)
+        except (OSError, EOFError, orjson.JSONDecodeError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self._remove(key)
+            return self._miss(query)
+        with self._lock:
+            updated = self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            if not updated.rowcount:
+                # Written by a process that died before indexing it
+                self._db.execute("INSERT INTO entries (key, query, size, accessed) VALUES (?, ?, ?, ?)",
+                                 (key, query, len(payload), time.time()))
+                self._bytes += len(payload)
+        self.hits += 1
+        RESPONSE_CACHE_REQUESTS.labels(query, "hit").inc()
+        return data
+
+    def _miss(self, query: str) -> None:
+        self.misses += 1
+        RESPONSE_CACHE_REQUESTS.labels(query, "miss").inc()
+        return None
+
+    def put(self, key: str, query: str, data: dict):
+        payload = gzip.compress(orjson.dumps(data), compresslevel=6)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(payload)
+        os.replace(temp, path)
+
+        with self._lock:
+            previous = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, query, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, query, len(payload), time.time()),
+            )
+            self._bytes += len(payload) - (previous[0] if previous else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    # Deletes least recently used entries until the cache is back under 90% of max_bytes
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            self._delete(key, size)
+            self.evictions += 1
+            RESPONSE_CACHE_EVICTIONS.inc()
+
+    def _delete(self, key: str, size: int):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._bytes -= size
+
+    def _remove(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._delete(key, row[0] if row else 0)
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,30 @@
+import bisect
+import hashlib
+from typing import Iterable
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+# Consistent hash ring assigning data sources to `shards` subscription workers.
+#
+# Every shard is placed on the ring `vnodes` times and a key belongs to the first shard
+# point at or after its own hash. Workers build the same ring from the same shard count,
+# so they agree on the owner of every source without talking to each other, and a source
+# added or removed only moves that source: the others keep their worker and subscription.
+class HashRing:
+    def __init__(self, shards: int, vnodes: int = 160):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        ring = sorted((_point(f"shard-{shard}#{v}"), shard) for shard in range(shards) for v in range(vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+
+    def owner(self, key: str) -> int:
+        i = bisect.bisect_left(self._points, _point(key))
+        return self._owners[i % len(self._owners)]
+
+    def keys_for(self, shard: int, keys: Iterable[str]) -> set[str]:
+        return {key for key in keys if self.owner(key) == shard}
@@ -1,17 +1,59 @@
+import os
+import time
 import asyncio
 import logging
 import uuid
-from typing import List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
 from dateutil import parser
 
-from worlds_api_client import WorldsAPIClient
-from db.crud import store_detection_activity_bulk, store_event
+from devices import get_devices_list, get_devices_list_async
+from detection_buckets import DetectionBuckets
+from ingest_pipeline import IngestPipeline
+from shard_ring import HashRing
+from worlds_api_client import AsyncWorldsAPIClient, WorldsAPIBase, WorldsAPIClient
+from write_spool import WriteSpool
+from metrics import (
+    AGGREGATE_BUCKETS, FLUSH_FAILURES, FLUSH_ROWS, FLUSH_SECONDS, INGEST_DROPPED, INGEST_LAG, INGEST_QUEUE_DEPTH,
+    SPOOL_PENDING, SUBSCRIPTION_SHARD_SOURCES, start_metrics_server,
+)
+from db.async_crud import copy_detection_events, store_detection_events_bulk, store_event, store_events_bulk
 
 logger = logging.getLogger(__name__)
 
-AGGREGATE: Dict[str, Dict[str, Any]] = {}
 BATCH_TIMEOUT = 30.0  # seconds
+RECONNECT_DELAY = 15  # seconds
+# detection_events gets one row per (source_id, tag, bucket) of DETECTION_BUCKET_SECONDS
+DETECTION_BUCKET_SECONDS = int(os.getenv("DETECTION_BUCKET_SECONDS", "30"))
+DETECTION_BUCKET_GRACE = int(os.getenv("DETECTION_BUCKET_GRACE", "10"))  # seconds to wait for late events
+AGGREGATE = DetectionBuckets(DETECTION_BUCKET_SECONDS, DETECTION_BUCKET_GRACE)
+AGGREGATE_BUCKETS.set_function(lambda: len(AGGREGATE))
+
+# Events are handed from the websocket reader to INGEST_CONSUMERS tasks through a bounded queue
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_CONSUMERS = int(os.getenv("INGEST_CONSUMERS", "4"))
+INGEST_OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "block")  # block, drop_oldest or sample
+INGEST_SAMPLE_EVERY = int(os.getenv("INGEST_SAMPLE_EVERY", "10"))
+INGEST_STATS_INTERVAL = float(os.getenv("INGEST_STATS_INTERVAL", "60"))  # seconds
+
+# With SHARD_COUNT > 1 the data sources are split between SHARD_COUNT workers by consistent
+# hashing (shard_ring.py) and this worker only subscribes to the ones of SHARD_INDEX, one
+# dataSourceId filtered subscription each. The device list is re-read every
+# SHARD_REFRESH_INTERVAL and subscriptions are started and stopped to match it.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "160"))
+SHARD_REFRESH_INTERVAL = float(os.getenv("SHARD_REFRESH_INTERVAL", "300"))  # seconds
+
+# Flushed buckets and alert events go to a local SQLite spool first and are drained into Postgres
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Every shard drains its own spool file, a shared one would be replayed twice
+SPOOL_PATH = os.getenv("SPOOL_PATH",
+                       f"spool/subscription-{SHARD_INDEX}.db" if SHARD_COUNT > 1 else "spool/subscription.db")
+SPOOL_BATCH_SIZE = int(os.getenv("SPOOL_BATCH_SIZE", "5000"))
+SPOOL_MAX_ROWS = int(os.getenv("SPOOL_MAX_ROWS", "1000000"))
+SPOOL_DRAIN_INTERVAL = float(os.getenv("SPOOL_DRAIN_INTERVAL", "1"))  # seconds
+SPOOL: Optional[WriteSpool] = None
 
 def prepare_detection_activity_for_db(event: Dict[str, Any]) -> Dict[str, Any]:
     #Transforms a raw detectionActivity event into a database-ready format.
@@ -22,7 +64,7 @@ def prepare_detection_activity_for_db(event: Dict[str, Any]) -> Dict[str, Any]:
     timestamp_str = detection_activity.get("timestamp")
 
     db_record = {
-        "timestamp": parser.isoparse(timestamp_str) if timestamp_str else datetime.utcnow(),
+        "timestamp": parser.isoparse(timestamp_str) if timestamp_str else datetime.now(timezone.utc),
         "source_id": data_source.get("id"),
         "source_name": data_source.get("name"),
         "tag": track.get("tag"),
@@ -35,15 +77,38 @@ def prepare_detection_activity_for_db(event: Dict[str, Any]) -> Dict[str, Any]:
 
     return db_record
 
-async def flush_aggregate():
-    if not AGGREGATE:
+# Idempotency key of a spooled batch of buckets (detection_events.batch_seq): microseconds
+# since the epoch, bumped past the previous one, so keys keep growing across restarts. The
+# key is stored in the spool with the rows and a replayed batch is inserted with it again.
+_last_batch_seq = 0
+
+def next_batch_seq() -> int:
+    global _last_batch_seq
+    _last_batch_seq = max(_last_batch_seq + 1, time.time_ns() // 1000)
+    return _last_batch_seq
+
+async def flush_aggregate(final: bool = False):
+    # Closed buckets are swapped out before the write, events keep landing in the new buffer
+    batch = AGGREGATE.swap(None if final else datetime.now(timezone.utc))
+    if not batch:
         return
 
-    batch = list(AGGREGATE.values())
-    await asyncio.to_thread(store_detection_activity_bulk, batch)
-    AGGREGATE.clear()
+    started = time.perf_counter()
+    try:
+        if SPOOL is not None:
+            batch_seq = next_batch_seq()
+            await SPOOL.append("detection_events", [{**row, "batch_seq": batch_seq} for row in batch.values()])
+        else:
+            await copy_detection_events(batch.values())
+        FLUSH_ROWS.inc(len(batch))
+    except Exception as e:
+        FLUSH_FAILURES.inc()
+        logger.error(f"Failed to flush {len(batch)} detection buckets, keeping them for the next flush: {e}")
+        AGGREGATE.restore(batch)
+    finally:
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
 
-def alert_on_yellow_vest(detection: Dict[str, Any]):
+async def alert_on_yellow_vest(detection: Dict[str, Any]):
     # If the event is for a 'yellow_vest', create and save a formal Event directly
     if detection["tag"] == "yellow_vest":
         try:
@@ -80,57 +145,147 @@ def alert_on_yellow_vest(detection: Dict[str, Any]):
                 "priority": "high"
             }
 
-            # Save the event directly to the database
-            store_event(event_data)
-            logger.info(f"Created and saved event to DB: {event_data['id']}")
+            if SPOOL is not None:
+                await SPOOL.append("events", [event_data])
+            else:
+                await store_event(event_data)
+            logger.info(f"Created event {event_data['id']}")
         except Exception as e:
             logger.error(f"Failed to create and save event: {e}", exc_info=True)
 
-def handle_detection_activity(detection: Dict[str, Any]):
+async def handle_detection_activity(detection: Dict[str, Any]):
     try:
         db_record = prepare_detection_activity_for_db(detection)
         if not db_record:
             return
 
-        # Aggregate detection activity in-memory. Count same tags into a single db entry for current bucket.
-        tag = db_record["tag"]
-        if tag not in AGGREGATE:
-            AGGREGATE[tag] = db_record
-        else:
-            AGGREGATE[tag]["event_count"] += 1
+        # Aggregate detection activity in-memory. Count same source and tag into a single db entry per time bucket.
+        AGGREGATE.add(db_record)
 
-        alert_on_yellow_vest(db_record)
+        if db_record["tag"] == "yellow_vest":
+            await alert_on_yellow_vest(db_record)
 
     except Exception as e:
         logger.error(f"Error handling event: {e}", exc_info=True)
 
 async def aggregate_flusher():
     #A background task that periodically flushes the aggregate buffer.
-    while True:
-        await asyncio.sleep(BATCH_TIMEOUT)
-        await flush_aggregate()
-
-async def main():
-    logger.info("**Starting subscription service**")
-    asyncio.create_task(aggregate_flusher())
-
-    client = WorldsAPIClient()
-    variables = {"filter": {}}
+    try:
+        while True:
+            await asyncio.sleep(BATCH_TIMEOUT)
+            await flush_aggregate()
+    except asyncio.CancelledError:
+        # Write the still open buckets on shutdown
+        await flush_aggregate(final=True)
+        raise
 
+# Keeps one detectionActivity subscription open, reconnecting after RECONNECT_DELAY
+async def subscribe_forever(client: WorldsAPIBase, variables: Dict[str, Any], callback, label: str = "all sources"):
     while True:
         try:
-            logger.info("Attempting to connect to event subscription...")
+            logger.info(f"Attempting to connect to event subscription for {label}...")
             await client.subscribe(
                 "detectionActivity",
                 variables=variables,
-                callback=handle_detection_activity
+                callback=callback
             )
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Subscription connection lost: {e}. Reconnecting in 15 seconds...")
-            await asyncio.sleep(15)
+            logger.error(f"Subscription connection lost for {label}: {e}. Reconnecting in {RECONNECT_DELAY} seconds...")
+            await asyncio.sleep(RECONNECT_DELAY)
         else:
-            logger.warning("Subscription ended gracefully. Reconnecting in 15 seconds...")
-            await asyncio.sleep(15)
+            logger.warning(f"Subscription for {label} ended gracefully. Reconnecting in {RECONNECT_DELAY} seconds...")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+async def list_data_sources(client: WorldsAPIBase) -> List[str]:
+    if isinstance(client, AsyncWorldsAPIClient):
+        devices = await get_devices_list_async(client)
+    else:
+        devices = await asyncio.to_thread(get_devices_list, client)
+    return [device["id"] for device in devices if device.get("id")]
+
+# Sharded mode: subscribes to the data sources the hash ring assigns to SHARD_INDEX, with
+# a single detectionActivity subscription filtered on dataSourceId "in" the owned ids.
+#
+# Every SHARD_REFRESH_INTERVAL the device list is read again. When the owned sources
+# changed, the subscription is closed and reopened with the new list, events already
+# queued are still handled (the swap misses the few events of the reconnect). An empty
+# or failed device list keeps the current subscription. The owner of a source only
+# depends on its id and SHARD_COUNT, so device changes never move a source between
+# running workers; changing SHARD_COUNT takes a restart of all of them and moves about
+# 1/SHARD_COUNT of the sources.
+async def subscribe_shard(client: WorldsAPIBase, callback):
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        raise ValueError(f"SHARD_INDEX {SHARD_INDEX} is outside of 0..{SHARD_COUNT - 1}")
+    ring = HashRing(SHARD_COUNT, SHARD_VNODES)
+    subscribed: set[str] = set()
+    subscription: Optional[asyncio.Task] = None
+    try:
+        while True:
+            sources = await list_data_sources(client)
+            if sources:
+                owned = ring.keys_for(SHARD_INDEX, sources)
+                if owned != subscribed:
+                    logger.info(f"Shard {SHARD_INDEX}/{SHARD_COUNT}: {len(owned)} of {len(sources)} data sources, "
+                                f"+{len(owned - subscribed)} -{len(subscribed - owned)}")
+                    if subscription is not None:
+                        subscription.cancel()
+                        await asyncio.gather(subscription, return_exceptions=True)
+                        subscription = None
+                    if owned:
+                        variables = {"filter": {"dataSourceId": {"in": sorted(owned)}}}
+                        subscription = asyncio.create_task(subscribe_forever(
+                            client, variables, callback, label=f"shard {SHARD_INDEX} ({len(owned)} sources)"))
+                    subscribed = owned
+            else:
+                logger.warning(f"Shard {SHARD_INDEX}/{SHARD_COUNT}: no data sources listed, "
+                               f"keeping the subscription to {len(subscribed)}")
+            SUBSCRIPTION_SHARD_SOURCES.set(len(subscribed))
+            await asyncio.sleep(SHARD_REFRESH_INTERVAL)
+    finally:
+        if subscription is not None:
+            subscription.cancel()
+            await asyncio.gather(subscription, return_exceptions=True)
+
+def open_spool() -> WriteSpool:
+    return WriteSpool(
+        SPOOL_PATH,
+        writers={"detection_events": store_detection_events_bulk, "events": store_events_bulk},
+        batch_size=SPOOL_BATCH_SIZE,
+        max_rows=SPOOL_MAX_ROWS,
+        drain_interval=SPOOL_DRAIN_INTERVAL,
+    )
+
+async def main(client: Optional[WorldsAPIBase] = None):
+    global SPOOL
+    logger.info("**Starting subscription service**")
+    start_metrics_server()
+    if SPOOL_ENABLED and SPOOL is None:
+        SPOOL = open_spool()
+        SPOOL_PENDING.set_function(lambda: SPOOL.pending)
+        asyncio.create_task(SPOOL.run())
+    asyncio.create_task(aggregate_flusher())
+
+    pipeline = IngestPipeline(
+        handle_detection_activity,
+        maxsize=INGEST_QUEUE_SIZE,
+        consumers=INGEST_CONSUMERS,
+        policy=INGEST_OVERFLOW_POLICY,
+        sample_every=INGEST_SAMPLE_EVERY,
+        name="detectionActivity",
+    )
+    pipeline.start()
+    INGEST_QUEUE_DEPTH.labels(pipeline.name).set_function(lambda: pipeline.depth)
+    INGEST_LAG.labels(pipeline.name).set_function(lambda: pipeline.last_lag)
+    INGEST_DROPPED.labels(pipeline.name).set_function(lambda: pipeline.dropped)
+    asyncio.create_task(pipeline.report(INGEST_STATS_INTERVAL))
+
+    client = client or WorldsAPIClient()
+    if SHARD_COUNT > 1:
+        await subscribe_shard(client, pipeline.put)
+    else:
+        await subscribe_forever(client, {"filter": {}}, pipeline.put)
 
 if __name__ == "__main__":
     try:
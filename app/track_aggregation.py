@@ -0,0 +1,158 @@
+import heapq
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+
+# Track node fields read by parse_track, TrackAggregator and track_store. The lean
+# tracksSummary query selects only these (APIDiscovery/generate_queries.py).
+TRACK_NODE_FIELDS = {
+    "id": {},
+    "tag": {},
+    "startTime": {},
+    "endTime": {},
+    "video": {"thumbnailUrl": {}},
+    "detections": {"metadata": {"track_confidence": {}}, "zones": {"name": {}}},
+}
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def track_length(node: dict) -> float:
+    start_dt = parse_timestamp(node.get("startTime"))
+    end_dt = parse_timestamp(node.get("endTime"))
+    return (end_dt - start_dt).total_seconds() if start_dt and end_dt else 0.0
+
+
+def track_zones(node: dict) -> set[str]:
+    return {z["name"] for d in node.get("detections") or [] for z in d.get("zones") or [] if z.get("name")}
+
+
+# Flattens a raw track node into the fields the aggregations consume.
+def parse_track(node: dict, length: Optional[float] = None) -> dict:
+    detections = node.get("detections") or []
+
+    # Get average confidence for the track
+    conf_vals = []
+    for d in detections:
+        conf = (d.get("metadata") or {}).get("track_confidence")
+        if conf is not None:
+            conf_vals.append(conf)
+
+    return {
+        "id": node.get("id"),
+        "tag": node.get("tag", "unknown"),
+        "start": parse_timestamp(node.get("startTime")),
+        "end": parse_timestamp(node.get("endTime")),
+        "length": track_length(node) if length is None else length,
+        "detections": len(detections),
+        "thumbnail_url": (node.get("video") or {}).get("thumbnailUrl"),
+        "track_confidence_average": sum(conf_vals) / len(conf_vals) if conf_vals else None,
+        "zones": track_zones(node),
+    }
+
+
+# Builds the top_tracks row for a parsed track.
+def track_record(track: dict, device_id: str, timestamp: str) -> dict:
+    return {
+        "id": track["id"],
+        "device_id": device_id,
+        "timestamp": timestamp,
+        "length": track["length"],
+        "detections": track["detections"],
+        "tag": track["tag"],
+        "thumbnail_url": track["thumbnail_url"],
+        "track_confidence_average": track["track_confidence_average"],
+        "zones": list(track["zones"]),
+    }
+
+
+# Bounded min-heap that keeps the k entries with the largest score.
+# Entries are unique by id, offering an id again only replaces it when the score grew.
+class TopK:
+    __slots__ = ("k", "heap")
+
+    def __init__(self, k: int):
+        self.k = k
+        self.heap: list[tuple[float, str, Any]] = []
+
+    def admits(self, score: float, item_id: str) -> bool:
+        return len(self.heap) < self.k or (score, item_id) > self.heap[0][:2]
+
+    def offer(self, score: float, item_id: str, payload: Any) -> bool:
+        for i, (held_score, held_id, _) in enumerate(self.heap):
+            if held_id == item_id:
+                if score <= held_score:
+                    return False
+                self.heap[i] = (score, item_id, payload)
+                heapq.heapify(self.heap)
+                return True
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (score, item_id, payload))
+            return True
+        if (score, item_id) > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, (score, item_id, payload))
+            return True
+        return False
+
+    def __iter__(self):
+        return iter(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def largest(self) -> list[tuple[float, str, Any]]:
+        return sorted(self.heap, key=lambda e: e[:2], reverse=True)
+
+
+# Streaming aggregation of track nodes for one device and time window.
+#
+# Only O(distinct tags + distinct zones + max_tracks) state is kept: every node updates
+# the tag and zone counters and is offered to a bounded heap keyed on track length.
+# Nodes that enter the heap are held as-is and full top_tracks records are only built
+# for the survivors when the result is requested, so memory does not grow with the
+# number of tracks in the window.
+class TrackAggregator:
+    def __init__(self, device_id: str, timestamp: str, max_tracks: int = 5):
+        self.device_id = device_id
+        self.timestamp = timestamp
+        self.tag_counts: dict[str, int] = {}
+        self.zones: set[str] = set()
+        self.top = TopK(max_tracks)
+        self.tracks = 0
+
+    def add(self, node: dict):
+        tag = node.get("tag", "unknown")
+        self.tag_counts[tag] = self.tag_counts.get(tag, 0) + 1
+        for d in node.get("detections") or []:
+            for z in d.get("zones") or []:
+                name = z.get("name")
+                if name:
+                    self.zones.add(name)
+
+        length = track_length(node)
+        track_id = node.get("id")
+        if self.top.admits(length, track_id):
+            self.top.offer(length, track_id, node)
+        self.tracks += 1
+
+    def add_nodes(self, nodes: Iterable[dict]):
+        for node in nodes:
+            self.add(node)
+
+    def result(self) -> dict:
+        base_record = {"device_id": self.device_id, "timestamp": self.timestamp}
+        return {
+            "tags": {**base_record, "tags": [{"tag": t, "count": c} for t, c in self.tag_counts.items()]},
+            "top_tracks": [
+                track_record(parse_track(node, length), self.device_id, self.timestamp)
+                for length, _, node in self.top.largest()
+            ],
+            "zones": {**base_record, "zones": list(self.zones)},
+        }
@@ -0,0 +1,146 @@
+import os
+import copy
+import logging
+import queue
+import threading
+from datetime import datetime
+from typing import Iterator
+
+from metrics import TRACKS_PER_PAGE
+from track_aggregation import parse_timestamp
+from worlds_api_client import WorldsAPIBase, WorldsAPIClient
+
+logger = logging.getLogger(__name__)
+
+# "tracks" is the full query with every detection's timestamp and the data source.
+# TRACKS_QUERY=tracksSummary selects only the track fields the aggregation reads
+# (TRACK_NODE_FIELDS). The committed tracksSummary.graphql was generated against the
+# simulator's schema, regenerate it from the live API before opting in:
+#   python APIDiscovery/generate_queries.py --refresh --only tracksSummary --force
+#   python benchmarks/bench_simulator.py query --live
+TRACKS_QUERY = os.getenv("TRACKS_QUERY", "tracks")
+
+_DONE = object()
+
+
+def tracks_variables(client: WorldsAPIBase, data_source_id: str, start_time: datetime, end_time: datetime) -> dict:
+    variables = client.get_default_variables()
+    variables["filter"] = {
+        "dataSourceId": {"eq": data_source_id},
+        "time": {
+            "between": [
+                start_time.isoformat(timespec="milliseconds"),
+                end_time.isoformat(timespec="milliseconds"),
+            ]
+        },
+    }
+    return variables
+
+
+# Fetches the tracks of a time window with cursor pagination running ahead of the consumer.
+#
+# Every slice of the window is paged by its own background thread into a bounded queue,
+# so page N+1 is already in flight while page N is being aggregated. With slices > 1 the
+# window is split into equal sub-intervals that are fetched concurrently. Nodes are still
+# yielded slice by slice and page by page, so the output order is deterministic, and tracks
+# that overlap a slice boundary (returned by both slices) are only yielded once.
+class TrackPageFetcher:
+    def __init__(self, client: WorldsAPIClient, query_name: str = "tracks", slices: int = 1, prefetch: int = 2):
+        self.client = client
+        self.query_name = query_name
+        self.slices = max(1, slices)
+        self.prefetch = max(1, prefetch)
+        self.pages = 0  # pages consumed by iter_page_nodes
+
+    def _produce(self, variables: dict, out: queue.Queue, stop: threading.Event):
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        seen_cursors = set()
+        try:
+            while not stop.is_set():
+                page = self.client.execute_query(self.query_name, variables)
+                if not put(page):
+                    return
+
+                info = self.client.extract_page_info(page)
+                if not info or not info.get("hasNextPage"):
+                    break
+                end_cursor = info.get("endCursor")
+                if not end_cursor or end_cursor in seen_cursors:
+                    break
+                seen_cursors.add(end_cursor)
+                variables["after"] = end_cursor
+        except Exception as e:
+            put(e)
+            return
+        put(_DONE)
+
+    def iter_pages(self, variables_list: list[dict]) -> Iterator[tuple[int, dict]]:
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.prefetch) for _ in variables_list]
+        threads = [
+            threading.Thread(
+                target=self._produce,
+                args=(copy.deepcopy(variables), q, stop),
+                name=f"{self.query_name}-fetch-{i}",
+                daemon=True,
+            )
+            for i, (variables, q) in enumerate(zip(variables_list, queues))
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for index, q in enumerate(queues):
+                while True:
+                    item = q.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield index, item
+        finally:
+            # Unblocks producers when the consumer stops early or a slice failed
+            stop.set()
+
+    def slice_bounds(self, start_time: datetime, end_time: datetime) -> list[tuple[datetime, datetime]]:
+        step = (end_time - start_time) / self.slices
+        bounds = [start_time + step * i for i in range(self.slices)] + [end_time]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # Nodes of every page, page by page. Tracks that overlap a slice boundary are only
+    # kept in the first slice that returned them.
+    def iter_page_nodes(self, data_source_id: str, start_time: datetime, end_time: datetime) -> Iterator[list[dict]]:
+        bounds = self.slice_bounds(start_time, end_time)
+        variables_list = [tracks_variables(self.client, data_source_id, s, e) for s, e in bounds]
+
+        # Ids of tracks that ran past the end of their slice and may show up again in the next one
+        crossing = set()
+        for index, page in self.iter_pages(variables_list):
+            slice_end = bounds[index][1]
+            nodes = self.client.extract_nodes(page)
+            self.pages += 1
+            TRACKS_PER_PAGE.observe(len(nodes))
+            if crossing or index < len(bounds) - 1:
+                kept = []
+                for node in nodes:
+                    track_id = node.get("id")
+                    if track_id in crossing:
+                        continue
+                    if index < len(bounds) - 1:
+                        end = parse_timestamp(node.get("endTime"))
+                        if end is None or end >= slice_end:
+                            crossing.add(track_id)
+                    kept.append(node)
+                nodes = kept
+            yield nodes
+
+    def iter_nodes(self, data_source_id: str, start_time: datetime, end_time: datetime) -> Iterator[dict]:
+        for nodes in self.iter_page_nodes(data_source_id, start_time, end_time):
+            yield from nodes
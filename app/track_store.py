@@ -0,0 +1,577 @@
+import json
+import logging
+import threading
+import warnings
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+
+from track_aggregation import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+_US = 1_000_000
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ZONE_WORD_BITS = 64
+_NAT = "NaT"
+VALUE_COLUMNS = ("length", "detections", "confidence")
+AGGREGATES = ("count", "sum", "mean", "min", "max")
+
+
+def _parse_one_us(value) -> Optional[int]:
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+# Microseconds since the epoch for a list of ISO-8601 timestamps, and a mask of the
+# ones that parsed. UTC "...Z" timestamps, what the Worlds API returns, are converted by
+# numpy's datetime64 parser in one call per list. Timestamps with an offset, and every
+# value of a list numpy rejects, go through parse_timestamp one by one.
+def parse_epoch_us(values: list[Optional[str]]) -> tuple[np.ndarray, np.ndarray]:
+    utc = []
+    others = []
+    for i, value in enumerate(values):
+        if value and value[-1] == "Z":
+            utc.append(value[:-1])
+        else:
+            utc.append(_NAT)
+            if value:
+                others.append(i)
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns about offsets it parsed itself ("+02:00Z"), leave those to fromisoformat
+            warnings.simplefilter("error", UserWarning)
+            epoch = np.array(utc, dtype="M8[us]").astype(np.int64)
+        valid = epoch != np.iinfo(np.int64).min
+    except (ValueError, TypeError, UserWarning):
+        epoch = np.zeros(len(values), dtype=np.int64)
+        valid = np.zeros(len(values), dtype=bool)
+        others = range(len(values))
+
+    for i in others:
+        parsed = _parse_one_us(values[i])
+        if parsed is not None:
+            epoch[i] = parsed
+            valid[i] = True
+    return epoch, valid
+
+
+# One page of track nodes as columns.
+#
+# Tags are codes into the decoder's tag list and zones a bitset over its zone list,
+# `zones` holding one uint64 word per 64 zones. Timestamps are microseconds since the
+# epoch, `has_times` is False when either end of the track is missing or unparseable.
+@dataclass
+class TrackColumns:
+    ids: list
+    thumbnails: list
+    start: np.ndarray
+    end: np.ndarray
+    has_times: np.ndarray
+    tag: np.ndarray
+    detections: np.ndarray
+    confidence_sum: np.ndarray
+    confidence_count: np.ndarray
+    zones: np.ndarray
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Turns pages of track nodes into TrackColumns for the store.
+#
+# Fields are pulled out of a page with list comprehensions over all of its nodes and
+# detections, the arithmetic is done by numpy: timestamps are parsed per page by
+# parse_epoch_us and confidences summed per track with a weighted bincount. Tag and zone
+# names are interned once per decoder, pages decoded by the same decoder share its codes.
+class TrackPageDecoder:
+    def __init__(self):
+        self.tags: list = []
+        self.zones: list[str] = []
+        self._tag_codes: dict[Any, int] = {}
+        self._zone_bits: dict[str, int] = {}
+
+    def _tag_code(self, tag) -> int:
+        code = self._tag_codes.get(tag)
+        if code is None:
+            code = self._tag_codes[tag] = len(self.tags)
+            self.tags.append(tag)
+        return code
+
+    def _zone_bit(self, name: str) -> int:
+        bit = self._zone_bits.get(name)
+        if bit is None:
+            bit = self._zone_bits[name] = 1 << len(self.zones)
+            self.zones.append(name)
+        return bit
+
+    def _zone_mask(self, track_detections) -> int:
+        bits = 0
+        for d in track_detections:
+            for z in d.get("zones") or ():
+                name = z.get("name")
+                if name:
+                    bits |= self._zone_bit(name)
+        return bits
+
+    def zone_names(self, bits: int) -> list[str]:
+        return [name for i, name in enumerate(self.zones) if bits >> i & 1]
+
+    def decode(self, nodes: Iterable[dict]) -> TrackColumns:
+        nodes = list(nodes)
+        n = len(nodes)
+        tag_codes = self._tag_codes
+        tags = [node.get("tag", "unknown") for node in nodes]
+        node_detections = [node.get("detections") or () for node in nodes]
+        detections = np.fromiter(map(len, node_detections), dtype=np.int32, count=n)
+
+        # Confidences of every detection of the page in one list, summed per track by a
+        # weighted bincount (in detection order, like sum() over the track's list)
+        try:
+            confidences = [d["metadata"]["track_confidence"] for ds in node_detections for d in ds]
+        except (KeyError, TypeError):
+            confidences = [(d.get("metadata") or {}).get("track_confidence") for ds in node_detections for d in ds]
+        confidences = np.array(confidences, dtype=np.float64)  # None -> NaN
+        present = ~np.isnan(confidences)
+        rows = np.repeat(np.arange(n), detections)[present]
+
+        # Zone bits are distinct powers of two, their sum over a set of names is the bitset
+        try:
+            bit = self._zone_bits.__getitem__
+            zone_masks = [sum(map(bit, {z["name"] for d in ds for z in d["zones"]})) for ds in node_detections]
+        except (KeyError, TypeError):
+            zone_masks = [self._zone_mask(ds) for ds in node_detections]
+
+        epoch, valid = parse_epoch_us([node.get("startTime") for node in nodes] + [node.get("endTime") for node in nodes])
+        return TrackColumns(
+            ids=[node.get("id") for node in nodes],
+            thumbnails=[(node.get("video") or {}).get("thumbnailUrl") for node in nodes],
+            start=epoch[:n],
+            end=epoch[n:],
+            has_times=valid[:n] & valid[n:],
+            tag=np.array([tag_codes[t] if t in tag_codes else self._tag_code(t) for t in tags], dtype=np.int32),
+            detections=detections,
+            confidence_sum=np.bincount(rows, weights=confidences[present], minlength=n),
+            confidence_count=np.bincount(rows, minlength=n).astype(np.int32),
+            zones=self._zone_words(zone_masks),
+        )
+
+    def _zone_words(self, zone_sets: list[int]) -> np.ndarray:
+        words = max(1, -(-len(self.zones) // _ZONE_WORD_BITS))
+        if words == 1:
+            return np.array(zone_sets, dtype=np.uint64).reshape(len(zone_sets), 1)
+        mask = (1 << _ZONE_WORD_BITS) - 1
+        return np.array(
+            [[bits >> (w * _ZONE_WORD_BITS) & mask for w in range(words)] for bits in zone_sets],
+            dtype=np.uint64,
+        ).reshape(len(zone_sets), words)
+
+    @staticmethod
+    def zone_int(words: np.ndarray) -> int:
+        return sum(int(word) << (w * _ZONE_WORD_BITS) for w, word in enumerate(words))
+
+
+def _epoch_us(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * _US)
+
+
+def _iso(epoch_us: int) -> str:
+    return datetime.fromtimestamp(epoch_us / _US, tz=timezone.utc).isoformat(timespec="seconds")
+
+
+# Distinct rows of the key columns (one array per column, all of length n) and the group
+# of every row. The columns are packed into one int64 per row, digits of a mixed radix
+# number, so groups are found among plain integers instead of rows.
+def _group(keys: list[np.ndarray], n: int) -> tuple[np.ndarray, np.ndarray]:
+    if not keys:
+        return np.zeros((1, 0), dtype=np.int64), np.zeros(n, dtype=np.int64)
+    lows = [int(k.min()) for k in keys]
+    radixes = [int(k.max()) - low + 1 for k, low in zip(keys, lows)]
+    if np.prod(radixes, dtype=float) >= 2 ** 62:
+        groups, inverse = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+        return groups, inverse.reshape(-1)
+
+    packed = np.zeros(n, dtype=np.int64)
+    for k, low, radix in zip(keys, lows, radixes):
+        packed = packed * radix + (k - low)
+    total = int(np.prod(radixes))
+    if total <= max(4 * n, 1 << 16):
+        # Small key space (tags x zones, buckets x tags): dense lookup instead of a sort
+        distinct = np.flatnonzero(np.bincount(packed, minlength=total))
+        lookup = np.zeros(total, dtype=np.int64)
+        lookup[distinct] = np.arange(len(distinct))
+        inverse = lookup[packed]
+    else:
+        distinct, inverse = np.unique(packed, return_inverse=True)
+    groups = np.empty((len(distinct), len(keys)), dtype=np.int64)
+    for column in range(len(keys) - 1, -1, -1):
+        distinct, digit = np.divmod(distinct, radixes[column])
+        groups[:, column] = digit + lows[column]
+    return groups, inverse.reshape(-1)
+
+
+# Fixed capacity ring of one device's track summaries, one numpy array per column.
+#
+# Timestamps are microseconds since the epoch, tags codes into the decoder's tag list and
+# zones a bitset over its zone list (one uint64 word per 64 zones, widened when the
+# decoder learns more). A track seen again (windows overlap, tracks grow) overwrites its
+# slot. The columns grow with the number of tracks up to `capacity`, after that the slot
+# written longest ago is reused.
+class DeviceTrackRing:
+    COLUMNS = ("ids", "valid", "start", "end", "tag", "detections", "confidence", "zones")
+
+    def __init__(self, capacity: int, decoder: TrackPageDecoder, initial: int = 1024):
+        self.capacity = capacity
+        self.decoder = decoder
+        self.lock = threading.Lock()
+        self._allocate(min(capacity, initial), 1)
+        self._slots: dict = {}  # track id -> slot
+        self._next = 0
+        self._wrapped = False
+
+    def _allocate(self, size: int, words: int):
+        self.ids = np.full(size, None, dtype=object)
+        self.valid = np.zeros(size, dtype=bool)
+        self.start = np.zeros(size, dtype=np.int64)
+        self.end = np.zeros(size, dtype=np.int64)
+        self.tag = np.zeros(size, dtype=np.int32)
+        self.detections = np.zeros(size, dtype=np.int32)
+        self.confidence = np.full(size, np.nan, dtype=np.float32)
+        self.zones = np.zeros((size, words), dtype=np.uint64)
+
+    # Columns grow by doubling until they hold `capacity` tracks, `words` zone words per track
+    def _reserve(self, size: int, words: int):
+        allocated = len(self.valid)
+        if size <= allocated and words <= self.zones.shape[1]:
+            return
+        old = {name: getattr(self, name) for name in self.COLUMNS}
+        size = min(self.capacity, max(size, allocated * 2)) if size > allocated else allocated
+        self._allocate(size, max(words, self.zones.shape[1]))
+        for name, column in old.items():
+            if name == "zones":
+                self.zones[:allocated, :column.shape[1]] = column
+            else:
+                getattr(self, name)[:allocated] = column
+
+    def __len__(self):
+        return len(self._slots)
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    def _slot(self, track_id) -> int:
+        slot = self._slots.get(track_id)
+        if slot is None:
+            slot = self._next
+            self._next = (slot + 1) % self.capacity
+            self._wrapped = self._wrapped or self._next == 0
+            if self.valid[slot]:
+                del self._slots[self.ids[slot]]
+            self._slots[track_id] = slot
+        return slot
+
+    # Rows without both timestamps are skipped, they have no place on the time axis
+    def add(self, columns: TrackColumns):
+        rows = np.flatnonzero(columns.has_times)[-self.capacity:]
+        if not len(rows):
+            return
+        words = columns.zones.shape[1]
+        with self.lock:
+            if self._wrapped:
+                self._reserve(self.capacity, words)
+            else:
+                new = sum(columns.ids[i] not in self._slots for i in rows)
+                self._reserve(min(self.capacity, self._next + new), words)
+            slots = np.fromiter((self._slot(columns.ids[i]) for i in rows), dtype=np.int64, count=len(rows))
+            count = columns.confidence_count[rows]
+            self.ids[slots] = [columns.ids[i] for i in rows]
+            self.valid[slots] = True
+            self.start[slots] = columns.start[rows]
+            self.end[slots] = columns.end[rows]
+            self.tag[slots] = columns.tag[rows]
+            self.detections[slots] = columns.detections[rows]
+            self.confidence[slots] = np.where(count > 0, columns.confidence_sum[rows] / np.maximum(count, 1), np.nan)
+            self.zones[slots] = 0
+            self.zones[slots, :words] = columns.zones[rows]
+
+    # Drops the tracks that ended before `cutoff_us`
+    def expire(self, cutoff_us: int):
+        with self.lock:
+            expired = np.flatnonzero(self.valid & (self.end < cutoff_us))
+            for slot in expired:
+                del self._slots[self.ids[slot]]
+            self.valid[expired] = False
+            self.ids[expired] = None
+
+    # Slots of the tracks overlapping [since, until)
+    def rows(self, since_us: Optional[int] = None, until_us: Optional[int] = None) -> np.ndarray:
+        mask = self.valid.copy()
+        if since_us is not None:
+            mask &= self.end >= since_us
+        if until_us is not None:
+            mask &= self.start < until_us
+        return np.flatnonzero(mask)
+
+    def values(self, column: str, rows: np.ndarray) -> np.ndarray:
+        if column == "length":
+            return (self.end[rows] - self.start[rows]) / _US
+        if column == "detections":
+            return self.detections[rows].astype(np.float64)
+        if column == "confidence":
+            return self.confidence[rows].astype(np.float64)
+        raise ValueError(f"unknown column {column!r}, expected one of {', '.join(VALUE_COLUMNS)}")
+
+    # (zone index, row) pairs for every zone each row visited
+    def zone_pairs(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        zone_codes, row_indexes = [], []
+        for z in range(len(self.decoder.zones)):
+            word, bit = divmod(z, _ZONE_WORD_BITS)
+            if word >= self.zones.shape[1]:
+                break
+            hit = np.flatnonzero((self.zones[rows, word] >> np.uint64(bit)) & np.uint64(1))
+            zone_codes.append(np.full(len(hit), z, dtype=np.int64))
+            row_indexes.append(hit)
+        if not zone_codes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(zone_codes), np.concatenate(row_indexes)
+
+    def zone_names(self, slot: int) -> list[str]:
+        return self.decoder.zone_names(TrackPageDecoder.zone_int(self.zones[slot]))
+
+
+# In-memory store of the last `hours` of track summaries of every device.
+#
+# Fed with the pages the aggregation fetches anyway, so other cuts of the same tracks
+# (per zone, per 5 minutes, tag x zone, confidence histograms, top-K by any column) are
+# answered from RAM without asking the Worlds API again. Memory is bounded by `capacity`
+# tracks per device, about 40 bytes of columns per track plus its id.
+class TrackStore:
+    def __init__(self, hours: float = 24, capacity: int = 200_000):
+        self.retention_us = int(hours * 3600 * _US)
+        self.capacity = capacity
+        self._rings: dict[str, DeviceTrackRing] = {}
+        self._lock = threading.Lock()
+
+    def ring(self, device_id: str) -> DeviceTrackRing:
+        ring = self._rings.get(device_id)
+        if ring is None:
+            with self._lock:
+                ring = self._rings.setdefault(device_id, DeviceTrackRing(self.capacity, TrackPageDecoder()))
+        return ring
+
+    # The device's dictionary of tags and zones
+    def decoder(self, device_id: str) -> TrackPageDecoder:
+        return self.ring(device_id).decoder
+
+    def devices(self) -> list[str]:
+        return list(self._rings)
+
+    def nbytes(self) -> int:
+        return sum(ring.nbytes() for ring in list(self._rings.values()))
+
+    def tracks(self) -> int:
+        return sum(len(ring) for ring in list(self._rings.values()))
+
+    def add_columns(self, device_id: str, columns: TrackColumns, now: Optional[datetime] = None):
+        ring = self.ring(device_id)
+        ring.add(columns)
+        ring.expire(_epoch_us(now or datetime.now(timezone.utc)) - self.retention_us)
+
+    def add_nodes(self, device_id: str, nodes: Iterable[dict], now: Optional[datetime] = None) -> TrackColumns:
+        columns = self.decoder(device_id).decode(nodes)
+        self.add_columns(device_id, columns, now)
+        return columns
+
+    # Groups the device's tracks overlapping [since, until) by any of "tag" and "zone"
+    # (a track counts once for every zone it visited) and, with `bucket_seconds`, by the
+    # time bucket its start falls in, then aggregates `value` (a VALUE_COLUMNS column,
+    # only needed for aggregates other than "count") per group. Tracks without a
+    # confidence are left out of confidence aggregates.
+    #
+    #   store.rollup(device_id, by=("tag", "zone"))
+    #   store.rollup(device_id, by=("tag",), bucket_seconds=300)
+    #   store.rollup(device_id, by=("zone",), value="length", agg="mean")
+    def rollup(self, device_id: str, by: Sequence[str] = ("tag",), bucket_seconds: Optional[float] = None,
+               value: Optional[str] = None, agg: str = "count", since: Optional[datetime] = None,
+               until: Optional[datetime] = None) -> list[dict]:
+        if agg not in AGGREGATES:
+            raise ValueError(f"unknown aggregate {agg!r}, expected one of {', '.join(AGGREGATES)}")
+        if agg != "count" and value is None:
+            raise ValueError(f"{agg} needs a value column")
+        unknown = set(by) - {"tag", "zone"}
+        if unknown:
+            raise ValueError(f"can not group by {', '.join(sorted(unknown))}, expected tag or zone")
+        ring = self._rings.get(device_id)
+        if ring is None:
+            return []
+
+        with ring.lock:
+            rows = ring.rows(_epoch_us(since), _epoch_us(until))
+            zone_codes = None
+            if "zone" in by:
+                zone_codes, picked = ring.zone_pairs(rows)
+                rows = rows[picked]
+            values = ring.values(value, rows) if value else np.ones(len(rows))
+            keys, names = [], []
+            if bucket_seconds:
+                bucket_us = int(bucket_seconds * _US)
+                keys.append(ring.start[rows] // bucket_us * bucket_us)
+                names.append("bucket")
+            for name in by:
+                keys.append(ring.tag[rows].astype(np.int64) if name == "tag" else zone_codes)
+                names.append(name)
+            tags, zones = list(ring.decoder.tags), list(ring.decoder.zones)
+
+        present = ~np.isnan(values)
+        values = values[present]
+        keys = [k[present] for k in keys]
+        if not len(values):
+            return []
+        groups, inverse = _group(keys, len(values))
+
+        counts = np.bincount(inverse, minlength=len(groups))
+        if agg == "count":
+            result = counts
+        elif agg in ("sum", "mean"):
+            result = np.bincount(inverse, weights=values, minlength=len(groups))
+            if agg == "mean":
+                result = result / counts
+        else:
+            result = np.full(len(groups), np.inf if agg == "min" else -np.inf)
+            (np.minimum if agg == "min" else np.maximum).at(result, inverse, values)
+
+        decode = {"bucket": _iso, "tag": tags.__getitem__, "zone": zones.__getitem__}
+        return [
+            {**{name: decode[name](int(key)) for name, key in zip(names, group)},
+             "value": int(v) if agg == "count" else float(v)}
+            for group, v in zip(groups, result)
+        ]
+
+    # The k tracks with the largest `by` column (VALUE_COLUMNS) overlapping [since, until),
+    # ranked like TopK
+    def top(self, device_id: str, k: int = 5, by: str = "length", since: Optional[datetime] = None,
+            until: Optional[datetime] = None) -> list[dict]:
+        ring = self._rings.get(device_id)
+        if ring is None or k <= 0:
+            return []
+        with ring.lock:
+            rows = ring.rows(_epoch_us(since), _epoch_us(until))
+            values = ring.values(by, rows)
+            rows, values = rows[~np.isnan(values)], values[~np.isnan(values)]
+            if len(rows) > k:
+                # Everything tied with the k-th value stays a candidate, ties go to the larger
+                # id like in TopK
+                keep = values >= np.partition(values, len(values) - k)[len(values) - k]
+                rows, values = rows[keep], values[keep]
+            ranked = sorted(zip(values.tolist(), ring.ids[rows], rows.tolist()), reverse=True)[:k]
+            return [self._track(ring, slot) for _, _, slot in ranked]
+
+    @staticmethod
+    def _track(ring: DeviceTrackRing, slot: int) -> dict:
+        confidence = float(ring.confidence[slot])
+        return {
+            "id": ring.ids[slot],
+            "tag": ring.decoder.tags[ring.tag[slot]],
+            "start": _iso(int(ring.start[slot])),
+            "end": _iso(int(ring.end[slot])),
+            "length": (int(ring.end[slot]) - int(ring.start[slot])) / _US,
+            "detections": int(ring.detections[slot]),
+            "track_confidence_average": None if np.isnan(confidence) else confidence,
+            "zones": ring.zone_names(slot),
+        }
+
+    # Histogram of a VALUE_COLUMNS column over the tracks overlapping [since, until),
+    # values outside `value_range` are not counted
+    def histogram(self, device_id: str, column: str = "confidence", bins: int = 10,
+                  value_range: tuple[float, float] = (0.0, 1.0), since: Optional[datetime] = None,
+                  until: Optional[datetime] = None) -> dict:
+        ring = self._rings.get(device_id)
+        values = np.zeros(0)
+        if ring is not None:
+            with ring.lock:
+                values = ring.values(column, ring.rows(_epoch_us(since), _epoch_us(until)))
+        counts, edges = np.histogram(values[~np.isnan(values)], bins=bins, range=value_range)
+        return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+# JSON over HTTP for the store's queries, so dashboards and ad-hoc scripts can ask for cuts
+# of the recent tracks without going through the Worlds API or the database. The time
+# range is `hours` back from now or `since`/`until` as ISO-8601, both optional.
+#
+#   GET /devices
+#   GET /rollup?device_id=...&by=tag,zone&bucket_seconds=300&value=length&agg=mean&hours=1
+#   GET /top?device_id=...&k=5&by=detections
+#   GET /histogram?device_id=...&column=confidence&bins=10&min=0&max=1
+class TrackStoreHandler(BaseHTTPRequestHandler):
+    store: TrackStore
+
+    def _range(self, params: dict) -> dict:
+        if "hours" in params:
+            return {"since": datetime.now(timezone.utc) - timedelta(hours=float(params["hours"])), "until": None}
+        span = {}
+        for name in ("since", "until"):
+            span[name] = parse_timestamp(params[name]) if name in params else None
+            if name in params and span[name] is None:
+                raise ValueError(f"{name} is not an ISO-8601 date or time: {params[name]!r}")
+        return span
+
+    def _query(self, path: str, params: dict):
+        if path == "/devices":
+            return [{"device_id": d, "tracks": len(self.store.ring(d))} for d in self.store.devices()]
+        if path not in ("/rollup", "/top", "/histogram"):
+            return None
+        if "device_id" not in params:
+            raise ValueError("device_id is required")
+        device_id, span = params["device_id"], self._range(params)
+        if path == "/rollup":
+            bucket = params.get("bucket_seconds")
+            return self.store.rollup(device_id, by=[b for b in params.get("by", "tag").split(",") if b],
+                                     bucket_seconds=float(bucket) if bucket else None, value=params.get("value"),
+                                     agg=params.get("agg", "count"), **span)
+        if path == "/top":
+            return self.store.top(device_id, int(params.get("k", 5)), by=params.get("by", "length"), **span)
+        return self.store.histogram(device_id, params.get("column", "confidence"), bins=int(params.get("bins", 10)),
+                                    value_range=(float(params.get("min", 0)), float(params.get("max", 1))), **span)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            result = self._query(url.path.rstrip("/") or "/", params)
+            status = 200 if result is not None else 404
+            if result is None:
+                result = {"error": f"unknown path {url.path}"}
+        except ValueError as e:
+            status, result = 400, {"error": str(e)}
+        body = json.dumps(result).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+# Serves `store` on `port` from a daemon thread, returns the server
+def start_track_store_server(store: TrackStore, port: int) -> ThreadingHTTPServer:
+    handler = type("BoundTrackStoreHandler", (TrackStoreHandler,), {"store": store})
+    server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="track-store-http", daemon=True).start()
+    logger.info(f"Serving track store queries on :{port}")
+    return server
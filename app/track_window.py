@@ -0,0 +1,121 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from track_aggregation import TopK, track_record
+
+logger = logging.getLogger(__name__)
+
+# Each cycle re-reads this far before the watermark, for tracks the API indexed late.
+# Tracks still open are not left to the overlap: the API's time.between filter may match
+# tracks by startTime, so an open track that started before the overlap would never be
+# returned again once closed. TrackWindow keeps their start times and fetches from the
+# earliest one instead, whatever the filter matches on.
+OVERLAP_SECONDS = 120
+
+
+class MinuteBucket:
+    # Partial aggregates for tracks that ended (or, still open, started) within one minute.
+    __slots__ = ("tag_counts", "top", "zones")
+
+    def __init__(self, max_tracks: int):
+        self.tag_counts: dict[str, int] = {}
+        self.top = TopK(max_tracks)  # (length, id, track)
+        self.zones: set[str] = set()
+
+
+# Rolling window of track aggregates for one device.
+#
+# Tracks are bucketed per minute of their endTime. Each cycle only needs the tracks
+# newer than the watermark (the latest endTime seen so far), which are merged into
+# their buckets while buckets that fell out of the window are dropped. The window
+# result is then re-assembled from at most `minutes` small buckets.
+#
+# Tracks still in progress (no endTime) are bucketed by their startTime, so their tag
+# and zones count right away like in aggregate_tracks. fetch_range reaches back to the
+# earliest open track, so each is fetched again once closed; its tag count then moves
+# to its endTime bucket, counted once through `seen`.
+class TrackWindow:
+    def __init__(self, device_id: str, minutes: int = 60, max_tracks: int = 5, overlap_seconds: int = OVERLAP_SECONDS):
+        self.device_id = device_id
+        self.minutes = minutes
+        self.max_tracks = max_tracks
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.watermark: Optional[datetime] = None
+        self.buckets: dict[int, MinuteBucket] = {}
+        self.seen: dict[str, int] = {}  # track id -> minute bucket it was counted in
+        self.open: dict[str, datetime] = {}  # track id -> startTime of tracks without endTime yet
+
+    def fetch_range(self, now: datetime) -> tuple[datetime, datetime]:
+        window_start = now - timedelta(minutes=self.minutes)
+        if self.watermark is None:
+            return window_start, now
+        start = self.watermark - self.overlap
+        if self.open:
+            start = min(start, min(self.open.values()))
+        return max(window_start, start), now
+
+    def add(self, track: dict, now: Optional[datetime] = None):
+        when = track["end"] or track.get("start") or now
+        if when is None:
+            return
+        minute = int(when.timestamp()) // 60
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            bucket = self.buckets[minute] = MinuteBucket(self.max_tracks)
+
+        track_id = track["id"]
+        if track["end"] is None:
+            self.open[track_id] = when
+        else:
+            self.open.pop(track_id, None)
+
+        counted = self.seen.get(track_id)
+        if counted != minute:
+            # A closed track counted while open moves to its endTime bucket
+            previous = self.buckets.get(counted) if counted is not None else None
+            if previous is not None and previous.tag_counts.get(track["tag"]):
+                previous.tag_counts[track["tag"]] -= 1
+                if not previous.tag_counts[track["tag"]]:
+                    del previous.tag_counts[track["tag"]]
+            bucket.tag_counts[track["tag"]] = bucket.tag_counts.get(track["tag"], 0) + 1
+            self.seen[track_id] = minute
+
+        # A track that is seen again has grown, its newer candidate wins when merging
+        bucket.zones.update(track["zones"])
+        bucket.top.offer(track["length"], track_id, track)
+
+    def advance(self, end: Optional[datetime]):
+        if end is not None and (self.watermark is None or end > self.watermark):
+            self.watermark = end
+
+    def expire(self, now: datetime):
+        oldest = int((now - timedelta(minutes=self.minutes)).timestamp()) // 60
+        expired = [m for m in self.buckets if m < oldest]
+        for minute in expired:
+            del self.buckets[minute]
+        if expired:
+            self.seen = {track_id: m for track_id, m in self.seen.items() if m >= oldest}
+        window_start = now - timedelta(minutes=self.minutes)
+        self.open = {track_id: start for track_id, start in self.open.items() if start >= window_start}
+
+    def result(self, timestamp: str) -> dict:
+        tag_counts = {}
+        zones = set()
+        candidates = {}
+        for bucket in self.buckets.values():
+            for tag, count in bucket.tag_counts.items():
+                tag_counts[tag] = tag_counts.get(tag, 0) + count
+            zones.update(bucket.zones)
+            for length, track_id, track in bucket.top:
+                if track_id not in candidates or length > candidates[track_id]["length"]:
+                    candidates[track_id] = track
+
+        top = heapq.nlargest(self.max_tracks, candidates.values(), key=lambda t: (t["length"], t["id"]))
+        base_record = {"device_id": self.device_id, "timestamp": timestamp}
+        return {
+            "tags": {**base_record, "tags": [{"tag": t, "count": c} for t, c in tag_counts.items()]},
+            "top_tracks": [track_record(t, self.device_id, timestamp) for t in top],
+            "zones": {**base_record, "zones": list(zones)},
+        }
@@ -1,17 +1,70 @@
 import os
+import time
+import random
 import asyncio
+import inspect
+import threading
 import requests
 import logging
+import aiohttp
+import orjson
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from gql import Client, gql
+from gql import Client
 from gql.transport.websockets import WebsocketsTransport
-from typing import Callable, Optional
+from requests.adapters import HTTPAdapter
+from typing import AsyncIterator, Callable, Optional
+from query_registry import QueryRegistry, get_registry
+from response_cache import ResponseCache
+from metrics import (
+    RESPONSE_CACHE_BYTES, SUBSCRIPTION_ERRORS, SUBSCRIPTION_EVENTS, WORLDS_GRAPHQL_ERRORS, WORLDS_REQUEST_RETRIES,
+    observe_request,
+)
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class WorldsAPIClient:
-    def __init__(self):
+# HTTP transport settings, one pooled keep-alive session is shared by every request of a client
+HTTP_POOL_SIZE = int(os.getenv("WORLDS_HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("WORLDS_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("WORLDS_HTTP_READ_TIMEOUT", "15"))
+HTTP_MAX_RETRIES = int(os.getenv("WORLDS_HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.getenv("WORLDS_HTTP_BACKOFF_BASE", "0.5"))  # seconds
+HTTP_BACKOFF_MAX = float(os.getenv("WORLDS_HTTP_BACKOFF_MAX", "30"))  # seconds
+# Upper bound of in-flight requests of one AsyncWorldsAPIClient
+HTTP_MAX_CONCURRENCY = int(os.getenv("WORLDS_HTTP_MAX_CONCURRENCY", str(HTTP_POOL_SIZE)))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Automatic Persisted Queries: send only the document hash, the full text is sent once when the server misses it
+PERSISTED_QUERIES = os.getenv("WORLDS_PERSISTED_QUERIES", "false").lower() in ("1", "true", "yes")
+APQ_NOT_FOUND = "PersistedQueryNotFound"
+APQ_NOT_SUPPORTED = "PersistedQueryNotSupported"
+# Opt-in on-disk cache of query responses whose time range ended RESPONSE_CACHE_SETTLED_SECONDS ago
+RESPONSE_CACHE_ENABLED = os.getenv("WORLDS_RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_DIR = os.getenv("WORLDS_RESPONSE_CACHE_DIR", "cache/responses")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("WORLDS_RESPONSE_CACHE_MAX_BYTES", str(1 << 30)))
+RESPONSE_CACHE_SETTLED_SECONDS = float(os.getenv("WORLDS_RESPONSE_CACHE_SETTLED_SECONDS", "3600"))
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+# Process wide response cache, opened on first use
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES,
+                                                RESPONSE_CACHE_SETTLED_SECONDS)
+                RESPONSE_CACHE_BYTES.set_function(lambda: _response_cache.bytes)
+    return _response_cache
+
+
+# Configuration, query loading, response helpers and subscriptions shared by
+# the blocking and the asyncio clients.
+class WorldsAPIBase:
+    def __init__(self, queries: Optional[QueryRegistry] = None, cache: Optional[ResponseCache] = None):
         self.api_url = os.getenv("WORLDS_API_URL")
         self.ws_url = os.getenv("WORLDS_WS_URL")
         self.token_id = os.getenv("WORLDS_TOKEN_ID")
@@ -21,42 +74,77 @@ class WorldsAPIClient:
         self.headers = {
             "x-token-id": self.token_id,
             "x-token-value": self.token_value,
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate, br",
         }
+        self.max_retries = HTTP_MAX_RETRIES
+        self.queries = queries or get_registry()
+        self.persisted_queries = PERSISTED_QUERIES
+        self.cache = cache or (get_response_cache() if RESPONSE_CACHE_ENABLED else None)
 
-    def _load_query(self, name: str) -> str:
-        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "queries", f"{name}.graphql")
-        if not os.path.exists(path):
-            logger.error(f"Query file not found: {path}")
-            raise FileNotFoundError(f"Query file not found: {path}")
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+    @staticmethod
+    def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), HTTP_BACKOFF_MAX)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(delay, 0.0), HTTP_BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
 
-    def _post(self, query_str: str, variables: Optional[dict] = None) -> dict:
-        payload = {"query": query_str}
+    @staticmethod
+    def _payload(query_str: Optional[str], variables: Optional[dict] = None, query_hash: Optional[str] = None) -> dict:
+        payload = {}
+        if query_str is not None:
+            payload["query"] = query_str
         if variables:
             payload["variables"] = variables
-        try:
-            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=15)
-            response.raise_for_status()
-            data = response.json()
-            if "errors" in data:
-                logger.warning(f"GraphQL returned errors: {data['errors']}")
-            return data
-        except requests.Timeout:
-            logger.error("Request to Worlds API timed out.")
-            raise
-        except requests.RequestException as e:
-            logger.error(f"HTTP request failed: {e}")
-            raise
+        if query_hash:
+            payload["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+        return payload
 
-    def execute_query(self, query_name: str, variables: Optional[dict] = None) -> dict:
-        query_str = self._load_query(query_name)
-        return self._post(query_str, variables)
+    @staticmethod
+    def _persisted_query_miss(data: dict) -> Optional[str]:
+        for error in data.get("errors") or []:
+            message = error.get("message")
+            code = (error.get("extensions") or {}).get("code")
+            if message == APQ_NOT_FOUND or code == "PERSISTED_QUERY_NOT_FOUND":
+                return APQ_NOT_FOUND
+            if message == APQ_NOT_SUPPORTED or code == "PERSISTED_QUERY_NOT_SUPPORTED":
+                return APQ_NOT_SUPPORTED
+        return None
 
-    def execute_mutation(self, mutation_name: str, variables: Optional[dict] = None) -> dict:
-        mutation_str = self._load_query(mutation_name)
-        return self._post(mutation_str, variables)
+    # Decides what to do after a hash-only request: None means the response is final,
+    # otherwise the document has to be sent in full (with its hash so the server stores it).
+    def _after_persisted_attempt(self, name: str, data: dict) -> Optional[str]:
+        miss = self._persisted_query_miss(data)
+        if miss == APQ_NOT_SUPPORTED:
+            logger.warning("Worlds API does not support persisted queries, sending full documents.")
+            self.persisted_queries = False
+            return self.queries.get(name).text
+        if miss == APQ_NOT_FOUND:
+            logger.info(f"Registering persisted query {name}")
+            return self.queries.get(name).text
+        return None
+
+    # Cache key of a settled query, None when the response must come from the API
+    def _cache_key(self, name: str, variables: Optional[dict]) -> Optional[str]:
+        if self.cache is None or not self.cache.cacheable(variables):
+            return None
+        return self.cache.key(self.queries.get(name).sha256, variables)
+
+    @staticmethod
+    def _cacheable_response(data: dict) -> bool:
+        return bool(data.get("data")) and not data.get("errors")
+
+    def _log_errors(self, data: dict):
+        if "errors" in data and not self._persisted_query_miss(data):
+            WORLDS_GRAPHQL_ERRORS.inc()
+            logger.warning(f"GraphQL returned errors: {data['errors']}")
 
     @staticmethod
     def get_default_variables() -> dict:
@@ -74,6 +162,12 @@ class WorldsAPIClient:
                     result.append(node)
         return result
 
+    @staticmethod
+    def extract_page_info(api_response: dict) -> Optional[dict]:
+        for value in api_response.get("data", {}).values():
+            return value.get("pageInfo")
+        return None
+
     async def subscribe(self, query_name: str, variables: Optional[dict] = None, callback: Optional[Callable] = None):
         transport = WebsocketsTransport(
             url=self.ws_url,
@@ -83,19 +177,245 @@ class WorldsAPIClient:
                 "x-token-value": self.token_value,
             },
         )
-        query_str = self._load_query(query_name)
-        subscription = gql(query_str)
+        subscription = self.queries.get(query_name).document
+        events = SUBSCRIPTION_EVENTS.labels(query_name)
         try:
             async with Client(transport=transport, fetch_schema_from_transport=False) as session:
                 async for result in session.subscribe(subscription, variable_values=variables or {}):
+                    events.inc()
                     if callback:
                         try:
-                            callback(result)
+                            # Coroutine callbacks are awaited, so a full ingest queue slows the reader down
+                            outcome = callback(result)
+                            if inspect.isawaitable(outcome):
+                                await outcome
                         except Exception as cb_err:
                             logger.exception(f"Error in subscription callback: {cb_err}")
                     else:
                         logger.info(f"New subscription event: {result}")
         except asyncio.CancelledError:
             logger.info(f"Subscription cancelled for {query_name}")
+            raise
         except Exception as e:
+            SUBSCRIPTION_ERRORS.labels(query_name).inc()
             logger.exception(f"Subscription error for {query_name}: {e}")
+        # gql ends the subscription quietly when its task is cancelled, the cancellation is
+        # passed on so a reconnect loop around subscribe() stops with its task
+        task = asyncio.current_task()
+        if task is not None and task.cancelling():
+            logger.info(f"Subscription cancelled for {query_name}")
+            raise asyncio.CancelledError()
+
+
+class WorldsAPIClient(WorldsAPIBase):
+    def __init__(self, queries: Optional[QueryRegistry] = None, cache: Optional[ResponseCache] = None):
+        super().__init__(queries, cache)
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.session = self._build_session(HTTP_POOL_SIZE)
+
+    def _build_session(self, pool_size: int) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(self.headers)
+        # Retries are done in _post so they can honour Retry-After and add jitter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    # Mutations are not idempotent, they are only retried when the request
+    # can not have been processed (429 or a failure to connect).
+    def _post(self, query_str: Optional[str], variables: Optional[dict] = None, idempotent: bool = True,
+              query_hash: Optional[str] = None) -> dict:
+        payload = self._payload(query_str, variables, query_hash)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries \
+                        and (idempotent or response.status_code == 429):
+                    delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                    logger.warning(f"Worlds API returned {response.status_code}, retrying in {delay:.2f}s "
+                                   f"({attempt + 1}/{self.max_retries})")
+                    WORLDS_REQUEST_RETRIES.labels(str(response.status_code)).inc()
+                    response.close()
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                response.raise_for_status()
+                # orjson on the raw body, several times faster than response.json() on track pages
+                data = orjson.loads(response.content)
+                self._log_errors(data)
+                return data
+            except requests.exceptions.SSLError as e:
+                logger.error(f"HTTP request failed: {e}")
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    if isinstance(e, requests.Timeout):
+                        logger.error("Request to Worlds API timed out.")
+                    else:
+                        logger.error(f"HTTP request failed: {e}")
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Request to Worlds API failed ({e}), retrying in {delay:.2f}s "
+                               f"({attempt + 1}/{self.max_retries})")
+                WORLDS_REQUEST_RETRIES.labels(type(e).__name__).inc()
+                time.sleep(delay)
+                attempt += 1
+            except (requests.RequestException, orjson.JSONDecodeError) as e:
+                logger.error(f"HTTP request failed: {e}")
+                raise
+
+    def _execute(self, name: str, variables: Optional[dict] = None, idempotent: bool = True) -> dict:
+        with observe_request(name):
+            document = self.queries.get(name)
+            if not self.persisted_queries:
+                return self._post(document.text, variables, idempotent)
+
+            data = self._post(None, variables, idempotent, query_hash=document.sha256)
+            full_text = self._after_persisted_attempt(name, data)
+            if full_text is None:
+                return data
+            return self._post(full_text, variables, idempotent,
+                              query_hash=document.sha256 if self.persisted_queries else None)
+
+    def execute_query(self, query_name: str, variables: Optional[dict] = None) -> dict:
+        key = self._cache_key(query_name, variables)
+        if key is None:
+            return self._execute(query_name, variables)
+        data = self.cache.get(key, query_name)
+        if data is None:
+            data = self._execute(query_name, variables)
+            if self._cacheable_response(data):
+                self.cache.put(key, query_name, data)
+        return data
+
+    def execute_mutation(self, mutation_name: str, variables: Optional[dict] = None) -> dict:
+        return self._execute(mutation_name, variables, idempotent=False)
+
+
+# asyncio flavour of WorldsAPIClient.
+#
+# Queries and mutations share one aiohttp connection pool and at most `max_concurrency`
+# requests are in flight at a time, so many coroutines (dashboard aggregations, the
+# subscription service) can issue API calls from a single event loop without threads.
+class AsyncWorldsAPIClient(WorldsAPIBase):
+    def __init__(self, max_concurrency: int = HTTP_MAX_CONCURRENCY, queries: Optional[QueryRegistry] = None,
+                 cache: Optional[ResponseCache] = None):
+        super().__init__(queries, cache)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _post(self, query_str: Optional[str], variables: Optional[dict] = None, idempotent: bool = True,
+                    query_hash: Optional[str] = None) -> dict:
+        payload = self._payload(query_str, variables, query_hash)
+        session = self._get_session()
+
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    async with session.post(self.api_url, json=payload) as response:
+                        if response.status in RETRY_STATUSES and attempt < self.max_retries \
+                                and (idempotent or response.status == 429):
+                            delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                            logger.warning(f"Worlds API returned {response.status}, retrying in {delay:.2f}s "
+                                           f"({attempt + 1}/{self.max_retries})")
+                            WORLDS_REQUEST_RETRIES.labels(str(response.status)).inc()
+                        else:
+                            response.raise_for_status()
+                            data = orjson.loads(await response.read())
+                            self._log_errors(data)
+                            return data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                retryable = idempotent or isinstance(e, aiohttp.ClientConnectorError)
+                if not retryable or attempt >= self.max_retries:
+                    logger.error(f"HTTP request failed: {e!r}")
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Request to Worlds API failed ({e!r}), retrying in {delay:.2f}s "
+                               f"({attempt + 1}/{self.max_retries})")
+                WORLDS_REQUEST_RETRIES.labels(type(e).__name__).inc()
+            except aiohttp.ClientError as e:
+                logger.error(f"HTTP request failed: {e}")
+                raise
+            # Sleep outside of the semaphore so a backing-off request does not hold a slot
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _execute(self, name: str, variables: Optional[dict] = None, idempotent: bool = True) -> dict:
+        with observe_request(name):
+            document = self.queries.get(name)
+            if not self.persisted_queries:
+                return await self._post(document.text, variables, idempotent)
+
+            data = await self._post(None, variables, idempotent, query_hash=document.sha256)
+            full_text = self._after_persisted_attempt(name, data)
+            if full_text is None:
+                return data
+            return await self._post(full_text, variables, idempotent,
+                                    query_hash=document.sha256 if self.persisted_queries else None)
+
+    # Cache files are read and written in a thread, the event loop never waits on the disk
+    async def execute_query(self, query_name: str, variables: Optional[dict] = None) -> dict:
+        key = self._cache_key(query_name, variables)
+        if key is None:
+            return await self._execute(query_name, variables)
+        data = await asyncio.to_thread(self.cache.get, key, query_name)
+        if data is None:
+            data = await self._execute(query_name, variables)
+            if self._cacheable_response(data):
+                await asyncio.to_thread(self.cache.put, key, query_name, data)
+        return data
+
+    async def execute_mutation(self, mutation_name: str, variables: Optional[dict] = None) -> dict:
+        return await self._execute(mutation_name, variables, idempotent=False)
+
+    # Follows the pagination cursor, the next page is requested before the current one is yielded.
+    async def iter_pages(self, query_name: str, variables: Optional[dict] = None) -> AsyncIterator[dict]:
+        variables = dict(variables or self.get_default_variables())
+        seen_cursors = set()
+        pending = asyncio.ensure_future(self.execute_query(query_name, dict(variables)))
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+
+                page_info = self.extract_page_info(page)
+                end_cursor = page_info.get("endCursor") if page_info and page_info.get("hasNextPage") else None
+                if end_cursor and end_cursor not in seen_cursors:
+                    seen_cursors.add(end_cursor)
+                    variables["after"] = end_cursor
+                    pending = asyncio.ensure_future(self.execute_query(query_name, dict(variables)))
+
+                yield page
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def iter_nodes(self, query_name: str, variables: Optional[dict] = None) -> AsyncIterator[dict]:
+        async for page in self.iter_pages(query_name, variables):
+            for node in self.extract_nodes(page):
+                yield node
@@ -0,0 +1,27 @@
+import asyncio
+import logging
+
+import dashboard_service
+import subscription_service
+from worlds_api_client import AsyncWorldsAPIClient
+
+logger = logging.getLogger(__name__)
+
+
+# Runs the dashboard aggregation and the detection subscription on one event loop,
+# sharing a single AsyncWorldsAPIClient connection pool.
+async def main():
+    async with AsyncWorldsAPIClient() as client:
+        await asyncio.gather(
+            dashboard_service.main_async(client),
+            subscription_service.main(client),
+        )
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Application shutting down.")
+    except Exception as e:
+        logger.critical(f"An unrecoverable error occurred: {e}", exc_info=True)
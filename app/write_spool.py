@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Writer = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+# Append-only local spool in front of Postgres.
+#
+# Every append() is stored as one chunk (a JSON array of rows) in a SQLite database in WAL
+# mode, which costs about as much as a local file append and never waits on Postgres.
+# A drainer task replays the chunks in order through the writer registered for their kind,
+# merging consecutive chunks into batches of about `batch_size` rows, and deletes them once
+# the writer returned. Whatever was not drained yet survives a restart.
+#
+# Delivery is at-least-once: a crash between a successful write and the delete replays
+# that batch, writers have to be idempotent (detection buckets carry a batch_seq and go
+# through store_detection_events_bulk, events are upserted by id). The spool is capped at
+# `max_rows`, past that the oldest chunks are discarded.
+#
+# SQLite access and the JSON encoding/decoding of whole chunks run in worker threads
+# (asyncio.to_thread) under one lock, so a large batch never stalls the event loop.
+class WriteSpool:
+    def __init__(self, path: str, writers: Dict[str, Writer], batch_size: int = 5000,
+                 max_rows: int = 1_000_000, drain_interval: float = 1.0, max_backoff: float = 60.0):
+        self.path = path
+        self.writers = writers
+        self.batch_size = max(1, batch_size)
+        self.max_rows = max_rows
+        self.drain_interval = drain_interval
+        self.max_backoff = max_backoff
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL survives a process crash, only an OS crash can lose the last commits
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, rows INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._pending = self._db.execute("SELECT COALESCE(SUM(rows), 0) FROM spool").fetchone()[0]
+        self._wakeup = asyncio.Event()
+
+        self.appended = 0
+        self.drained = 0
+        self.discarded = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        if self._pending:
+            logger.info(f"Spool {path} has {self._pending} rows left from a previous run.")
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def append(self, kind: str, rows: Iterable[Dict[str, Any]]) -> int:
+        if kind not in self.writers:
+            raise ValueError(f"No writer registered for spool kind '{kind}'")
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        await asyncio.to_thread(self._append, kind, rows)
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return len(rows)
+
+    def _append(self, kind: str, rows: List[Dict[str, Any]]):
+        payload = json.dumps(rows, default=_encode)
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT INTO spool (kind, rows, payload) VALUES (?, ?, ?)",
+                (kind, len(rows), payload),
+            )
+            self._pending += len(rows)
+            discarded = 0
+            while self._pending > self.max_rows:
+                seq, count = self._db.execute("SELECT seq, rows FROM spool ORDER BY seq LIMIT 1").fetchone()
+                self._db.execute("DELETE FROM spool WHERE seq = ?", (seq,))
+                self._pending -= count
+                discarded += count
+        self.appended += len(rows)
+        if discarded:
+            self.discarded += discarded
+            logger.warning(f"Spool is full ({self.max_rows} rows), discarded the {discarded} oldest rows.")
+
+    # Oldest chunks adding up to about batch_size rows, at least one, decoded and grouped
+    # into (kind, last seq, rows) runs of consecutive chunks of the same kind
+    def _read_batch(self) -> List[tuple]:
+        chunks, total = [], 0
+        with self._lock:
+            for seq, kind, count, payload in self._db.execute(
+                    "SELECT seq, kind, rows, payload FROM spool ORDER BY seq"):
+                if chunks and total + count > self.batch_size:
+                    break
+                chunks.append((seq, kind, payload))
+                total += count
+        batch = []
+        for kind, group in groupby(chunks, key=lambda chunk: chunk[1]):
+            group = list(group)
+            rows = [row for chunk in group for row in json.loads(chunk[2], object_hook=_decode)]
+            batch.append((kind, group[-1][0], rows))
+        return batch
+
+    # append() may have discarded some of these chunks while they were being written,
+    # only the rows still in the spool come off _pending
+    def _checkpoint(self, last_seq: int):
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            deleted = self._db.execute("DELETE FROM spool WHERE seq <= ? RETURNING rows", (last_seq,)).fetchall()
+            self._pending -= sum(count for count, in deleted)
+
+    # Replays one batch, consecutive chunks of the same kind go to their writer together.
+    # Returns the number of rows written, raises if a writer failed.
+    async def drain_once(self) -> int:
+        written = 0
+        for kind, last_seq, rows in await asyncio.to_thread(self._read_batch):
+            await self.writers[kind](rows)
+            await asyncio.to_thread(self._checkpoint, last_seq)
+            self.drained += len(rows)
+            written += len(rows)
+        return written
+
+    async def run(self):
+        backoff = self.drain_interval
+        while True:
+            try:
+                written = await self.drain_once()
+                backoff = self.drain_interval
+                if written and self._pending:
+                    continue  # more is waiting, keep going
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, backoff * 2 or 1.0)
+                logger.error(f"Spool drain failed, {self._pending} rows pending, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.drain_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "appended": self.appended,
+            "drained": self.drained,
+            "discarded": self.discarded,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,98 @@
+# Peak memory and wall time of aggregate_tracks' streaming pipeline versus the previous
+# "keep every track then sort" approach, for growing track counts.
+#
+#   python benchmarks/bench_aggregate_memory.py --tracks 1000 10000 50000
+#
+# Pages are generated lazily so the numbers only reflect what the aggregation holds on to.
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from track_aggregation import TrackAggregator, parse_track, track_record  # noqa: E402
+
+TAGS = ["car", "person", "vehicle", "safety_barrier", "bicycle", "yellow_vest"]
+ZONES = ["Intersection", "Pedestrian Crossing", "Stop Light", "Parking Spot", "Pedetrian Crossing 2"]
+PAGE_SIZE = 50
+
+
+def make_node(rng: random.Random, i: int, now: datetime) -> dict:
+    start = now - timedelta(seconds=rng.uniform(60, 3600))
+    end = start + timedelta(seconds=rng.uniform(0.5, 60))
+    detections = [
+        {
+            "metadata": {"track_confidence": rng.random()},
+            "timestamp": (start + timedelta(seconds=d)).isoformat().replace("+00:00", "Z"),
+            "zones": [{"name": z} for z in rng.sample(ZONES, rng.randint(0, 3))],
+        }
+        for d in range(rng.randint(1, 15))
+    ]
+    return {
+        "id": f"track-{i:08d}",
+        "dataSource": {"id": "bench", "name": "bench"},
+        "video": {"thumbnailUrl": f"https://example.invalid/asset/{i}.m3u8?getThumbnail=true"},
+        "tag": rng.choice(TAGS),
+        "startTime": start.isoformat().replace("+00:00", "Z"),
+        "endTime": end.isoformat().replace("+00:00", "Z"),
+        "detections": detections,
+    }
+
+
+def iter_pages(tracks: int, seed: int = 7):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for first in range(0, tracks, PAGE_SIZE):
+        yield [make_node(rng, i, now) for i in range(first, min(first + PAGE_SIZE, tracks))]
+
+
+def streaming(tracks: int):
+    aggregator = TrackAggregator("bench", "now", max_tracks=5)
+    for nodes in iter_pages(tracks):
+        aggregator.add_nodes(nodes)
+    return aggregator.result()["top_tracks"]
+
+
+def keep_all(tracks: int):
+    track_details = {}
+    for nodes in iter_pages(tracks):
+        for node in nodes:
+            track = parse_track(node)
+            track_details[track["id"]] = track_record(track, "bench", "now")
+    return sorted(track_details.values(), key=lambda x: x["length"], reverse=True)[:5]
+
+
+def measure(fn, tracks: int):
+    tracemalloc.start()
+    started = time.perf_counter()
+    top = fn(tracks)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return top, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="aggregate_tracks memory benchmark")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    args = parser.parse_args()
+
+    print(f"{'tracks':>8} {'mode':>10} {'peak MiB':>9} {'seconds':>8}")
+    for tracks in args.tracks:
+        expected = None
+        for name, fn in (("keep-all", keep_all), ("streaming", streaming)):
+            top, elapsed, peak = measure(fn, tracks)
+            ids = [t["id"] for t in top]
+            if expected is None:
+                expected = ids
+            elif ids != expected:
+                raise SystemExit(f"top tracks differ for {tracks} tracks: {ids} != {expected}")
+            print(f"{tracks:>8} {name:>10} {peak / 2 ** 20:>9.2f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
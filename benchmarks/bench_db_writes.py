@@ -0,0 +1,77 @@
+# Rows/sec of the detection_events write paths in db/crud.py against a real Postgres:
+# the ORM bulk_insert_mappings path, multi-row INSERT, and COPY in text and binary format.
+#
+#   POSTGRES_HOST=localhost python benchmarks/bench_db_writes.py --rows 100000
+#
+# Rows are written with a unique source_id and deleted again afterwards.
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert as pg_insert  # noqa: E402
+
+from db.crud import copy_detection_events, store_detection_activity_bulk, _batches  # noqa: E402
+from db.db import SessionLocal  # noqa: E402
+from db.model import DetectionActivity  # noqa: E402
+
+TAGS = ["car", "person", "vehicle", "safety_barrier", "bicycle", "yellow_vest"]
+
+
+def make_rows(count: int, source_id: str) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "timestamp": now - timedelta(seconds=i),
+            "source_id": source_id,
+            "source_name": "Bourbon Street benchmark",
+            "tag": TAGS[i % len(TAGS)],
+            "event_count": i % 50 + 1,
+        }
+        for i in range(count)
+    ]
+
+
+def multi_row_insert(rows: list[dict], batch_size: int = 1000):
+    with SessionLocal() as db:
+        for batch in _batches(rows, batch_size):
+            db.execute(pg_insert(DetectionActivity), batch)
+        db.commit()
+
+
+def cleanup(source_id: str):
+    with SessionLocal() as db:
+        db.execute(delete(DetectionActivity).where(DetectionActivity.source_id == source_id))
+        db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="detection_events write path benchmark")
+    parser.add_argument("--rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    paths = [
+        ("orm bulk_insert_mappings", store_detection_activity_bulk),
+        ("multi-row INSERT", multi_row_insert),
+        ("COPY text", lambda rows: copy_detection_events(rows, fmt="text")),
+        ("COPY binary", lambda rows: copy_detection_events(rows, fmt="binary")),
+    ]
+    for label, write in paths:
+        source_id = f"bench-{uuid.uuid4()}"
+        rows = make_rows(args.rows, source_id)
+        started = time.perf_counter()
+        try:
+            write(rows)
+            elapsed = time.perf_counter() - started
+        finally:
+            cleanup(source_id)
+        print(f"{label:>26}: {args.rows / elapsed:>10,.0f} rows/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Schema expansion cost in APIDiscovery: the previous list_fields_recursive, which copied
+# the visited set at every branch and expanded every path, against the expansion memoized
+# per (type, depth), on a synthetic, densely linked schema saved to a file and loaded
+# offline with WorldsAPIDiscovery.from_schema_file.
+#
+#   python benchmarks/bench_discovery.py --types 300 --links 6 --depths 3 4 5 6 8
+#
+# The previous expansion is only run while it stays under --budget seconds per depth.
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "APIDiscovery"))
+
+from discovery import WorldsAPIDiscovery  # noqa: E402
+
+
+# `wrap` lists the wrappers from the outside in, "!L!" is [T!]!
+def type_ref(name: str, kind: str, wrap: str = "") -> dict:
+    ref = {"kind": kind, "name": name, "ofType": None}
+    for wrapper in reversed(wrap):
+        ref = {"kind": {"!": "NON_NULL", "L": "LIST"}[wrapper], "name": None, "ofType": ref}
+    return ref
+
+
+def field(name: str, ref: dict) -> dict:
+    return {"name": name, "args": [], "type": ref, "description": None, "isDeprecated": False,
+            "deprecationReason": None}
+
+
+# An introspection __schema of `types` object types with `scalars` scalar fields and
+# `links` fields pointing at other types (some of them lists), and a Query type with one
+# connection-like root field per 10 types
+def make_schema(types: int, scalars: int, links: int, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    objects = []
+    for i in range(types):
+        fields = [field(f"s{j}", type_ref("String", "SCALAR", rng.choice(["", "!"]))) for j in range(scalars)]
+        for j in range(links):
+            target = rng.randrange(types)
+            fields.append(field(f"t{target}_{j}", type_ref(f"T{target}", "OBJECT", rng.choice(["", "!", "!L!"]))))
+        objects.append({"kind": "OBJECT", "name": f"T{i}", "fields": fields, "interfaces": []})
+    roots = [field(f"t{i}", type_ref(f"T{i}", "OBJECT", "!")) for i in range(0, types, 10)]
+    objects.append({"kind": "OBJECT", "name": "Query", "fields": roots, "interfaces": []})
+    objects.append({"kind": "SCALAR", "name": "String"})
+    return {"queryType": {"name": "Query"}, "mutationType": None, "subscriptionType": None,
+            "types": objects, "directives": []}
+
+
+# list_fields_recursive as it was before the memoized expansion
+def legacy_fields(helper: WorldsAPIDiscovery, type_name: str, visited=None, max_depth: int = 5) -> dict:
+    visited = set() if visited is None else visited
+    if type_name in visited or max_depth <= 0:
+        return {}
+    type_obj = helper.get_type(type_name)
+    if not type_obj or "fields" not in type_obj:
+        return {}
+    visited.add(type_name)
+    fields = {}
+    for f in type_obj["fields"]:
+        nested_type, kind = helper._unwrap(f["type"])
+        if kind in ["OBJECT", "INTERFACE"] and helper.get_type(nested_type):
+            fields[f["name"]] = legacy_fields(helper, nested_type, visited.copy(), max_depth - 1)
+        else:
+            fields[f["name"]] = {}
+    return fields
+
+
+def count_selections(fields: dict, memo=None) -> int:
+    memo = {} if memo is None else memo
+    if id(fields) not in memo:
+        memo[id(fields)] = sum(1 + count_selections(sub, memo) for sub in fields.values())
+    return memo[id(fields)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIDiscovery schema expansion benchmark")
+    parser.add_argument("--types", type=int, default=300)
+    parser.add_argument("--scalars", type=int, default=8)
+    parser.add_argument("--links", type=int, default=6, help="object fields per type")
+    parser.add_argument("--depths", type=int, nargs="+", default=[3, 4, 5, 6, 8])
+    parser.add_argument("--repeat", type=int, default=3, help="memoized runs per depth, best is shown")
+    parser.add_argument("--budget", type=float, default=20.0, help="seconds, skip the previous expansion beyond")
+    args = parser.parse_args()
+
+    schema = make_schema(args.types, args.scalars, args.links)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"data": {"__schema": schema}}, f)
+    try:
+        started = time.perf_counter()
+        helper = WorldsAPIDiscovery.from_schema_file(f.name)
+        print(f"{args.types} types, schema file {os.path.getsize(f.name) / 1024:.0f} KiB "
+              f"loaded in {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        os.remove(f.name)
+
+    print(f"{'depth':>5} {'previous s':>11} {'memoized ms':>12} {'selections':>12}")
+    legacy_seconds = 0.0
+    for depth in args.depths:
+        legacy = "skipped"
+        if legacy_seconds < args.budget:
+            started = time.perf_counter()
+            legacy_fields(helper, "T0", max_depth=depth)
+            legacy_seconds = time.perf_counter() - started
+            legacy = f"{legacy_seconds:.3f}"
+        memoized = float("inf")
+        for _ in range(args.repeat):
+            helper._expansions.clear()
+            started = time.perf_counter()
+            fields = helper.list_fields_recursive("T0", max_depth=depth)
+            memoized = min(memoized, (time.perf_counter() - started) * 1000)
+        print(f"{depth:>5} {legacy:>11} {memoized:>12.2f} {count_selections(fields):>12}")
+
+
+if __name__ == "__main__":
+    main()
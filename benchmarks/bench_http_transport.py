@@ -0,0 +1,123 @@
+# Per-page latency of the pooled keep-alive session in WorldsAPIClient versus the
+# previous one-off requests.post() per page, against a local stub GraphQL server.
+#
+#   python benchmarks/bench_http_transport.py --pages 500 --tls
+#
+# --tls serves the stub over HTTPS with a throwaway self-signed certificate, which is
+# where a fresh connection per page hurts the most. It needs the `openssl` binary.
+import argparse
+import gzip
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import urllib3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from worlds_api_client import WorldsAPIClient  # noqa: E402
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+PAGE = json.dumps({
+    "data": {
+        "tracks": {
+            "edges": [
+                {"node": {"id": f"track-{i}", "tag": "car", "startTime": "2025-10-13T17:00:00.000Z",
+                          "endTime": "2025-10-13T17:00:30.000Z",
+                          "detections": [{"metadata": {"track_confidence": 0.5}, "zones": [{"name": "Intersection"}]}] * 10}}
+                for i in range(50)
+            ],
+            "pageInfo": {"hasNextPage": True, "endCursor": "cursor"},
+        }
+    }
+}).encode()
+PAGE_GZIP = gzip.compress(PAGE)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, keep Nagle from delaying the body
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = PAGE_GZIP if "gzip" in self.headers.get("Accept-Encoding", "") else PAGE
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if body is PAGE_GZIP:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(tls: bool):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if tls:
+        tmp = tempfile.mkdtemp()
+        cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+             "-days", "1", "-subj", "/CN=127.0.0.1"],
+            check=True, capture_output=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/graphql"
+
+
+def run(label, post, pages):
+    samples = []
+    for _ in range(pages):
+        started = time.perf_counter()
+        post()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    print(f"{label:>14} mean {statistics.mean(samples):7.2f} ms  p50 {samples[len(samples) // 2]:7.2f} ms  "
+          f"p99 {samples[int(len(samples) * 0.99)]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worlds API client transport benchmark")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--tls", action="store_true")
+    args = parser.parse_args()
+
+    server, url = start_server(args.tls)
+    payload = {"query": "query tracks { tracks { edges { node { id } } } }", "variables": {"first": 50}}
+
+    def one_off():
+        response = requests.post(url, json=payload, headers={"Content-Type": "application/json"},
+                                 timeout=15, verify=False)
+        response.raise_for_status()
+        return response.json()
+
+    client = WorldsAPIClient()
+    client.api_url = url
+    client.session.verify = False
+    client.session.trust_env = False  # a CA bundle from the environment would override verify=False
+
+    run("requests.post", one_off, args.pages)
+    run("pooled session", lambda: client._post(payload["query"], payload["variables"]), args.pages)
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# CPU time of turning raw track pages into the aggregation result: json + the per-node
+# TrackAggregator (the previous path) against orjson + TrackAggregator.
+#
+#   python benchmarks/bench_page_decode.py --tracks 10000 50000 --detections 15
+#
+# Pages are serialized up front, only decoding and aggregation are timed.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from bench_aggregate_memory import PAGE_SIZE, make_node  # noqa: E402
+from track_aggregation import TrackAggregator  # noqa: E402
+
+
+# The API's "2025-10-13T17:00:00.000Z" layout
+def api_timestamp(value: str) -> str:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+
+def make_pages(tracks: int, detections: int, seed: int = 7) -> list[bytes]:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    pages = []
+    for first in range(0, tracks, PAGE_SIZE):
+        nodes = []
+        for i in range(first, min(first + PAGE_SIZE, tracks)):
+            node = make_node(rng, i, now)
+            node["detections"] = (node["detections"] * detections)[:rng.randint(1, detections)]
+            node["startTime"] = api_timestamp(node["startTime"])
+            node["endTime"] = api_timestamp(node["endTime"])
+            nodes.append({"node": node})
+        pages.append(json.dumps({"data": {"tracks": {"edges": nodes, "pageInfo": {"hasNextPage": True}}}}).encode())
+    return pages
+
+
+def run(pages: list[bytes], loads, aggregator_cls) -> dict:
+    aggregator = aggregator_cls("bench", "now", max_tracks=5)
+    for body in pages:
+        aggregator.add_nodes(edge["node"] for edge in loads(body)["data"]["tracks"]["edges"])
+    return aggregator.result()
+
+
+def summary(result: dict):
+    return (
+        sorted((t["tag"], t["count"]) for t in result["tags"]["tags"]),
+        [(t["id"], t["length"], t["detections"], t["track_confidence_average"], sorted(t["zones"]))
+         for t in result["top_tracks"]],
+        sorted(result["zones"]["zones"]),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="track page decoding benchmark")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--detections", type=int, default=15, help="max detections per track")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    modes = (
+        ("json+nodes", json.loads, TrackAggregator),
+        ("orjson+nodes", orjson.loads, TrackAggregator),
+    )
+    print(f"{'tracks':>8} {'mode':>15} {'seconds':>8} {'tracks/s':>10} {'speedup':>8}")
+    for tracks in args.tracks:
+        pages = make_pages(tracks, args.detections)
+        expected, baseline = None, None
+        for name, loads, aggregator_cls in modes:
+            best = float("inf")
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = run(pages, loads, aggregator_cls)
+                best = min(best, time.perf_counter() - started)
+            if expected is None:
+                expected, baseline = summary(result), best
+            elif summary(result) != expected:
+                raise SystemExit(f"{name} result differs from the per-node aggregation for {tracks} tracks")
+            print(f"{tracks:>8} {name:>15} {best:>8.3f} {tracks / best:>10.0f} {baseline / best:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+# End-to-end throughput of the services against the local Worlds API simulator
+# (benchmarks/worlds_simulator.py), started as a subprocess for every data point.
+#
+#   python benchmarks/bench_simulator.py aggregate --tracks 1000 10000 50000
+#   python benchmarks/bench_simulator.py ingest --rates 100 1000 5000 --duration 10
+#   python benchmarks/bench_simulator.py ingest --rates 20000 --shards 1 2 4 --sources 64
+#   python benchmarks/bench_simulator.py query --tracks 10000 --metadata-bytes 0 200
+#   WORLDS_API_URL=... python benchmarks/bench_simulator.py query --live [--source ID]
+#
+# aggregate: cycle time and peak Python heap (tracemalloc) of one aggregate_tracks and
+#            one aggregate_tracks_async run over a 60 minute window holding --tracks tracks.
+#            The simulator minutes are warmed up first, results are not persisted.
+# ingest:    detectionActivity events/sec handled by the subscription service's ingest path
+#            (IngestPipeline -> handle_detection_activity -> DetectionBuckets) at each offered
+#            rate, and the end-to-end lag from the simulator's event timestamp to the end of
+#            handling. Alerts go to a WriteSpool in a temp dir that is not drained.
+#            With --shards N the data sources are split over N worker processes, each
+#            subscribing to its own sources (subscription_service.subscribe_shard).
+# query:     response bytes per track of the full tracks query and the lean tracksSummary
+#            one over the same hour, as decoded JSON and as gzip on the wire, the time
+#            orjson takes to decode the pages and one aggregate_tracks cycle with each.
+#            With --live the queries run against the API of WORLDS_API_URL and its schema
+#            instead of a simulator, over the last hour of --source (the first device).
+#
+# Keep the simulator options the same between runs you compare, the server side is part
+# of every number.
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+import dashboard_service  # noqa: E402
+import subscription_service  # noqa: E402
+from devices import get_devices_list  # noqa: E402
+from ingest_pipeline import IngestPipeline  # noqa: E402
+from track_fetcher import tracks_variables  # noqa: E402
+from worlds_api_client import AsyncWorldsAPIClient, WorldsAPIClient  # noqa: E402
+from write_spool import WriteSpool  # noqa: E402
+from db.async_crud import store_detection_events_bulk, store_events_bulk  # noqa: E402
+
+SIMULATOR = os.path.join(ROOT, "benchmarks", "worlds_simulator.py")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def simulator(args, **options):
+    port = free_port()
+    command = [sys.executable, SIMULATOR, "--port", str(port), "--sources", str(args.sources),
+               "--seed", str(args.seed),
+               "--detections-per-track", str(args.detections_per_track),
+               "--metadata-bytes", str(args.metadata_bytes), "--latency", str(args.latency)]
+    for name, value in options.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                requests.get(f"{url}/healthz", timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise SystemExit(f"simulator did not start: {' '.join(command)}")
+                time.sleep(0.1)
+        os.environ["WORLDS_API_URL"] = f"{url}/graphql"
+        os.environ["WORLDS_WS_URL"] = f"ws://127.0.0.1:{port}/graphql"
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def data_source_id() -> str:
+    client = WorldsAPIClient()
+    try:
+        return get_devices_list(client)[0]["id"]
+    finally:
+        client.close()
+
+
+def traced(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def bench_aggregate(args):
+    print(f"{'tracks':>8} {'mode':>6} {'pages':>6} {'seconds':>8} {'tracks/s':>9} {'peak MiB':>9}")
+    for tracks in args.tracks:
+        with simulator(args, tracks_per_hour=tracks):
+            source = data_source_id()
+            client = WorldsAPIClient()
+
+            def run_sync():
+                started = time.perf_counter()
+                result = dashboard_service.aggregate_tracks(client, source, minutes=60, persist=False)
+                return result, time.perf_counter() - started
+
+            def run_async():
+                async def cycle():
+                    async with AsyncWorldsAPIClient() as async_client:
+                        started = time.perf_counter()
+                        result = await dashboard_service.aggregate_tracks_async(
+                            async_client, source, minutes=60, persist=False)
+                        return result, time.perf_counter() - started
+                return asyncio.run(cycle())
+
+            run_sync()  # warm-up, the simulator builds its minutes on first use
+            for mode, fn in (("sync", run_sync), ("async", run_async)):
+                result, elapsed = fn()
+                _, peak = traced(fn)
+                count = sum(t["count"] for t in result["tags"]["tags"])
+                pages = -(-count // client.get_default_variables()["first"])
+                print(f"{tracks:>8} {mode:>6} {pages:>6} {elapsed:>8.2f} {count / elapsed:>9.0f} "
+                      f"{peak / 2 ** 20:>9.2f}")
+            client.close()
+
+
+async def ingest(rate: float, duration: float, spool_dir: str, shards: int = 1, shard: int = 0) -> dict:
+    # Same writers as the service, the spool is never drained so they are not called
+    subscription_service.SPOOL = WriteSpool(os.path.join(spool_dir, f"bench-{rate}-{shards}-{shard}.db"), writers={
+        "detection_events": store_detection_events_bulk, "events": store_events_bulk,
+    })
+    lags = []
+
+    async def handle(event):
+        await subscription_service.handle_detection_activity(event)
+        stamp = datetime.fromisoformat(event["detectionActivity"]["timestamp"].replace("Z", "+00:00"))
+        lags.append(time.time() - stamp.timestamp())
+
+    pipeline = IngestPipeline(handle, maxsize=subscription_service.INGEST_QUEUE_SIZE,
+                              consumers=subscription_service.INGEST_CONSUMERS,
+                              policy=subscription_service.INGEST_OVERFLOW_POLICY, name="bench")
+    pipeline.start()
+    client = AsyncWorldsAPIClient()
+    if shards > 1:
+        subscription_service.SHARD_COUNT, subscription_service.SHARD_INDEX = shards, shard
+        reader = asyncio.create_task(subscription_service.subscribe_shard(client, pipeline.put))
+    else:
+        reader = asyncio.create_task(client.subscribe("detectionActivity", {"filter": {}}, pipeline.put))
+
+    # Lets the subscriptions connect before the measurement starts, a shard opens one per source
+    while pipeline.received == 0 and not reader.done():
+        await asyncio.sleep(0.01)
+    if shards > 1:
+        await asyncio.sleep(1)
+    lags.clear()
+    received_before = pipeline.received
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - started
+    received = pipeline.received - received_before
+    processed = len(lags)
+
+    reader.cancel()
+    await asyncio.gather(reader, return_exceptions=True)
+    await pipeline.stop(drain=False)
+    await client.close()
+    subscription_service.SPOOL.close()
+    subscription_service.SPOOL = None
+
+    return {
+        "received": received / elapsed,
+        "processed": processed / elapsed,
+        "lags": lags,
+        "max_queue": pipeline.max_lag,
+    }
+
+
+def ingest_shard(rate: float, duration: float, spool_dir: str, shards: int, shard: int) -> dict:
+    logging.getLogger().setLevel(logging.WARNING)
+    return asyncio.run(ingest(rate, duration, spool_dir, shards, shard))
+
+
+# Shards run in their own processes, their rates are added up and their lags pooled
+def ingest_sharded(rate: float, duration: float, spool_dir: str, shards: int) -> dict:
+    if shards == 1:
+        parts = [asyncio.run(ingest(rate, duration, spool_dir))]
+    else:
+        # Spawned workers inherit the simulator's WORLDS_API_URL and WORLDS_WS_URL
+        with multiprocessing.get_context("spawn").Pool(shards) as pool:
+            parts = pool.starmap(ingest_shard, [(rate, duration, spool_dir, shards, shard) for shard in range(shards)])
+    lags = sorted(lag for part in parts for lag in part["lags"])
+    return {
+        "received": sum(part["received"] for part in parts),
+        "processed": sum(part["processed"] for part in parts),
+        "p50": lags[len(lags) // 2] if lags else float("nan"),
+        "p99": lags[int(len(lags) * 0.99)] if lags else float("nan"),
+        "max": lags[-1] if lags else float("nan"),
+        "max_queue": max(part["max_queue"] for part in parts),
+    }
+
+
+def bench_ingest(args):
+    print(f"{'shards':>6} {'offered/s':>9} {'received/s':>10} {'handled/s':>9} {'lag p50 ms':>10} {'p99 ms':>8} "
+          f"{'max ms':>8} {'queue max ms':>12}")
+    with tempfile.TemporaryDirectory() as spool_dir:
+        for shards in args.shards:
+            for rate in args.rates:
+                with simulator(args, events_per_second=rate):
+                    stats = ingest_sharded(rate, args.duration, spool_dir, shards)
+                print(f"{shards:>6} {rate:>9.0f} {stats['received']:>10.0f} {stats['processed']:>9.0f} "
+                      f"{stats['p50'] * 1000:>10.1f} {stats['p99'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f} "
+                      f"{stats['max_queue'] * 1000:>12.1f}")
+
+
+# Raw pages of one query over the window: [(wire bytes, decoded body)]
+def fetch_pages(client: WorldsAPIClient, query_name: str, source: str, start: datetime, end: datetime):
+    document = client.queries.get(query_name)
+    variables = tracks_variables(client, source, start, end)
+    pages = []
+    while True:
+        response = client.session.post(client.api_url, json={"query": document.text, "variables": variables},
+                                       stream=True)
+        wire = response.raw.read(decode_content=False)
+        encoded = response.headers.get("Content-Encoding") in ("gzip", "deflate")
+        body = zlib.decompressobj(47).decompress(wire) if encoded else wire
+        pages.append((len(wire), body))
+        info = client.extract_page_info(orjson.loads(body)) or {}
+        if not info.get("hasNextPage"):
+            return pages
+        variables["after"] = info["endCursor"]
+
+
+def compare_queries(client: WorldsAPIClient, source: str, label):
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(minutes=60)
+    for query_name in ("tracks", "tracksSummary"):
+        pages = fetch_pages(client, query_name, source, start, end)
+        started = time.perf_counter()
+        tracks = sum(len(orjson.loads(body)["data"]["tracks"]["edges"]) for _, body in pages)
+        decode = time.perf_counter() - started
+        if not tracks:
+            print(f"{label:>6} {query_name:>13} no tracks in the last hour")
+            continue
+
+        dashboard_service.TRACKS_QUERY = query_name
+        started = time.perf_counter()
+        dashboard_service.aggregate_tracks(client, source, minutes=60, persist=False)
+        cycle = time.perf_counter() - started
+        print(f"{label:>6} {query_name:>13} {tracks:>7} "
+              f"{sum(len(body) for _, body in pages) / tracks:>11.0f} "
+              f"{sum(wire for wire, _ in pages) / tracks:>10.0f} {decode:>8.3f} {cycle:>7.2f}")
+
+
+def bench_query(args):
+    print(f"{'meta B':>6} {'query':>13} {'tracks':>7} {'bytes/track':>11} {'gzip/track':>10} {'decode s':>8} "
+          f"{'cycle s':>7}")
+    if args.live:
+        client = WorldsAPIClient()
+        try:
+            compare_queries(client, args.source or data_source_id(), "live")
+        finally:
+            client.close()
+        return
+    for metadata_bytes in args.metadata_bytes_list:
+        args.metadata_bytes = metadata_bytes
+        with simulator(args, tracks_per_hour=args.tracks[0]):
+            client = WorldsAPIClient()
+            try:
+                compare_queries(client, data_source_id(), metadata_bytes)
+            finally:
+                client.close()
+
+
+SUITES = {"aggregate": bench_aggregate, "ingest": bench_ingest, "query": bench_query}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service benchmarks against the Worlds API simulator")
+    parser.add_argument("suite", nargs="*", help="aggregate, ingest and/or query, all by default")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1_000, 10_000, 50_000],
+                        help="tracks in the aggregated hour")
+    parser.add_argument("--rates", type=float, nargs="+", default=[100, 1_000, 5_000],
+                        help="offered detectionActivity events per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured per ingest rate")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1], help="ingest worker processes")
+    parser.add_argument("--sources", type=int, default=1, help="simulated data sources")
+    parser.add_argument("--detections-per-track", type=float, default=10)
+    parser.add_argument("--metadata-bytes", type=int, nargs="+", default=[0], dest="metadata_bytes_list",
+                        help="padding per detection metadata, query runs once per value")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per HTTP request")
+    parser.add_argument("--live", action="store_true", help="query: use the API of WORLDS_API_URL, no simulator")
+    parser.add_argument("--source", help="query --live: data source id, the first device by default")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    args.metadata_bytes = args.metadata_bytes_list[0]
+    suites = args.suite or ["aggregate", "ingest", "query"]
+    for suite in suites:
+        if suite not in SUITES:
+            parser.error(f"unknown suite '{suite}'")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for suite in suites:
+        print(f"== {suite}")
+        SUITES[suite](args)
+
+
+if __name__ == "__main__":
+    main()
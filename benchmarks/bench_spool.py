@@ -0,0 +1,107 @@
+# Flush-path latency and data loss of the subscription service writing detection buckets
+# straight to Postgres versus through the local WriteSpool, while the database stalls.
+#
+#   python benchmarks/bench_spool.py --flushes 200 --rows 500 --outage 2
+#
+# Postgres is replaced by an in-process stub writer: every call costs --latency ms plus
+# --row-cost us per row, and for --outage seconds in the middle of the run every call hangs
+# for --stall seconds and then fails, like a restarting database behind a connect timeout.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from write_spool import WriteSpool  # noqa: E402
+
+TAGS = ["car", "person", "vehicle", "safety_barrier", "bicycle", "yellow_vest"]
+
+
+class StubPostgres:
+    def __init__(self, latency_ms: float, row_cost_us: float, stall: float):
+        self.latency = latency_ms / 1000
+        self.row_cost = row_cost_us / 1_000_000
+        self.stall = stall
+        self.down_until = 0.0
+        self.rows = 0
+
+    async def write(self, rows):
+        if time.monotonic() < self.down_until:
+            await asyncio.sleep(self.stall)
+            raise ConnectionError("database unavailable")
+        await asyncio.sleep(self.latency + self.row_cost * len(rows))
+        self.rows += len(rows)
+
+
+def make_batch(size: int, flush: int) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {"timestamp": now, "source_id": f"source-{i % 40}", "source_name": "Bourbon Street benchmark",
+         "tag": TAGS[(i + flush) % len(TAGS)], "event_count": i % 50 + 1}
+        for i in range(size)
+    ]
+
+
+async def run(label, flush, db, args):
+    samples, lost = [], 0
+    started = time.monotonic()
+    for i in range(args.flushes):
+        if i == args.flushes // 3:
+            db.down_until = time.monotonic() + args.outage
+        batch = make_batch(args.rows, i)
+        t = time.perf_counter()
+        try:
+            await flush(batch)
+        except ConnectionError:
+            lost += len(batch)
+        samples.append((time.perf_counter() - t) * 1000)
+        await asyncio.sleep(args.interval / 1000)
+    ingest_time = time.monotonic() - started
+
+    samples.sort()
+    print(f"{label:>8} flush mean {statistics.mean(samples):7.2f} ms  p50 {samples[len(samples) // 2]:7.2f} ms  "
+          f"p99 {samples[int(len(samples) * 0.99)]:8.2f} ms  max {samples[-1]:8.2f} ms  "
+          f"ingest {ingest_time:6.2f} s  lost {lost} rows")
+    return started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Write spool benchmark")
+    parser.add_argument("--flushes", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=500, help="rows per flush")
+    parser.add_argument("--interval", type=float, default=10, help="ms between flushes")
+    parser.add_argument("--latency", type=float, default=5, help="ms per stub write call")
+    parser.add_argument("--row-cost", type=float, default=2, help="us per row in the stub")
+    parser.add_argument("--outage", type=float, default=2, help="seconds the stub is down")
+    parser.add_argument("--stall", type=float, default=1, help="seconds a call hangs while down")
+    parser.add_argument("--batch-size", type=int, default=5000, help="spool drain batch size")
+    args = parser.parse_args()
+
+    db = StubPostgres(args.latency, args.row_cost, args.stall)
+    await run("direct", db.write, db, args)
+
+    db = StubPostgres(args.latency, args.row_cost, args.stall)
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = WriteSpool(os.path.join(tmp, "spool.db"), {"detection_events": db.write},
+                           batch_size=args.batch_size, drain_interval=0.1, max_backoff=args.stall)
+        drainer = asyncio.create_task(spool.run())
+
+        async def spooled(batch):
+            await spool.append("detection_events", batch)
+
+        started = await run("spool", spooled, db, args)
+        while spool.pending:
+            await asyncio.sleep(0.05)
+        drainer.cancel()
+        print(f"{'':>8} drained {db.rows} rows in {time.monotonic() - started:6.2f} s, "
+              f"{spool.failures} failed drain attempts")
+        spool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+# In-memory track store (app/track_store.py): ingest rate, memory per device and the
+# latency of ad-hoc rollups over the stored tracks. Every rollup is checked against the
+# same cut computed from the raw nodes.
+#
+#   python benchmarks/bench_track_store.py --hours 24 --tracks-per-hour 2000
+#
+# Nodes are generated and decoded up front per page, as the aggregation hands them over.
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from bench_aggregate_memory import PAGE_SIZE, make_node  # noqa: E402
+from bench_page_decode import api_timestamp  # noqa: E402
+from track_aggregation import parse_track  # noqa: E402
+from track_store import TrackStore  # noqa: E402
+
+
+def make_pages(hours: int, tracks_per_hour: int, seed: int = 7) -> list[list[dict]]:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    nodes = []
+    for hour in range(hours):
+        for i in range(tracks_per_hour):
+            node = make_node(rng, hour * tracks_per_hour + i, now - timedelta(hours=hour))
+            node["startTime"] = api_timestamp(node["startTime"])
+            node["endTime"] = api_timestamp(node["endTime"])
+            nodes.append(node)
+    return [nodes[i:i + PAGE_SIZE] for i in range(0, len(nodes), PAGE_SIZE)]
+
+
+def timed(fn, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="in-memory track store benchmark")
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--tracks-per-hour", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = make_pages(args.hours, args.tracks_per_hour)
+    tracks = [parse_track(node) for page in pages for node in page]
+    store = TrackStore(hours=args.hours + 1, capacity=args.hours * args.tracks_per_hour)
+
+    started = time.perf_counter()
+    for page in pages:
+        store.add_nodes("bench", page)
+    ingest = time.perf_counter() - started
+    ids = sum(sys.getsizeof(track_id) for track_id in store.ring("bench").ids if track_id is not None)
+    print(f"{len(tracks)} tracks over {args.hours} h: ingest {ingest:.2f}s ({len(tracks) / ingest:.0f} tracks/s), "
+          f"columns {store.nbytes() / 2**20:.1f} MiB + ids {ids / 2**20:.1f} MiB")
+
+    # Rollup -> the same cut from the parsed tracks
+    def tag_zone():
+        return Counter((t["tag"], z) for t in tracks for z in t["zones"])
+
+    def tag_5min():
+        return Counter((int(t["start"].timestamp()) // 300 * 300, t["tag"]) for t in tracks)
+
+    def top_length():
+        return sorted(tracks, key=lambda t: (t["length"], t["id"]), reverse=True)[:5]
+
+    checks = [
+        ("tag x zone count", lambda: store.rollup("bench", by=("tag", "zone")),
+         lambda rows: {(r["tag"], r["zone"]): r["value"] for r in rows} == dict(tag_zone())),
+        ("tag per 5 min", lambda: store.rollup("bench", by=("tag",), bucket_seconds=300),
+         lambda rows: {(int(datetime.fromisoformat(r["bucket"]).timestamp()), r["tag"]): r["value"]
+                       for r in rows} == dict(tag_5min())),
+        ("zone mean length", lambda: store.rollup("bench", by=("zone",), value="length", agg="mean"), None),
+        ("confidence histogram", lambda: store.histogram("bench", "confidence", bins=10),
+         lambda h: sum(h["counts"]) == sum(t["track_confidence_average"] is not None for t in tracks)),
+        ("top 5 by length", lambda: store.top("bench", 5, by="length"),
+         lambda rows: [r["id"] for r in rows] == [t["id"] for t in top_length()]),
+    ]
+    print(f"{'query':>22} {'ms':>8} {'groups':>7}")
+    for name, query, check in checks:
+        seconds, result = timed(query, args.repeat)
+        if check is not None and not check(result):
+            raise SystemExit(f"{name}: store result differs from the nodes")
+        groups = len(result) if isinstance(result, list) else len(result["counts"])
+        print(f"{name:>22} {seconds * 1000:>8.2f} {groups:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,615 @@
+# Local stand-in for the Worlds GraphQL API, so the services can be run and measured
+# without live credentials.
+#
+#   python benchmarks/worlds_simulator.py --port 8090 --sources 4 --tracks-per-hour 6000 --events-per-second 200
+#   WORLDS_API_URL=http://127.0.0.1:8090/graphql WORLDS_WS_URL=ws://127.0.0.1:8090/graphql python app/dashboard_service.py
+#
+# Serves the `tracks`, `devices` and `dataSources` queries over HTTP POST and the
+# `detectionActivity` subscription over graphql-transport-ws on the same path. Documents
+# are parsed, validated and executed by graphql-core against SIMULATOR_SCHEMA, so only the
+# selected fields are returned and a query the real API would reject fails here too.
+# Automatic Persisted Queries are supported.
+#
+# Synthetic data is modelled on queries/sample_aggregated_grafana_data: 30-60 s tracks of
+# cars and people with about one detection every 4 seconds, crossing a handful of zones.
+# Tracks are derived from (seed, data source, minute), so every request for the same time
+# window sees the same tracks and cursors stay valid between pages. Only a small key per
+# track is generated up front, full nodes are built for the pages being returned and kept
+# in a bounded LRU.
+import argparse
+import asyncio
+import base64
+import bisect
+import functools
+import hashlib
+import json
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from aiohttp import WSMsgType, web
+from graphql import (
+    ExecutionResult, FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, OperationType,
+    build_schema, execute, get_operation_ast, parse, subscribe, validate,
+)
+from graphql.execution.values import get_argument_values, get_variable_values
+
+logger = logging.getLogger(__name__)
+
+GRAPHQL_TRANSPORT_WS = "graphql-transport-ws"
+
+SIMULATOR_SCHEMA = """
+scalar JSON
+
+input IdFilter { eq: ID, in: [ID!] }
+input StringFilter { eq: String, like: String }
+input TimeFilter { between: [String!] }
+input FilterTrackInput { dataSourceId: IdFilter, time: TimeFilter, tag: StringFilter }
+input FilterDeviceInput { address: StringFilter, id: IdFilter }
+input FilterDataSourceInput { type: StringFilter, id: IdFilter }
+input FilterDetectionActivityInput { dataSourceId: IdFilter, tag: StringFilter }
+
+type PageInfo { hasNextPage: Boolean!, endCursor: String }
+type Site { id: ID!, name: String }
+type Device { id: ID!, name: String, address: String, site: Site, dataSource: DataSource }
+type DataSource { id: ID!, name: String, type: String, labels: [String!], device: Device }
+type Video { url: String, thumbnailUrl: String, displayName: String }
+type Zone { id: ID!, name: String }
+type Detection { metadata: JSON, timestamp: String, zones: [Zone!]!, track: Track }
+type Track {
+  id: ID!, dataSource: DataSource, video: Video, tag: String,
+  startTime: String, endTime: String, detections: [Detection!]!
+}
+type DetectionActivity { track: Track, timestamp: String }
+
+type TrackEdge { node: Track!, cursor: String! }
+type TrackConnection { edges: [TrackEdge!]!, pageInfo: PageInfo! }
+type DeviceEdge { node: Device!, cursor: String! }
+type DeviceConnection { edges: [DeviceEdge!]!, pageInfo: PageInfo! }
+type DataSourceEdge { node: DataSource!, cursor: String! }
+type DataSourceConnection { edges: [DataSourceEdge!]!, pageInfo: PageInfo! }
+
+type Query {
+  tracks(filter: FilterTrackInput!, first: Int!, after: String): TrackConnection!
+  devices(filter: FilterDeviceInput!, first: Int!, after: String): DeviceConnection!
+  dataSources(filter: FilterDataSourceInput!, first: Int!, after: String): DataSourceConnection!
+}
+
+type Subscription {
+  detectionActivity(filter: FilterDetectionActivityInput): DetectionActivity
+}
+"""
+
+# Tag mix and zones of the sample aggregation, yellow_vest is what triggers the alert path
+TAGS = ["car"] * 60 + ["person"] * 28 + ["vehicle"] * 4 + ["safety_barrier"] * 4 + ["bicycle"] * 3 + ["yellow_vest"]
+ZONES = ["Intersection", "Pedestrian Crossing", "Pedestrian Crossing 3", "Pedetrian Crossing 2", "Stop Light",
+         "Stop Light 2", "Parking Spot"]
+ZONE_NODES = [{"id": f"zone-{i}", "name": name} for i, name in enumerate(ZONES)]
+MAX_PAGE_SIZE = 500
+
+
+@functools.lru_cache(maxsize=65536)
+def _iso_second(second: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+
+
+def iso(ms: int) -> str:
+    return f"{_iso_second(ms // 1000)}.{ms % 1000:03d}Z"
+
+
+def parse_ms(value: str) -> int:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def encode_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode(":".join(str(p) for p in parts).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list[str]:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+    except (ValueError, UnicodeDecodeError):
+        raise GraphQLError(f"Invalid cursor '{cursor}'")
+
+
+def connection(nodes: list[dict], cursors: list[str], has_next: bool) -> dict:
+    return {
+        "edges": [{"node": n, "cursor": c} for n, c in zip(nodes, cursors)],
+        "pageInfo": {"hasNextPage": has_next, "endCursor": cursors[-1] if cursors else None},
+    }
+
+
+# Deterministic synthetic devices, tracks and detection events.
+#
+# Every data source gets about `tracks_per_hour` tracks, each with roughly
+# `detections_per_track` detections spread over its length. `metadata_bytes` pads the
+# per-detection metadata to model heavier payloads. The live subscription emits
+# `events_per_second` detectionActivity events spread over all data sources.
+class SimulatedWorld:
+    def __init__(self, sources: int = 4, tracks_per_hour: float = 100, detections_per_track: float = 10,
+                 track_seconds: float = 37, metadata_bytes: int = 0, events_per_second: float = 50,
+                 seed: int = 7, cache_minutes: int = 4096, cache_tracks: int = 200_000):
+        self.tracks_per_minute = tracks_per_hour / 60
+        self.detections_per_track = detections_per_track
+        self.track_seconds = track_seconds
+        self.max_track_ms = int(track_seconds * 4 * 1000)
+        self.padding = "x" * metadata_bytes
+        self.events_per_second = events_per_second
+        self.seed = seed
+        self.cache_minutes = cache_minutes
+        self.cache_tracks = cache_tracks
+        self._minutes: "OrderedDict[tuple[int, int], tuple[list, list]]" = OrderedDict()
+        self._nodes: "OrderedDict[str, dict]" = OrderedDict()
+
+        self.data_sources = []
+        for i in range(sources):
+            source_id = str(uuid.UUID(int=random.Random(f"{seed}:source:{i}").getrandbits(128), version=4))
+            device = {
+                "id": str(uuid.UUID(int=random.Random(f"{seed}:device:{i}").getrandbits(128), version=4)),
+                "name": f"Simulated EarthCam {i}",
+                "address": f"https://www.earthcam.com/simulated/cam{i}",
+                "site": {"id": f"site-{i}", "name": f"Simulated Site {i}"},
+            }
+            data_source = {"id": source_id, "name": f"Simulated Camera {i}", "type": "VIDEO_DEVICE",
+                           "labels": ["simulated"], "device": device}
+            device["dataSource"] = data_source
+            self.data_sources.append(data_source)
+        self._source_index = {ds["id"]: i for i, ds in enumerate(self.data_sources)}
+
+    # Sorted (start_ms, id) keys and (start_ms, id, length_ms, tag) rows of the tracks
+    # that started in one minute of one data source
+    def _minute(self, source: int, minute: int) -> tuple[list, list]:
+        block = self._minutes.get((source, minute))
+        if block is not None:
+            self._minutes.move_to_end((source, minute))
+            return block
+
+        rng = random.Random(f"{self.seed}:{source}:{minute}")
+        count = int(self.tracks_per_minute) + (rng.random() < self.tracks_per_minute % 1)
+        rows = []
+        for _ in range(count):
+            start = minute * 60_000 + rng.randrange(60_000)
+            length = min(int(rng.expovariate(1 / self.track_seconds) * 1000) + 500, self.max_track_ms)
+            track_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            rows.append((start, track_id, length, rng.choice(TAGS)))
+        rows.sort()
+        block = ([(r[0], r[1]) for r in rows], rows)
+        self._minutes[(source, minute)] = block
+        while len(self._minutes) > self.cache_minutes:
+            self._minutes.popitem(last=False)
+        return block
+
+    def track_node(self, source: int, row: tuple) -> dict:
+        start, track_id, length, tag = row
+        node = self._nodes.get(track_id)
+        if node is not None:
+            self._nodes.move_to_end(track_id)
+            return node
+
+        rng = random.Random(track_id)
+        count = max(1, round(self.detections_per_track * length / 1000 / self.track_seconds))
+        zones = rng.sample(ZONE_NODES, rng.randint(0, 4))
+        confidence = rng.uniform(0.3, 0.9)
+        detections = []
+        for d in range(count):
+            metadata = {
+                "confidence": rng.uniform(0.2, 1.0),
+                "track_confidence": min(max(confidence + rng.uniform(-0.15, 0.15), 0.0), 1.0),
+                "bbox": [rng.random(), rng.random(), rng.random(), rng.random()],
+            }
+            if self.padding:
+                metadata["attributes"] = self.padding
+            detections.append({
+                "metadata": metadata,
+                "timestamp": iso(start + length * d // count),
+                "zones": [z for z in zones if rng.random() < 0.7],
+            })
+        asset = track_id.replace("-", "")
+        node = {
+            "id": track_id,
+            "dataSource": self.data_sources[source],
+            "video": {
+                "url": f"https://simulator.invalid/asset/dl/video/{asset}/{track_id}.m3u8",
+                "thumbnailUrl": f"https://simulator.invalid/asset/dl/video/{asset}/{track_id}.m3u8?getThumbnail=true",
+                "displayName": f"{tag} {track_id[:8]}",
+            },
+            "tag": tag,
+            "startTime": iso(start),
+            "endTime": iso(start + length),
+            "detections": detections,
+        }
+        self._nodes[track_id] = node
+        while len(self._nodes) > self.cache_tracks:
+            self._nodes.popitem(last=False)
+        return node
+
+    # Tracks overlapping [start, end] that have finished by now, ordered by (startTime, id)
+    def tracks(self, filter: dict, first: int, after: Optional[str] = None) -> dict:
+        first = max(0, min(first, MAX_PAGE_SIZE))
+        now_ms = int(time.time() * 1000)
+        between = ((filter.get("time") or {}).get("between")) or []
+        start_ms = parse_ms(between[0]) if between else now_ms - 3_600_000
+        end_ms = min(parse_ms(between[1]) if len(between) > 1 else now_ms, now_ms)
+        tag = (filter.get("tag") or {}).get("eq")
+        source_filter = filter.get("dataSourceId") or {}
+        ids = source_filter.get("in") or ([source_filter["eq"]] if source_filter.get("eq") else None)
+        sources = sorted(self._source_index[i] for i in ids if i in self._source_index) if ids is not None \
+            else list(range(len(self.data_sources)))
+
+        after_key = None
+        if after:
+            parts = decode_cursor(after)
+            after_key = (int(parts[0]), parts[1])
+
+        # Tracks that started up to max_track_ms before the window can still overlap it
+        first_minute = (start_ms - self.max_track_ms) // 60_000
+        if after_key is not None:
+            first_minute = max(first_minute, after_key[0] // 60_000)
+        page, cursors = [], []
+        for minute in range(first_minute, end_ms // 60_000 + 1):
+            candidates = []
+            for source in sources:
+                keys, rows = self._minute(source, minute)
+                lo = bisect.bisect_right(keys, after_key) if after_key is not None else 0
+                candidates.extend((row, source) for row in rows[lo:])
+            candidates.sort()
+            for (start, track_id, length, track_tag), source in candidates:
+                if start > end_ms or start + length < start_ms or start + length > now_ms:
+                    continue
+                if tag and track_tag != tag:
+                    continue
+                if len(page) == first:
+                    return connection(page, cursors, True)
+                page.append(self.track_node(source, (start, track_id, length, track_tag)))
+                cursors.append(encode_cursor(start, track_id))
+        return connection(page, cursors, False)
+
+    def _paged(self, nodes: list[dict], first: int, after: Optional[str]) -> dict:
+        offset = int(decode_cursor(after)[0]) + 1 if after else 0
+        page = nodes[offset:offset + max(0, min(first, MAX_PAGE_SIZE))]
+        cursors = [encode_cursor(offset + i) for i in range(len(page))]
+        return connection(page, cursors, offset + len(page) < len(nodes))
+
+    def devices(self, filter: dict, first: int, after: Optional[str] = None) -> dict:
+        like = ((filter.get("address") or {}).get("like") or "").strip("%")
+        ids = (filter.get("id") or {}).get("in") or ([filter["id"]["eq"]] if (filter.get("id") or {}).get("eq") else None)
+        nodes = [ds["device"] for ds in self.data_sources
+                 if like in ds["device"]["address"] and (ids is None or ds["device"]["id"] in ids)]
+        return self._paged(nodes, first, after)
+
+    def data_sources_page(self, filter: dict, first: int, after: Optional[str] = None) -> dict:
+        source_type = (filter.get("type") or {}).get("eq")
+        ids = (filter.get("id") or {}).get("in") or ([filter["id"]["eq"]] if (filter.get("id") or {}).get("eq") else None)
+        nodes = [ds for ds in self.data_sources
+                 if (not source_type or ds["type"] == source_type) and (ids is None or ds["id"] in ids)]
+        return self._paged(nodes, first, after)
+
+    # Live detectionActivity events at events_per_second, paced in 10 ms ticks. The
+    # timestamp is the emission time, subscribers measure their end-to-end lag against it.
+    async def detection_activity(self, filter: Optional[dict] = None) -> AsyncIterator[dict]:
+        filter = filter or {}
+        source_filter = filter.get("dataSourceId") or {}
+        ids = source_filter.get("in") or ([source_filter["eq"]] if source_filter.get("eq") else None)
+        tag = (filter.get("tag") or {}).get("eq")
+        sources = self.data_sources if ids is None \
+            else [self.data_sources[self._source_index[i]] for i in ids if i in self._source_index]
+        if not sources:
+            return
+        rate = self.events_per_second * len(sources) / len(self.data_sources)
+        rng = random.Random()
+        started = time.monotonic()
+        emitted = 0
+        while True:
+            due = int((time.monotonic() - started) * rate) - emitted
+            for _ in range(due):
+                event_tag = tag or rng.choice(TAGS)
+                yield {
+                    "timestamp": iso(int(time.time() * 1000)),
+                    "track": {"dataSource": rng.choice(sources), "tag": event_tag, "id": str(uuid.uuid4())},
+                }
+            emitted += due
+            await asyncio.sleep(0.01)
+
+
+def build_simulator_schema(world: SimulatedWorld):
+    schema = build_schema(SIMULATOR_SCHEMA)
+    query = schema.query_type.fields
+    query["tracks"].resolve = lambda _, info, filter, first, after=None: world.tracks(filter, first, after)
+    query["devices"].resolve = lambda _, info, filter, first, after=None: world.devices(filter, first, after)
+    query["dataSources"].resolve = lambda _, info, filter, first, after=None: world.data_sources_page(filter, first, after)
+    activity = schema.subscription_type.fields["detectionActivity"]
+    activity.subscribe = lambda _, info, filter=None: world.detection_activity(filter)
+    activity.resolve = lambda event, info, **_: event
+    return schema
+
+
+# Documents without directives, __typename or root-level fragments are answered by copying
+# the selected fields out of the resolved dicts. graphql-core's executor resolves every
+# field of every detection one by one and would cost the simulator more than the clients
+# it is measuring. Other documents go through graphql-core.
+def _plain(selection_set, fragments: dict) -> bool:
+    for selection in selection_set.selections:
+        if selection.directives:
+            return False
+        if isinstance(selection, FieldNode):
+            if selection.name.value.startswith("__"):
+                return False
+            inner = selection.selection_set
+        elif isinstance(selection, FragmentSpreadNode):
+            inner = fragments[selection.name.value].selection_set
+        else:
+            inner = selection.selection_set
+        if inner is not None and not _plain(inner, fragments):
+            return False
+    return True
+
+
+def _project(selection_set, value, fragments: dict):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [_project(selection_set, item, fragments) for item in value]
+    out = {}
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            key = selection.alias.value if selection.alias else selection.name.value
+            child = value.get(selection.name.value)
+            out[key] = child if selection.selection_set is None else _project(selection.selection_set, child, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            out.update(_project(fragments[selection.name.value].selection_set, value, fragments))
+        else:
+            out.update(_project(selection.selection_set, value, fragments))
+    return out
+
+
+class Operation:
+    def __init__(self, schema, document):
+        self.document = document
+        self.fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+        self.schema = schema
+
+    # (operation, root type, fields) when the fast path applies, None otherwise
+    def plan(self, operation_name: Optional[str]):
+        operation = get_operation_ast(self.document, operation_name)
+        if operation is None:
+            return None
+        if not all(isinstance(s, FieldNode) for s in operation.selection_set.selections):
+            return None
+        if not _plain(operation.selection_set, self.fragments):
+            return None
+        root = {
+            OperationType.QUERY: self.schema.query_type,
+            OperationType.SUBSCRIPTION: self.schema.subscription_type,
+        }.get(operation.operation)
+        return (operation, root) if root is not None else None
+
+    def arguments(self, operation, field: FieldNode, root, variables: Optional[dict]):
+        coerced = get_variable_values(self.schema, operation.variable_definitions or [], variables or {})
+        if isinstance(coerced, list):
+            raise coerced[0]
+        field_def = root.fields[field.name.value]
+        return field_def, get_argument_values(field_def, field, coerced)
+
+    def execute(self, operation, root, variables: Optional[dict]) -> dict:
+        data = {}
+        try:
+            for field in operation.selection_set.selections:
+                field_def, args = self.arguments(operation, field, root, variables)
+                value = field_def.resolve(None, None, **args)
+                key = field.alias.value if field.alias else field.name.value
+                data[key] = value if field.selection_set is None else _project(field.selection_set, value, self.fragments)
+        except GraphQLError as e:
+            return {"data": None, "errors": [e.formatted]}
+        return {"data": data}
+
+    # Arguments are checked right away, GraphQLError is raised before the first event
+    def subscribe(self, operation, root, variables: Optional[dict]) -> AsyncIterator[dict]:
+        field = operation.selection_set.selections[0]
+        field_def, args = self.arguments(operation, field, root, variables)
+        key = field.alias.value if field.alias else field.name.value
+
+        async def results():
+            events = field_def.subscribe(None, None, **args)
+            try:
+                async for event in events:
+                    value = field_def.resolve(event, None)
+                    yield {"data": {key: _project(field.selection_set, value, self.fragments)}}
+            finally:
+                await events.aclose()
+        return results()
+
+
+def _error(message: str, code: Optional[str] = None) -> dict:
+    error = {"message": message}
+    if code:
+        error["extensions"] = {"code": code}
+    return {"errors": [error]}
+
+
+class WorldsSimulator:
+    def __init__(self, world: SimulatedWorld, latency: float = 0.0):
+        self.world = world
+        self.schema = build_simulator_schema(world)
+        self.latency = latency
+        self._documents: dict[str, Operation] = {}
+        self._persisted: dict[str, str] = {}
+
+        self.requests = 0
+        self.events_sent = 0
+
+    # Parsed and validated document of a request payload, or an error response
+    def _document(self, payload: dict) -> tuple[Optional[Operation], Optional[dict]]:
+        query = payload.get("query")
+        persisted = (payload.get("extensions") or {}).get("persistedQuery")
+        if persisted:
+            query_hash = persisted.get("sha256Hash")
+            if query is None:
+                query = self._persisted.get(query_hash)
+                if query is None:
+                    return None, _error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+            elif hashlib.sha256(query.encode("utf-8")).hexdigest() != query_hash:
+                return None, _error("provided sha does not match query", "BAD_USER_INPUT")
+            else:
+                self._persisted[query_hash] = query
+        if not query:
+            return None, _error("Must provide query string.")
+
+        document = self._documents.get(query)
+        if document is None:
+            try:
+                document = parse(query)
+            except GraphQLError as e:
+                return None, {"errors": [e.formatted]}
+            errors = validate(self.schema, document)
+            if errors:
+                return None, {"errors": [e.formatted for e in errors]}
+            document = self._documents[query] = Operation(self.schema, document)
+        return document, None
+
+    async def handle_http(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            payload = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response(_error("Invalid JSON body"), status=400)
+        document, error = self._document(payload)
+        if error:
+            return web.json_response(error)
+        plan = document.plan(payload.get("operationName"))
+        if plan is not None:
+            body = document.execute(*plan, payload.get("variables"))
+        else:
+            body = self._result(execute(self.schema, document.document, variable_values=payload.get("variables"),
+                                        operation_name=payload.get("operationName")))
+        response = web.json_response(body)
+        response.enable_compression()
+        return response
+
+    @staticmethod
+    def _result(result: ExecutionResult) -> dict:
+        body = {"data": result.data}
+        if result.errors:
+            body["errors"] = [e.formatted for e in result.errors]
+        return body
+
+    async def _stream(self, ws: web.WebSocketResponse, op_id: str, payload: dict):
+        document, error = self._document(payload)
+        if error:
+            await ws.send_json({"id": op_id, "type": "error", "payload": error["errors"]})
+            return
+        plan = document.plan(payload.get("operationName"))
+        if plan is not None:
+            try:
+                results = document.subscribe(*plan, payload.get("variables"))
+            except GraphQLError as e:
+                await ws.send_json({"id": op_id, "type": "error", "payload": [e.formatted]})
+                return
+        else:
+            results = await subscribe(self.schema, document.document, variable_values=payload.get("variables"),
+                                      operation_name=payload.get("operationName"))
+            if isinstance(results, ExecutionResult):
+                await ws.send_json({"id": op_id, "type": "error", "payload": [e.formatted for e in results.errors]})
+                return
+        try:
+            async for result in results:
+                if isinstance(result, ExecutionResult):
+                    result = self._result(result)
+                await ws.send_json({"id": op_id, "type": "next", "payload": result})
+                self.events_sent += 1
+            await ws.send_json({"id": op_id, "type": "complete"})
+        except ConnectionResetError:
+            pass
+        finally:
+            await results.aclose()
+
+    # graphql-transport-ws: connection_init/ack, subscribe -> next*, complete, ping/pong
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(protocols=(GRAPHQL_TRANSPORT_WS,), heartbeat=None)
+        await ws.prepare(request)
+        operations: dict[str, asyncio.Task] = {}
+        acknowledged = False
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                kind = message.get("type")
+                if kind == "connection_init":
+                    if acknowledged:
+                        await ws.close(code=4429, message=b"Too many initialisation requests")
+                        break
+                    acknowledged = True
+                    await ws.send_json({"type": "connection_ack"})
+                elif kind == "ping":
+                    await ws.send_json({"type": "pong"})
+                elif kind == "subscribe":
+                    if not acknowledged:
+                        await ws.close(code=4401, message=b"Unauthorized")
+                        break
+                    op_id = message["id"]
+                    operations[op_id] = asyncio.create_task(self._stream(ws, op_id, message.get("payload") or {}))
+                elif kind == "complete":
+                    task = operations.pop(message.get("id"), None)
+                    if task:
+                        task.cancel()
+        finally:
+            for task in operations.values():
+                task.cancel()
+        return ws
+
+    async def handle(self, request: web.Request):
+        if request.method == "GET" and request.headers.get("Upgrade", "").lower() == "websocket":
+            return await self.handle_ws(request)
+        return await self.handle_http(request)
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "requests": self.requests, "events_sent": self.events_sent})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 2 ** 20)
+        app.router.add_route("*", "/graphql", self.handle)
+        app.router.add_get("/healthz", self.healthz)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Worlds API simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--sources", type=int, default=4, help="simulated video data sources")
+    parser.add_argument("--tracks-per-hour", type=float, default=100, help="per data source")
+    parser.add_argument("--detections-per-track", type=float, default=10, help="mean, scales with track length")
+    parser.add_argument("--track-seconds", type=float, default=37, help="mean track length")
+    parser.add_argument("--metadata-bytes", type=int, default=0, help="padding added to every detection's metadata")
+    parser.add_argument("--events-per-second", type=float, default=50, help="detectionActivity rate over all sources")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every HTTP request")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    world = SimulatedWorld(
+        sources=args.sources,
+        tracks_per_hour=args.tracks_per_hour,
+        detections_per_track=args.detections_per_track,
+        track_seconds=args.track_seconds,
+        metadata_bytes=args.metadata_bytes,
+        events_per_second=args.events_per_second,
+        seed=args.seed,
+    )
+    for ds in world.data_sources:
+        logger.info(f"Data source {ds['id']} ({ds['name']})")
+    web.run_app(WorldsSimulator(world, latency=args.latency).app(), host=args.host, port=args.port,
+                print=lambda msg: logger.info(f"Serving the Worlds API simulator on http://{args.host}:{args.port}/graphql"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import json
+import logging
+from itertools import chain
+from typing import Dict, Iterable, List, Sequence, Tuple
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from .model import TagsSeries, Tags, TopTracks, Zones, Devices, DetectionActivity, Events
+from .async_db import AsyncSessionLocal, async_engine
+from .metrics import instrumented
+from .crud import (
+    AGGREGATES_CHANNEL, NOTIFY_SQL, DETECTION_EVENTS_COLUMNS, EVENTS_COLUMNS, _TAG_IDS, _aggregation_rows, _as_datetime, _batches,
+    _missing_tag_names, _tag_counts_rows, _tag_counts_upsert,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# asyncio counterparts of the writers in crud.py, same names and arguments, for code that
+# runs on an event loop. Nothing here blocks the loop or needs a thread from the executor.
+
+
+@instrumented()
+async def save_devices(devices: List[Dict]):
+    if not devices:
+        logger.warning("save_devices called with empty device list.")
+        return
+
+    async with AsyncSessionLocal() as db:
+        try:
+            stmt = pg_insert(Devices.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={"name": stmt.excluded.name, "address": stmt.excluded.address},
+            )
+            await db.execute(stmt, [{"id": d["id"], "name": d.get("name"), "address": d.get("address")}
+                                    for d in devices if "id" in d])
+            await db.commit()
+            logger.info(f"Saved {len(devices)} devices.")
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Failed to save devices: {e}", exc_info=True)
+            raise
+
+
+@instrumented(rows=lambda args, result: 1)
+async def store_event(event_data: Dict):
+    async with AsyncSessionLocal() as db:
+        try:
+            await db.merge(Events(**event_data))
+            await db.commit()
+            logger.info(f"Event saved: {event_data.get('id')}")
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Error saving event {event_data.get('id')}: {e}", exc_info=True)
+            raise
+
+
+async def _resolve_tag_ids(db, names: List[str]) -> Dict[str, int]:
+    tag_ids = dict(_TAG_IDS)
+    if names:
+        await db.execute(pg_insert(Tags.__table__).on_conflict_do_nothing(index_elements=["name"]),
+                         [{"name": n} for n in names])
+        tag_ids.update((await db.execute(select(Tags.name, Tags.id).where(Tags.name.in_(names)))).tuples().all())
+    return tag_ids
+
+
+@instrumented(rows=lambda args, result: _aggregation_rows(args[0]))
+async def store_aggregation_results(results: Dict[str, Dict]):
+    if not results:
+        logger.warning("store_aggregation_results called with no results.")
+        return
+
+    tags_rows = [r["tags"] for r in results.values() if r.get("tags")]
+    track_rows = [t for r in results.values() for t in r.get("top_tracks") or []]
+    zone_rows = [
+        {"device_id": device_id, "zones": r["zones"]["zones"], "timestamp": r["zones"]["timestamp"]}
+        for device_id, r in results.items() if r.get("zones")
+    ]
+
+    async with AsyncSessionLocal() as db:
+        try:
+            tag_ids = {}
+            if tags_rows:
+                await db.execute(pg_insert(TagsSeries.__table__), tags_rows)
+                tag_ids = await _resolve_tag_ids(db, _missing_tag_names(tags_rows))
+                tag_counts_rows = _tag_counts_rows(tags_rows, tag_ids)
+                if tag_counts_rows:
+                    await db.execute(_tag_counts_upsert(), tag_counts_rows)
+
+            await db.execute(delete(TopTracks).where(TopTracks.device_id.in_(list(results))))
+            if track_rows:
+                stmt = pg_insert(TopTracks.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={c.name: stmt.excluded[c.name] for c in TopTracks.__table__.columns if c.name != "id"},
+                )
+                await db.execute(stmt, track_rows)
+
+            if zone_rows:
+                stmt = pg_insert(Zones.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["device_id"],
+                    set_={"zones": stmt.excluded.zones, "timestamp": stmt.excluded.timestamp},
+                )
+                await db.execute(stmt, zone_rows)
+
+            await db.execute(text(NOTIFY_SQL), {"channel": AGGREGATES_CHANNEL, "topic": "aggregation"})
+            await db.commit()
+            _TAG_IDS.update(tag_ids)
+            logger.info(f"Stored aggregation results for {len(results)} devices "
+                        f"({len(tags_rows)} tag series, {len(track_rows)} top tracks, {len(zone_rows)} zones).")
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Failed to store aggregation results: {e}", exc_info=True)
+            raise
+
+
+@instrumented()
+async def store_detection_activity_bulk(data_list: List[Dict]):
+    if not data_list:
+        logger.warning("store_detection_activity_bulk called with empty data.")
+        return
+
+    async with AsyncSessionLocal() as db:
+        try:
+            await db.execute(pg_insert(DetectionActivity.__table__), data_list)
+            await db.commit()
+            logger.info(f"Inserted {len(data_list)} detection activity entries.")
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Failed bulk insert of detection activity: {e}", exc_info=True)
+            raise
+
+
+# COPY through asyncpg's copy_records_to_table, which speaks the binary format itself.
+# Values only need to be the Python types asyncpg's codecs expect.
+
+def _record_value(value, pg_type: str):
+    if value is None:
+        return None
+    if pg_type == "timestamptz":
+        return _as_datetime(value)
+    if pg_type == "jsonb":
+        return json.dumps(value)
+    return value
+
+
+async def copy_rows(table: str, columns: List[Tuple[str, str]], rows: Iterable[Sequence]) -> int:
+    types = [pg_type for _, pg_type in columns]
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    # Records are converted as COPY consumes them, the input is never held as a list
+    copied = 0
+
+    def records():
+        nonlocal copied
+        for row in chain((first,), rows):
+            copied += 1
+            yield tuple(_record_value(v, t) for v, t in zip(row, types))
+
+    async with async_engine.connect() as conn:
+        try:
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection
+            # One transaction, a failed COPY leaves nothing behind and the notify only fires on commit
+            async with driver.transaction():
+                await driver.copy_records_to_table(table, records=records(), columns=[name for name, _ in columns])
+                await driver.execute("SELECT pg_notify($1, $2)", AGGREGATES_CHANNEL, table)
+            logger.info(f"Copied {copied} rows into {table}.")
+            return copied
+        except Exception as e:
+            logger.error(f"COPY into {table} failed: {e}", exc_info=True)
+            raise
+
+
+@instrumented()
+async def copy_detection_events(rows: Iterable[Dict]) -> int:
+    names = [name for name, _ in DETECTION_EVENTS_COLUMNS]
+    return await copy_rows(
+        DetectionActivity.__tablename__,
+        DETECTION_EVENTS_COLUMNS,
+        ([row.get(name, 1 if name == "event_count" else None) for name in names] for row in rows),
+    )
+
+
+@instrumented()
+async def copy_events(rows: Iterable[Dict]) -> int:
+    names = [name for name, _ in EVENTS_COLUMNS]
+    return await copy_rows(
+        Events.__tablename__,
+        EVENTS_COLUMNS,
+        ([row.get("metadata_" if name == "metadata" else name) for name in names] for row in rows),
+    )
+
+
+@instrumented()
+async def store_events_bulk(events: Iterable[Dict], batch_size: int = 1000, update: bool = False) -> int:
+    written = 0
+    async with AsyncSessionLocal() as db:
+        try:
+            stmt = pg_insert(Events.__table__)
+            if update:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={c: stmt.excluded[c.key] for c in Events.__table__.columns if c.name != "id"},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+            stmt = stmt.returning(Events.__table__.c.id)
+            for batch in _batches(events, batch_size):
+                written += len((await db.execute(stmt, batch)).all())
+            await db.commit()
+            logger.info(f"Upserted {written} events.")
+            return written
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Failed bulk upsert of events: {e}", exc_info=True)
+            raise
+
+
+@instrumented()
+async def store_detection_events_bulk(rows: Iterable[Dict], batch_size: int = 1000) -> int:
+    names = [name for name, _ in DETECTION_EVENTS_COLUMNS] + ["batch_seq"]
+    table = DetectionActivity.__table__
+    written = 0
+    async with AsyncSessionLocal() as db:
+        try:
+            stmt = pg_insert(table).on_conflict_do_nothing(
+                index_elements=["source_id", "tag", "timestamp", "batch_seq"],
+                index_where=table.c.batch_seq.isnot(None),
+            ).returning(table.c.id)
+            records = ({name: row.get(name, 1 if name == "event_count" else None) for name in names} for row in rows)
+            for batch in _batches(records, batch_size):
+                written += len((await db.execute(stmt, batch)).all())
+            await db.execute(text(NOTIFY_SQL), {"channel": AGGREGATES_CHANNEL, "topic": table.name})
+            await db.commit()
+            logger.info(f"Inserted {written} detection buckets.")
+            return written
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Failed bulk insert of detection buckets: {e}", exc_info=True)
+            raise
@@ -0,0 +1,28 @@
+import os
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .db import (
+    DB_USER, DB_PASS, DB_NAME, DB_HOST, DB_PORT,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT,
+)
+
+# asyncpg keeps an LRU of prepared statements per connection, 0 disables it (needed behind pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+_connect_args = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+if DB_STATEMENT_TIMEOUT:
+    _connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+
+# Same database and pool settings as the sync engine, for code running on an event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=_connect_args,
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
@@ -1,10 +1,17 @@
+import io
+import json
+import struct
 import logging
+from itertools import islice
 from datetime import datetime, timezone
-from typing import Optional, List, Dict
-from sqlalchemy import delete
+from typing import Optional, List, Dict, Iterable, Iterator, Sequence, Tuple
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
-from .model import TagsSeries, TopTracks, Zones, Devices, DetectionActivity, Events
-from .db import SessionLocal
+from .model import (TagsSeries, Tags, TagCounts, TopTracks, Zones, Devices, DetectionActivity, Events,
+                    BackfillWindows)
+from .db import SessionLocal, engine
+from .metrics import instrumented
 
 
 logging.basicConfig(
@@ -14,12 +21,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Writers announce committed changes on this channel (payload: "aggregation" or the table name),
+# the read API listens to it to drop cached responses
+AGGREGATES_CHANNEL = "aggregates_written"
+NOTIFY_SQL = "SELECT pg_notify(:channel, :topic)"
+
+
 def get_devices(device_id: Optional[str] = None) -> List[Devices]:
     with SessionLocal() as db:
         query = db.query(Devices)
         return query.filter(Devices.device_id == device_id).first() if device_id else query.all()
 
 
+@instrumented()
 def save_devices(devices: List[Dict]):
     if not devices:
         logger.warning("save_devices called with empty device list.")
@@ -27,10 +41,13 @@ def save_devices(devices: List[Dict]):
 
     with SessionLocal() as db:
         try:
-            ids = [d['id'] for d in devices if 'id' in d]
-            if ids:
-                db.query(Devices).filter(Devices.id.in_(ids)).delete(synchronize_session=False)
-            db.bulk_insert_mappings(Devices, devices)
+            stmt = pg_insert(Devices.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={"name": stmt.excluded.name, "address": stmt.excluded.address},
+            )
+            db.execute(stmt, [{"id": d["id"], "name": d.get("name"), "address": d.get("address")}
+                              for d in devices if "id" in d])
             db.commit()
             logger.info(f"Saved {len(devices)} devices.")
         except SQLAlchemyError as e:
@@ -39,6 +56,7 @@ def save_devices(devices: List[Dict]):
             raise
 
 
+@instrumented(rows=lambda args, result: 1)
 def store_event(event_data: Dict):
     with SessionLocal() as db:
         try:
@@ -51,6 +69,7 @@ def store_event(event_data: Dict):
             raise
 
 
+@instrumented(rows=lambda args, result: 1)
 def store_tags_series(data: Dict):
     with SessionLocal() as db:
         try:
@@ -63,6 +82,7 @@ def store_tags_series(data: Dict):
             raise
 
 
+@instrumented(rows=lambda args, result: len(args[1]))
 def store_top_tracks(device_id: str, tracks: List[Dict]):
     if not tracks:
         logger.warning(f"No tracks provided for device {device_id}")
@@ -85,6 +105,18 @@ def get_top_tracks(device_id: str) -> List[TopTracks]:
         return db.query(TopTracks).filter(TopTracks.device_id == device_id).all()
 
 
+# Counts of one tag over time, answered from the (device_id, tag_id, ts) primary key
+def get_tag_counts(device_id: str, tag: str, start: datetime, end: datetime) -> List[Tuple[datetime, int]]:
+    with SessionLocal() as db:
+        return db.execute(
+            select(TagCounts.ts, TagCounts.count)
+            .join(Tags, Tags.id == TagCounts.tag_id)
+            .where(TagCounts.device_id == device_id, Tags.name == tag, TagCounts.ts >= start, TagCounts.ts < end)
+            .order_by(TagCounts.ts)
+        ).tuples().all()
+
+
+@instrumented(rows=lambda args, result: 1)
 def store_zones(device_id: str, zones: List[str], timestamp: Optional[datetime] = None):
     timestamp = timestamp or datetime.now(timezone.utc)
     with SessionLocal() as db:
@@ -98,6 +130,177 @@ def store_zones(device_id: str, zones: List[str], timestamp: Optional[datetime]
             raise
 
 
+# Tag dictionary: name -> tags.id, ids are only cached once the transaction that created them committed
+_TAG_IDS: Dict[str, int] = {}
+
+
+def _tag_name(tag: Optional[str]) -> str:
+    return tag or "unknown"
+
+
+def _missing_tag_names(tags_rows: List[Dict]) -> List[str]:
+    names = {_tag_name(t.get("tag")) for row in tags_rows for t in row.get("tags") or []}
+    return sorted(names - _TAG_IDS.keys())
+
+
+def _tag_counts_rows(tags_rows: List[Dict], tag_ids: Dict[str, int]) -> List[Dict]:
+    counts: Dict[Tuple[str, int, object], int] = {}
+    for row in tags_rows:
+        for t in row.get("tags") or []:
+            key = (row["device_id"], tag_ids[_tag_name(t.get("tag"))], row["timestamp"])
+            counts[key] = counts.get(key, 0) + t.get("count", 0)
+    return [{"device_id": d, "tag_id": tag_id, "ts": ts, "count": c} for (d, tag_id, ts), c in counts.items()]
+
+
+def _tag_counts_upsert():
+    stmt = pg_insert(TagCounts.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["device_id", "tag_id", "ts"],
+        set_={"count": stmt.excluded["count"]},
+    )
+
+
+def _resolve_tag_ids(db, names: List[str]) -> Dict[str, int]:
+    tag_ids = dict(_TAG_IDS)
+    if names:
+        db.execute(pg_insert(Tags.__table__).on_conflict_do_nothing(index_elements=["name"]),
+                   [{"name": n} for n in names])
+        tag_ids.update(db.execute(select(Tags.name, Tags.id).where(Tags.name.in_(names))).tuples().all())
+    return tag_ids
+
+
+def _aggregation_rows(results: Dict[str, Dict]) -> int:
+    return sum(bool(r.get("tags")) + len(r.get("top_tracks") or []) + bool(r.get("zones")) for r in results.values())
+
+
+# Writes the aggregate_tracks results of any number of devices in one transaction.
+# `results` maps device_id -> {"tags": ..., "top_tracks": [...], "zones": ...} as returned
+# by aggregate_tracks. Every table gets a single multi-row statement (top_tracks a DELETE
+# plus one), so the round trips stay constant no matter how many devices or rows there are.
+# Tag counts go to tags_series as JSON and to tag_counts in long format, new tag names cost
+# two more statements the first time they are seen.
+@instrumented(rows=lambda args, result: _aggregation_rows(args[0]))
+def store_aggregation_results(results: Dict[str, Dict]):
+    if not results:
+        logger.warning("store_aggregation_results called with no results.")
+        return
+
+    tags_rows = [r["tags"] for r in results.values() if r.get("tags")]
+    track_rows = [t for r in results.values() for t in r.get("top_tracks") or []]
+    zone_rows = [
+        {"device_id": device_id, "zones": r["zones"]["zones"], "timestamp": r["zones"]["timestamp"]}
+        for device_id, r in results.items() if r.get("zones")
+    ]
+
+    with SessionLocal() as db:
+        try:
+            tag_ids = {}
+            if tags_rows:
+                db.execute(pg_insert(TagsSeries.__table__), tags_rows)
+                tag_ids = _resolve_tag_ids(db, _missing_tag_names(tags_rows))
+                tag_counts_rows = _tag_counts_rows(tags_rows, tag_ids)
+                if tag_counts_rows:
+                    db.execute(_tag_counts_upsert(), tag_counts_rows)
+
+            # top_tracks holds the latest window only, devices with an empty window are cleared as well
+            db.execute(delete(TopTracks).where(TopTracks.device_id.in_(list(results))))
+            if track_rows:
+                stmt = pg_insert(TopTracks.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={c.name: stmt.excluded[c.name] for c in TopTracks.__table__.columns if c.name != "id"},
+                )
+                db.execute(stmt, track_rows)
+
+            if zone_rows:
+                stmt = pg_insert(Zones.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["device_id"],
+                    set_={"zones": stmt.excluded.zones, "timestamp": stmt.excluded.timestamp},
+                )
+                db.execute(stmt, zone_rows)
+
+            db.execute(text(NOTIFY_SQL), {"channel": AGGREGATES_CHANNEL, "topic": "aggregation"})
+            db.commit()
+            _TAG_IDS.update(tag_ids)
+            logger.info(f"Stored aggregation results for {len(results)} devices "
+                        f"({len(tags_rows)} tag series, {len(track_rows)} top tracks, {len(zone_rows)} zones).")
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Failed to store aggregation results: {e}", exc_info=True)
+            raise
+
+
+# (device_id, window_start) of the backfill windows already stored between start and end
+def get_completed_windows(device_ids: List[str], start: datetime, end: datetime) -> set:
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(BackfillWindows.device_id, BackfillWindows.window_start).where(
+                BackfillWindows.device_id.in_(device_ids),
+                BackfillWindows.window_start >= start,
+                BackfillWindows.window_end <= end,
+            )
+        ).tuples().all()
+    return {(device_id, window_start) for device_id, window_start in rows}
+
+
+# Writes the aggregate_tracks result of one historical window and checkpoints it in
+# backfill_windows, in one transaction: a window is either stored and checkpointed or
+# not at all, and running it again replaces its tags_series row instead of adding one.
+# top_tracks and zones only hold a device's latest window, they are written when the
+# window is newer than the stored zones so a backfill never overwrites live results.
+@instrumented(rows=lambda args, result: _aggregation_rows({args[0]: args[3]}))
+def store_backfill_window(device_id: str, window_start: datetime, window_end: datetime, result: Dict, tracks: int):
+    tags_row = result.get("tags")
+    track_rows = result.get("top_tracks") or []
+    zones = result.get("zones")
+
+    with SessionLocal() as db:
+        try:
+            tag_ids = {}
+            db.execute(delete(TagsSeries).where(TagsSeries.device_id == device_id,
+                                                TagsSeries.timestamp == window_end))
+            if tags_row:
+                db.execute(pg_insert(TagsSeries.__table__), [tags_row])
+                tag_ids = _resolve_tag_ids(db, _missing_tag_names([tags_row]))
+                tag_counts_rows = _tag_counts_rows([tags_row], tag_ids)
+                if tag_counts_rows:
+                    db.execute(_tag_counts_upsert(), tag_counts_rows)
+
+            if zones:
+                stmt = pg_insert(Zones.__table__).values(
+                    device_id=device_id, zones=zones["zones"], timestamp=zones["timestamp"])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["device_id"],
+                    set_={"zones": stmt.excluded.zones, "timestamp": stmt.excluded.timestamp},
+                    where=Zones.timestamp.is_(None) | (Zones.timestamp < stmt.excluded.timestamp),
+                ).returning(Zones.device_id)
+                if db.execute(stmt).first() is not None:
+                    db.execute(delete(TopTracks).where(TopTracks.device_id == device_id))
+                    if track_rows:
+                        stmt = pg_insert(TopTracks.__table__)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=["id"],
+                            set_={c.name: stmt.excluded[c.name] for c in TopTracks.__table__.columns if c.name != "id"},
+                        )
+                        db.execute(stmt, track_rows)
+
+            stmt = pg_insert(BackfillWindows.__table__).values(
+                device_id=device_id, window_start=window_start, window_end=window_end, tracks=tracks)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["device_id", "window_start", "window_end"],
+                set_={"tracks": stmt.excluded.tracks, "completed_at": text("now()")},
+            ))
+            db.execute(text(NOTIFY_SQL), {"channel": AGGREGATES_CHANNEL, "topic": "aggregation"})
+            db.commit()
+            _TAG_IDS.update(tag_ids)
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Failed to store backfill window {device_id} {window_start.isoformat()}: {e}", exc_info=True)
+            raise
+
+
+@instrumented()
 def store_detection_activity_bulk(data_list: List[Dict]):
     if not data_list:
         logger.warning("store_detection_activity_bulk called with empty data.")
@@ -112,3 +315,249 @@ def store_detection_activity_bulk(data_list: List[Dict]):
             db.rollback()
             logger.error(f"Failed bulk insert of detection activity: {e}", exc_info=True)
             raise
+
+
+# COPY based bulk writer
+#
+# Rows are streamed to Postgres with COPY ... FROM STDIN instead of going through the ORM.
+# `columns` pairs every column name with its Postgres type, the type is needed to encode
+# the binary format and is ignored by the text format. For the binary format the types
+# are checked against the catalog once per table and process, so a column still on an
+# older type (event_count as SMALLINT before migrations/004_event_count_integer.sql) is
+# encoded as what the table has. Restart the writers after altering a column.
+
+DETECTION_EVENTS_COLUMNS = [
+    ("timestamp", "timestamptz"),
+    ("source_id", "text"),
+    ("source_name", "text"),
+    ("tag", "text"),
+    ("event_count", "int4"),
+]
+
+EVENTS_COLUMNS = [
+    ("id", "text"),
+    ("event_producer_id", "text"),
+    ("type", "text"),
+    ("sub_type", "text"),
+    ("start_time", "timestamptz"),
+    ("end_time", "timestamptz"),
+    ("draft", "bool"),
+    ("priority", "text"),
+    ("metadata", "jsonb"),
+]
+
+_PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _text_value(value, pg_type: str) -> str:
+    if value is None:
+        return "\\N"
+    if pg_type == "timestamptz":
+        value = _as_datetime(value).isoformat()
+    elif pg_type == "jsonb":
+        value = json.dumps(value)
+    elif pg_type == "bool":
+        value = "t" if value else "f"
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def _binary_value(value, pg_type: str) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    if pg_type == "timestamptz":
+        delta = _as_datetime(value) - _PG_EPOCH
+        data = struct.pack("!q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+    elif pg_type == "int2":
+        data = struct.pack("!h", value)
+    elif pg_type == "int4":
+        data = struct.pack("!i", value)
+    elif pg_type == "int8":
+        data = struct.pack("!q", value)
+    elif pg_type == "float8":
+        data = struct.pack("!d", value)
+    elif pg_type == "bool":
+        data = b"\x01" if value else b"\x00"
+    elif pg_type == "jsonb":
+        data = b"\x01" + json.dumps(value).encode("utf-8")
+    else:
+        data = str(value).encode("utf-8")
+    return struct.pack("!i", len(data)) + data
+
+
+def _encode_rows(rows: Iterable[Sequence], columns: List[Tuple[str, str]], fmt: str) -> Iterator[bytes]:
+    types = [pg_type for _, pg_type in columns]
+    if fmt == "binary":
+        yield b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+        field_count = struct.pack("!h", len(types))
+        for row in rows:
+            yield field_count + b"".join(_binary_value(v, t) for v, t in zip(row, types))
+        yield struct.pack("!h", -1)
+    else:
+        for row in rows:
+            yield ("\t".join(_text_value(v, t) for v, t in zip(row, types)) + "\n").encode("utf-8")
+
+
+# File-like adapter so copy_expert can pull encoded rows from a generator
+class _IterStream(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+# table -> {column name: type name} as read from pg_attribute
+_COLUMN_TYPES: Dict[str, Dict[str, str]] = {}
+
+
+def _catalog_types(cursor, table: str, columns: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    if table not in _COLUMN_TYPES:
+        cursor.execute(
+            "SELECT a.attname, t.typname FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid "
+            "WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped",
+            (table,),
+        )
+        _COLUMN_TYPES[table] = dict(cursor.fetchall())
+    types = _COLUMN_TYPES[table]
+    return [(name, types.get(name, pg_type)) for name, pg_type in columns]
+
+
+def copy_rows(table: str, columns: List[Tuple[str, str]], rows: Iterable[Sequence], fmt: str = "binary") -> int:
+    if fmt not in ("text", "binary"):
+        raise ValueError(f"Unsupported COPY format: {fmt}")
+
+    counted = 0
+
+    def counting(it):
+        nonlocal counted
+        for row in it:
+            counted += 1
+            yield row
+
+    column_list = ", ".join(f'"{name}"' for name, _ in columns)
+    options = "(FORMAT binary)" if fmt == "binary" else "(FORMAT text)"
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            if fmt == "binary":
+                columns = _catalog_types(cursor, table, columns)
+            stream = io.BufferedReader(_IterStream(_encode_rows(counting(rows), columns, fmt)), buffer_size=1 << 16)
+            cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH {options}", stream)
+            cursor.execute("SELECT pg_notify(%s, %s)", (AGGREGATES_CHANNEL, table))
+        connection.commit()
+        logger.info(f"Copied {counted} rows into {table}.")
+        return counted
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"COPY into {table} failed: {e}", exc_info=True)
+        raise
+    finally:
+        connection.close()
+
+
+@instrumented()
+def copy_detection_events(rows: Iterable[Dict], fmt: str = "binary") -> int:
+    names = [name for name, _ in DETECTION_EVENTS_COLUMNS]
+    return copy_rows(
+        DetectionActivity.__tablename__,
+        DETECTION_EVENTS_COLUMNS,
+        ([row.get(name, 1 if name == "event_count" else None) for name in names] for row in rows),
+        fmt,
+    )
+
+
+@instrumented()
+def copy_events(rows: Iterable[Dict], fmt: str = "binary") -> int:
+    names = [name for name, _ in EVENTS_COLUMNS]
+    return copy_rows(
+        Events.__tablename__,
+        EVENTS_COLUMNS,
+        ([row.get("metadata_" if name == "metadata" else name) for name in names] for row in rows),
+        fmt,
+    )
+
+
+def _batches(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    it = iter(rows)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+# Multi-row INSERT ... ON CONFLICT for rows whose primary key may already exist,
+# where COPY would abort the whole stream on the first duplicate.
+@instrumented()
+def store_events_bulk(events: Iterable[Dict], batch_size: int = 1000, update: bool = False) -> int:
+    written = 0
+    with SessionLocal() as db:
+        try:
+            # executemany of a single-row statement, SQLAlchemy batches it into multi-row VALUES
+            stmt = pg_insert(Events.__table__)
+            if update:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={c: stmt.excluded[c.key] for c in Events.__table__.columns if c.name != "id"},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+            # rowcount of an executemany is not reliable, count the rows RETURNING gives back:
+            # inserted ones, and updated ones when `update` is set
+            stmt = stmt.returning(Events.__table__.c.id)
+            for batch in _batches(events, batch_size):
+                written += len(db.execute(stmt, batch).all())
+            db.commit()
+            logger.info(f"Upserted {written} events.")
+            return written
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Failed bulk upsert of events: {e}", exc_info=True)
+            raise
+
+
+# INSERT ... ON CONFLICT DO NOTHING for detection buckets stamped with a batch_seq, which
+# the write spool may replay. A replayed batch hits idx_detection_events_batch
+# (migrations/005_detection_batches.sql) instead of being counted twice. Returns the
+# number of rows inserted.
+@instrumented()
+def store_detection_events_bulk(rows: Iterable[Dict], batch_size: int = 1000) -> int:
+    names = [name for name, _ in DETECTION_EVENTS_COLUMNS] + ["batch_seq"]
+    table = DetectionActivity.__table__
+    written = 0
+    with SessionLocal() as db:
+        try:
+            stmt = pg_insert(table).on_conflict_do_nothing(
+                index_elements=["source_id", "tag", "timestamp", "batch_seq"],
+                index_where=table.c.batch_seq.isnot(None),
+            ).returning(table.c.id)
+            records = ({name: row.get(name, 1 if name == "event_count" else None) for name in names} for row in rows)
+            for batch in _batches(records, batch_size):
+                written += len(db.execute(stmt, batch).all())
+            db.execute(text(NOTIFY_SQL), {"channel": AGGREGATES_CHANNEL, "topic": table.name})
+            db.commit()
+            logger.info(f"Inserted {written} detection buckets.")
+            return written
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Failed bulk insert of detection buckets: {e}", exc_info=True)
+            raise
@@ -9,8 +9,24 @@ DB_USER = os.getenv("POSTGRES_USER", "grafana")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "grafana")
 DB_NAME = os.getenv("POSTGRES_DB", "worlds")
 DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
+DB_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:5432/{DB_NAME}"
+# Connection pool, shared by the sync engine here and the async engine in async_db.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))  # milliseconds, 0 disables
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"} if DB_STATEMENT_TIMEOUT else {},
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
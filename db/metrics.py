@@ -0,0 +1,63 @@
+import time
+import inspect
+import functools
+from typing import Callable, Optional
+from prometheus_client import Counter, Histogram
+
+# Writer metrics, labelled with the function name. The sync (crud.py) and async
+# (async_crud.py) writers of the same name share their series.
+DB_WRITE_SECONDS = Histogram(
+    "db_write_seconds", "Duration of a database writer call", ["writer"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_ROWS_WRITTEN = Counter("db_rows_written_total", "Rows written by a database writer", ["writer"])
+DB_WRITE_ERRORS = Counter("db_write_errors_total", "Database writer calls that raised", ["writer"])
+
+
+def _default_rows(args, result) -> int:
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result
+    if args and hasattr(args[0], "__len__"):
+        return len(args[0])
+    return 0
+
+
+# Times a writer and counts its rows and errors. `rows(args, result)` tells how many rows
+# a call wrote, by default the int it returned or the length of its first argument.
+def instrumented(rows: Optional[Callable] = None):
+    count = rows or _default_rows
+
+    def decorate(fn):
+        name = fn.__name__
+        seconds = DB_WRITE_SECONDS.labels(name)
+        written = DB_ROWS_WRITTEN.labels(name)
+        errors = DB_WRITE_ERRORS.labels(name)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    seconds.observe(time.perf_counter() - started)
+                written.inc(count(args, result))
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    seconds.observe(time.perf_counter() - started)
+                written.inc(count(args, result))
+                return result
+        return wrapper
+    return decorate
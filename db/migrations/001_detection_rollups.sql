@@ -0,0 +1,70 @@
+-- Continuous aggregates of detection_events per (source_id, tag).
+--
+-- detection_events_1m is built from the raw rows, detection_events_1h from the 1 minute
+-- rollup and detection_events_1d from the 1 hour rollup, so each refresh only reads the
+-- level below it. Refresh windows stay inside the retention of the level they read from,
+-- otherwise a refresh would wipe buckets whose source rows were already dropped.
+-- Retention here must match ROLLUPS in db/rollups.py.
+--
+-- Safe to run more than once: psql -f db/migrations/001_detection_rollups.sql
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS detection_events_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 minute', timestamp) AS bucket,
+       source_id,
+       tag,
+       max(source_name) AS source_name,
+       sum(event_count)::BIGINT AS event_count
+FROM detection_events
+GROUP BY bucket, source_id, tag
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS detection_events_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+       source_id,
+       tag,
+       max(source_name) AS source_name,
+       sum(event_count)::BIGINT AS event_count
+FROM detection_events_1m
+GROUP BY 1, source_id, tag
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS detection_events_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+       source_id,
+       tag,
+       max(source_name) AS source_name,
+       sum(event_count)::BIGINT AS event_count
+FROM detection_events_1h
+GROUP BY 1, source_id, tag
+WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS idx_detection_events_1m_source ON detection_events_1m (source_id, bucket DESC);
+CREATE INDEX IF NOT EXISTS idx_detection_events_1h_source ON detection_events_1h (source_id, bucket DESC);
+CREATE INDEX IF NOT EXISTS idx_detection_events_1d_source ON detection_events_1d (source_id, bucket DESC);
+
+-- Raw rows are kept for 1 day, see schema.sql. The spool can deliver buckets late, so the
+-- 1 minute refresh looks back 12 hours to pick them up.
+SELECT add_continuous_aggregate_policy('detection_events_1m',
+    start_offset => INTERVAL '12 hours',
+    end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute',
+    if_not_exists => true);
+
+SELECT add_continuous_aggregate_policy('detection_events_1h',
+    start_offset => INTERVAL '2 days',
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '15 minutes',
+    if_not_exists => true);
+
+SELECT add_continuous_aggregate_policy('detection_events_1d',
+    start_offset => INTERVAL '7 days',
+    end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 hour',
+    if_not_exists => true);
+
+SELECT add_retention_policy('detection_events_1m', INTERVAL '7 days', if_not_exists => true);
+SELECT add_retention_policy('detection_events_1h', INTERVAL '90 days', if_not_exists => true);
+SELECT add_retention_policy('detection_events_1d', INTERVAL '730 days', if_not_exists => true);
@@ -0,0 +1,50 @@
+-- Normalized tag time series.
+--
+-- tags_series keeps every aggregation cycle as a JSON array, so per-tag queries unpack
+-- JSONB row by row. tag_counts stores the same counts in long format, one row per
+-- (device_id, tag_id, ts), with tag names interned in the small tags dictionary. The
+-- primary key makes "tag X on device Y over time" an index range scan. The table is a
+-- hypertable with weekly chunks and one year of retention.
+--
+-- Safe to run more than once: psql -f db/migrations/002_tag_counts.sql
+
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS tag_counts (
+    device_id TEXT NOT NULL,
+    tag_id INTEGER NOT NULL REFERENCES tags(id),
+    ts TIMESTAMPTZ NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (device_id, tag_id, ts)
+);
+
+CREATE EXTENSION IF NOT EXISTS timescaledb;
+SELECT create_hypertable('tag_counts', 'ts', chunk_time_interval => INTERVAL '7 days', if_not_exists => true);
+SELECT add_retention_policy('tag_counts', INTERVAL '365 days', if_not_exists => true);
+CREATE INDEX IF NOT EXISTS idx_tag_counts_tag_time ON tag_counts (tag_id, ts DESC);
+
+-- Backfill from the JSON rows
+INSERT INTO tags (name)
+SELECT DISTINCT COALESCE(t->>'tag', 'unknown')
+FROM tags_series s
+CROSS JOIN LATERAL jsonb_array_elements(CASE WHEN jsonb_typeof(s.tags) = 'array' THEN s.tags ELSE '[]' END) t
+ON CONFLICT (name) DO NOTHING;
+
+INSERT INTO tag_counts (device_id, tag_id, ts, count)
+SELECT s.device_id, d.id, s.timestamp, sum((t->>'count')::INTEGER)
+FROM tags_series s
+CROSS JOIN LATERAL jsonb_array_elements(CASE WHEN jsonb_typeof(s.tags) = 'array' THEN s.tags ELSE '[]' END) t
+JOIN tags d ON d.name = COALESCE(t->>'tag', 'unknown')
+WHERE s.timestamp IS NOT NULL
+GROUP BY s.device_id, d.id, s.timestamp
+ON CONFLICT DO NOTHING;
+
+-- These two indexes used to be created on tags_series by mistake, schema.sql now puts
+-- them on their own tables. Recreate them on databases initialised with the old schema.
+DROP INDEX IF EXISTS idx_tracks_device_time;
+DROP INDEX IF EXISTS idx_tracks_zones_time;
+CREATE INDEX IF NOT EXISTS idx_tracks_device_time ON top_tracks (device_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_tracks_zones_time ON zones (device_id, timestamp DESC);
@@ -0,0 +1,16 @@
+-- Checkpoints of the historical backfill (app/backfill.py).
+--
+-- One row per aggregated (device, window), written in the same transaction as the
+-- window's results, so a window is either stored and checkpointed or neither. An
+-- interrupted backfill skips the windows found here when it is started again.
+--
+-- Safe to run more than once: psql -f db/migrations/003_backfill_windows.sql
+
+CREATE TABLE IF NOT EXISTS backfill_windows (
+    device_id TEXT NOT NULL,
+    window_start TIMESTAMPTZ NOT NULL,
+    window_end TIMESTAMPTZ NOT NULL,
+    tracks INTEGER NOT NULL,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, window_start, window_end)
+);
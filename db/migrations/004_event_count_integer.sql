@@ -0,0 +1,28 @@
+-- detection_events.event_count from SMALLINT to INTEGER.
+--
+-- The spool writes one row per (source, tag, minute) bucket, whose count can go past
+-- the 32767 a SMALLINT holds. schema.sql creates the column as INTEGER, databases
+-- created before keep SMALLINT because CREATE TABLE IF NOT EXISTS leaves them alone.
+--
+-- The continuous aggregates of 001 read the column and TimescaleDB refuses to change
+-- its type under them, so on a SMALLINT database they are dropped, the column altered
+-- and 001 run again. The rollups are rebuilt from the raw rows still kept (1 day),
+-- older 1 hour and 1 day buckets are lost. On an INTEGER database nothing happens.
+--
+-- Run from psql, it uses \if and \ir: psql -f db/migrations/004_event_count_integer.sql
+-- Safe to run more than once.
+
+SELECT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'detection_events' AND column_name = 'event_count' AND data_type = 'smallint'
+) AS event_count_smallint \gset
+
+\if :event_count_smallint
+DROP MATERIALIZED VIEW IF EXISTS detection_events_1d;
+DROP MATERIALIZED VIEW IF EXISTS detection_events_1h;
+DROP MATERIALIZED VIEW IF EXISTS detection_events_1m;
+
+ALTER TABLE detection_events ALTER COLUMN event_count TYPE INTEGER;
+
+\ir 001_detection_rollups.sql
+\endif
@@ -0,0 +1,16 @@
+-- Idempotent replay of spooled detection buckets.
+--
+-- The subscription service stamps every flushed batch of buckets with a batch_seq before
+-- it goes to the write spool (app/write_spool.py), whose replay is at-least-once. The
+-- unique index over (source_id, tag, timestamp, batch_seq) lets the spool writer insert
+-- with ON CONFLICT DO NOTHING, so a batch replayed after a crash between its commit and
+-- the spool checkpoint is not counted twice. Rows written without a batch_seq (direct
+-- COPY, rows from before this migration) are left out of the index.
+--
+-- Safe to run more than once: psql -f db/migrations/005_detection_batches.sql
+
+ALTER TABLE detection_events ADD COLUMN IF NOT EXISTS batch_seq BIGINT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_detection_events_batch
+    ON detection_events (source_id, tag, timestamp, batch_seq) NULLS NOT DISTINCT
+    WHERE batch_seq IS NOT NULL;
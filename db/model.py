@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, JSON, TIMESTAMP, Float, DateTime, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, JSON, TIMESTAMP, Float, DateTime, Boolean
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -10,6 +10,19 @@ class TagsSeries(Base):
     timestamp = Column(DateTime(timezone=True))
     tags = Column(JSON)
 
+# Long-format tag counts, one row per (device, aggregation time, tag), see migrations/002_tag_counts.sql
+class Tags(Base):
+    __tablename__ = "tags"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+class TagCounts(Base):
+    __tablename__ = "tag_counts"
+    device_id = Column(String, primary_key=True)
+    tag_id = Column(Integer, primary_key=True)
+    ts = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(Integer, nullable=False)
+
 class TopTracks(Base):
     __tablename__ = "top_tracks"
     id = Column(String, primary_key=True)
@@ -28,6 +41,15 @@ class Zones(Base):
     timestamp = Column(DateTime(timezone=True))
     zones = Column(JSON)
 
+# Completed backfill windows, see migrations/003_backfill_windows.sql
+class BackfillWindows(Base):
+    __tablename__ = "backfill_windows"
+    device_id = Column(String, primary_key=True)
+    window_start = Column(DateTime(timezone=True), primary_key=True)
+    window_end = Column(DateTime(timezone=True), primary_key=True)
+    tracks = Column(Integer, nullable=False)
+    completed_at = Column(DateTime(timezone=True))
+
 class Alerts(Base):
     __tablename__ = "alerts"
     id = Column(Integer, primary_key=True)
@@ -50,6 +72,8 @@ class DetectionActivity(Base):
     source_name = Column(String, nullable=False)
     tag = Column(String)
     event_count = Column(Integer, default=1)
+    # Flush batch of a spooled row, see migrations/005_detection_batches.sql
+    batch_seq = Column(BigInteger)
 
 class Events(Base):
     __tablename__ = "events"
@@ -0,0 +1,74 @@
+import os
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from .db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Raw detection_events rows are already pre-aggregated by the subscription service
+DETECTION_BUCKET_SECONDS = int(os.getenv("DETECTION_BUCKET_SECONDS", "30"))
+
+
+@dataclass(frozen=True)
+class Rollup:
+    table: str
+    time_column: str
+    bucket: timedelta
+    retention: Optional[timedelta]  # None keeps everything
+
+
+# Finest to coarsest, retention mirrors schema.sql and migrations/001_detection_rollups.sql
+ROLLUPS = [
+    Rollup("detection_events", "timestamp", timedelta(seconds=DETECTION_BUCKET_SECONDS), timedelta(days=1)),
+    Rollup("detection_events_1m", "bucket", timedelta(minutes=1), timedelta(days=7)),
+    Rollup("detection_events_1h", "bucket", timedelta(hours=1), timedelta(days=90)),
+    Rollup("detection_events_1d", "bucket", timedelta(days=1), timedelta(days=730)),
+]
+
+
+# The coarsest rollup whose buckets still divide `step` and that still holds data at `start`.
+# When no table with a fine enough bucket reaches back to `start`, the finest one that does
+# is used and the effective step becomes its bucket size.
+def pick_rollup(start: datetime, step: timedelta, now: Optional[datetime] = None) -> Rollup:
+    now = now or datetime.now(timezone.utc)
+    covering = [r for r in ROLLUPS if r.retention is None or start >= now - r.retention] or ROLLUPS[-1:]
+    fitting = [r for r in covering if r.bucket <= step and step % r.bucket == timedelta(0)]
+    return fitting[-1] if fitting else covering[0]
+
+
+def detection_counts_query(start: datetime, end: datetime, step: timedelta, source_id: Optional[str] = None,
+                           tag: Optional[str] = None, now: Optional[datetime] = None):
+    rollup = pick_rollup(start, step, now)
+    step = max(step, rollup.bucket)
+    column = rollup.time_column
+
+    filters = [f'"{column}" >= :start', f'"{column}" < :end']
+    params = {"start": start, "end": end, "step": step}
+    if source_id is not None:
+        filters.append("source_id = :source_id")
+        params["source_id"] = source_id
+    if tag is not None:
+        filters.append("tag = :tag")
+        params["tag"] = tag
+
+    # date_bin instead of time_bucket so the raw table can be queried on plain Postgres too
+    sql = (
+        f"SELECT date_bin(:step, \"{column}\", TIMESTAMPTZ '2000-01-01') AS time, source_id, tag, "
+        f"sum(event_count)::BIGINT AS event_count "
+        f"FROM {rollup.table} WHERE {' AND '.join(filters)} "
+        f"GROUP BY 1, source_id, tag ORDER BY 1"
+    )
+    return rollup, text(sql), params
+
+
+def get_detection_counts(start: datetime, end: datetime, step: timedelta, source_id: Optional[str] = None,
+                         tag: Optional[str] = None) -> List[Dict]:
+    rollup, query, params = detection_counts_query(start, end, step, source_id, tag)
+    with SessionLocal() as db:
+        rows = db.execute(query, params).mappings().all()
+    logger.info(f"Read {len(rows)} detection count rows from {rollup.table} "
+                f"({start.isoformat()} - {end.isoformat()}, step {params['step']}).")
+    return [dict(row) for row in rows]
@@ -17,14 +17,14 @@ CREATE TABLE IF NOT EXISTS top_tracks (
     thumbnail_url TEXT,
     zones JSONB
 );
-CREATE INDEX IF NOT EXISTS idx_tracks_device_time ON tags_series(device_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_tracks_device_time ON top_tracks(device_id, timestamp DESC);
 
 CREATE TABLE IF NOT EXISTS zones (
     device_id TEXT PRIMARY KEY,
     timestamp TIMESTAMPTZ DEFAULT now(),
     zones JSONB
 );
-CREATE INDEX IF NOT EXISTS idx_tracks_zones_time ON tags_series(device_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_tracks_zones_time ON zones(device_id, timestamp DESC);
 
 CREATE TABLE IF NOT EXISTS devices (
     id TEXT PRIMARY KEY,
@@ -50,9 +50,15 @@ CREATE TABLE detection_events (
     source_id           TEXT        NOT NULL,
     source_name         TEXT        NOT NULL,
     tag                 TEXT,
-    event_count         SMALLINT    DEFAULT 1
+    event_count         INTEGER     DEFAULT 1,
+    batch_seq           BIGINT
 );
 CREATE EXTENSION IF NOT EXISTS timescaledb;
 SELECT create_hypertable('detection_events', 'timestamp');
 CREATE INDEX idx_source_id_time ON detection_events (source_id, timestamp DESC);
-SELECT add_retention_policy('detection_events', INTERVAL '1 days');
\ No newline at end of file
+SELECT add_retention_policy('detection_events', INTERVAL '1 days');
+-- 1 minute / 1 hour / 1 day rollups with longer retention: migrations/001_detection_rollups.sql
+-- Normalized per-tag counts (tags, tag_counts): migrations/002_tag_counts.sql
+-- Backfill checkpoints (backfill_windows): migrations/003_backfill_windows.sql
+-- event_count to INTEGER on databases created with SMALLINT: migrations/004_event_count_integer.sql
+-- Idempotency key of spooled detection batches (batch_seq): migrations/005_detection_batches.sql